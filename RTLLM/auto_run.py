@@ -1,144 +1,202 @@
-import os
-import time
-import tqdm
-from scipy.special import comb
-import json
-#import threading
-from threading import Thread
-
-
-def exec_shell(cmd_str, timeout=8):
-    def run_shell_func(sh):
-        os.system(sh)
-    start_time = time.time()
-    t = Thread(target=run_shell_func, args=(cmd_str,), daemon=False)
-    t.start()
-    while 1:
-        now = time.time()
-        if now - start_time >= timeout:
-            if not t.is_alive():
-                return 1
-            else:
-                return 0
-        if not t.is_alive():
-            return 1
-        time.sleep(1)
-
-
-def cal_atk(dic_list, n, k):
-    #syntax 
-    sum_list = []
-    for design in dic_list.keys():
-        c = dic_list[design]['syntax_success']
-        sum_list.append(1 - comb(n - c, k) / comb(n, k))
-    sum_list.append(0)
-    syntax_passk = sum(sum_list) / len(sum_list)
-    
-    #func
-    sum_list = []
-    for design in dic_list.keys():
-        c = dic_list[design]['func_success']
-        sum_list.append(1 - comb(n - c, k) / comb(n, k))
-    sum_list.append(0)
-    func_passk = sum(sum_list) / len(sum_list)
-    print(f'syntax pass@{k}: {syntax_passk},   func pass@{k}: {func_passk}')
-
-
-
-progress_bar = tqdm.tqdm(total=290)
-# design_name = ['adder_8bit', 'adder_16bit', 'adder_32bit', 'adder_pipe_64bit', 'adder_bcd', 'sub_64bit', 'multi_8bit', 'multi_16bit', 'multi_booth_8bit', 'multi_pipe_4bit', 
-#                'multi_pipe_8bit', 'div_16bit', 'radix2_div', 'comparator_3bit', 'comparator_4bit', 'accu', 'fixed_point_adder', 'fixed_point_substractor', 'float_multi', 'asyn_fifo', 
-#                'LIFObuffer', 'right_shifter', 'LFSR', 'barrel_shifter', 'fsm', 'sequence_detector', 'counter_12', 'JC_counter', 'ring_counter', 'up_down_counter', 
-#                'signal_generator', 'square_wave', 'clkgenerator', 'instr_reg', 'ROM', 'RAM', 'alu', 'pe', 'freq_div', 'freq_divbyeven', 
-#                'freq_divbyodd', 'freq_divfrac', 'calendar', 'traffic_light', 'width_8to16', 'synchronizer', 'edge_detect', 'pulse_detect', 'parallel2serial', 'serial2parallel']
-
-design_name = ['accu', 'adder_8bit', 'adder_16bit', 'adder_32bit', 'adder_pipe_64bit', 'asyn_fifo', 'calendar', 'counter_12', 'edge_detect',
-                'freq_div', 'fsm', 'JC_counter', 'multi_16bit', 'multi_booth_8bit', 'multi_pipe_4bit', 'multi_pipe_8bit', 'parallel2serial' , 'pe' , 'pulse_detect', 
-                'radix2_div', 'RAM', 'right_shifter',  'serial2parallel', 'signal_generator','synchronizer', 'alu', 'div_16bit', 'traffic_light', 'width_8to16']
-    
-print(len(design_name))
-with open("file_list.json", "r") as file:
-    file_list = json.load(file)
-
-full_design_name = {}
-for fold in file_list.keys():
-    for sf in file_list[fold].keys():
-        tasks = file_list[fold][sf]
-        for t in tasks:
-            fpath = f"{fold}/{sf}/{t}"
-            # all_design_name.append(fpath)
-            if t in design_name:
-                full_design_name[t] = fpath
-                # design_name.append(fpath)
-# print(f"all design name: {all_design_name}")
-# print(f"design name: {design_name}")
-
-
-
-path = "/nfs_global/S/huanglei/RTLLM_Evaluation/Original-CodeV"
-result_dic = {key: {} for key in design_name}
-for item in design_name:
-    result_dic[item]['syntax_success'] = 0
-    result_dic[item]['func_success'] = 0
-
-
-def test_one_file(testfile, result_dic):
-    for design in full_design_name.keys():
-        if os.path.exists(f"{full_design_name[design]}/makefile"):
-            print(f"test {design} in {testfile}")
-            makefile_path = os.path.join(full_design_name[design], "makefile")
-            with open(makefile_path, "r") as file:
-                makefile_content = file.read()
-                modified_makefile_content = makefile_content.replace("${TEST_DESIGN}", f"{path}/{testfile}/{design}")
-                # modified_makefile_content = makefile_content.replace(f"{path}/{design}/{design}", "${TEST_DESIGN}")
-            with open(makefile_path, "w") as file:
-                file.write(modified_makefile_content)
-            # Run 'make vcs' in the design folder
-            os.chdir(full_design_name[design])
-            os.system("make vcs")
-            simv_generated = False
-            if os.path.exists("simv"):
-                simv_generated = True
-
-
-            if simv_generated:
-                result_dic[design]['syntax_success'] += 1
-                # Run 'make sim' and check the result
-                #os.system("make sim > output.txt")
-                to_flag = exec_shell("make sim > output.txt")
-                if to_flag == 1:
-                    with open("output.txt", "r") as file:
-                        output = file.read()
-                        if "Pass" in output or "pass" in output:
-                            result_dic[design]['func_success'] += 1
-            
-            with open("makefile", "w") as file:
-                file.write(makefile_content)
-            os.system("make clean")
-            os.chdir("..")
-            progress_bar.update(1)
-
-    return result_dic
-
-file_id = 0
-n = 0
-while os.path.exists(os.path.join(path, f"test_{file_id}")):
-    # if file_id == 5:
-    #     break
-    print(f"test_{file_id}")
-    result_dic = test_one_file(f"test_{file_id}", result_dic)
-    n += 1
-    file_id += 1
-print(result_dic)
-cal_atk(result_dic, n, 1)
-total_syntax_success = 0
-total_func_success = 0
-for item in design_name:
-    if result_dic[item]['syntax_success'] != 0:
-        total_syntax_success += 1
-    if result_dic[item]['func_success'] != 0:
-        total_func_success += 1
-print(f'total_syntax_success: {total_syntax_success}/{len(design_name)}')
-print(f'total_func_success: {total_func_success}/{len(design_name)}')
-# print(f"Syntax Success: {syntax_success}/{len(design_name)}")
-# print(f"Functional Success: {func_success}/{len(design_name)}")
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import tqdm
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, os.path.join(os.path.dirname(ROOT), "verilog-eval-2", "evaluation"))
+from data import write_jsonl
+from passk import summarize
+
+design_name = ['accu', 'adder_8bit', 'adder_16bit', 'adder_32bit', 'adder_pipe_64bit', 'asyn_fifo', 'calendar', 'counter_12', 'edge_detect',
+                'freq_div', 'fsm', 'JC_counter', 'multi_16bit', 'multi_booth_8bit', 'multi_pipe_4bit', 'multi_pipe_8bit', 'parallel2serial' , 'pe' , 'pulse_detect',
+                'radix2_div', 'RAM', 'right_shifter',  'serial2parallel', 'signal_generator','synchronizer', 'alu', 'div_16bit', 'traffic_light', 'width_8to16']
+
+# Compile and simulation commands per backend, and the simulation image the
+# compile command builds. {design} is replaced by the design name; both run
+# inside the staging directory of one sample. Verilator compiles the design
+# to a native executable, which pays off for the long sequential testbenches.
+SIMULATORS = {
+    "iverilog": (["iverilog", "-g2012", "-o", "simv", "{design}.v", "testbench.v"],
+                 ["vvp", "-n", "simv"], "simv"),
+    "vcs": (["vcs", "-sverilog", "+v2k", "-timescale=1ns/1ns", "-l", "compile.log", "{design}.v", "testbench.v"],
+            ["./simv", "-l", "run.log"], "simv"),
+    "verilator": (["verilator", "--binary", "--timing", "-Wno-fatal", "-Wno-lint", "-Wno-style", "-Wno-TIMESCALEMOD",
+                   "-o", "simv", "{design}.v", "testbench.v"],
+                  ["./obj_dir/simv"], os.path.join("obj_dir", "simv")),
+}
+
+
+def find_designs(names, simulator):
+    """
+    Maps each design name to the folder holding its testbench. With the
+    iverilog backend the Change2ivl variant of a design is used if there is
+    one, since some testbenches need small changes to run on iverilog; the
+    same variants are used with Verilator.
+    Also returns the top-level category of each design.
+    """
+    with open(os.path.join(ROOT, "file_list.json"), "r") as file:
+        file_list = json.load(file)
+
+    folders = {}
+    categories = {}
+    for fold in file_list.keys():
+        for sf in file_list[fold].keys():
+            for t in file_list[fold][sf]:
+                if t in names:
+                    categories[t] = fold
+                    folders[t] = os.path.join(ROOT, fold, sf, t)
+                    ivl_folder = os.path.join(ROOT, "Change2ivl", t)
+                    if simulator in ("iverilog", "verilator") and os.path.isdir(ivl_folder):
+                        folders[t] = ivl_folder
+    return folders, categories
+
+
+def run_command(argv, cwd, timeout):
+    """
+    Runs argv in its own process group and returns (returncode, output), or
+    None if it did not finish within timeout seconds, in which case the
+    whole group is killed.
+    """
+    p = subprocess.Popen(argv, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                         start_new_session=True)
+    try:
+        out, _ = p.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(p.pid, signal.SIGKILL)
+        p.communicate()
+        return None
+    except BaseException:
+        os.killpg(p.pid, signal.SIGKILL)
+        raise
+    return p.returncode, out.decode("utf-8", errors="replace")
+
+
+def test_one_sample(design, folder, sample_idx, sample_file, simulator, compile_timeout, timeout):
+    """
+    Compiles and simulates one generated design in a private copy of its
+    design folder, so that any number of samples and runs can share the
+    folder. Returns a result row for the results file.
+    """
+    start = time.perf_counter()
+    result = dict(design=design, sample=sample_idx, syntax=False, func=False)
+    staging = tempfile.mkdtemp(prefix=f"rtllm-{design}-")
+    try:
+        for name in os.listdir(folder):
+            # The reference design is never compiled; leave it behind.
+            if not name.startswith("verified_") and os.path.isfile(os.path.join(folder, name)):
+                shutil.copy(os.path.join(folder, name), staging)
+        if not os.path.exists(sample_file):
+            result["result"] = "missing sample"
+            return result
+        shutil.copy(sample_file, os.path.join(staging, f"{design}.v"))
+
+        compile_cmd, sim_cmd, image = SIMULATORS[simulator]
+        output = run_command([arg.format(design=design) for arg in compile_cmd], staging, compile_timeout)
+        if output is None:
+            result["result"] = "compile timed out"
+            return result
+        if output[0] != 0 or not os.path.exists(os.path.join(staging, image)):
+            result["result"] = "syntax error"
+            result["log"] = output[1][-2000:]
+            return result
+        result["syntax"] = True
+
+        output = run_command(sim_cmd, staging, timeout)
+        if output is None:
+            result["result"] = "timed out"
+            return result
+        result["func"] = "Pass" in output[1] or "pass" in output[1]
+        result["result"] = "passed" if result["func"] else "failed"
+        if not result["func"]:
+            result["log"] = output[1][-2000:]
+        return result
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+        result["elapsed"] = time.perf_counter() - start
+
+
+def evaluate(path, out_file=None, simulator="iverilog", n_workers=16, compile_timeout=60.0, timeout=8.0,
+             ks=(1, 5)):
+    """
+    Evaluates the samples in path/test_<i>/<design>.v for every design in
+    design_name and writes one result row per (design, sample) plus a
+    summary with syntax and functional pass@k, overall and per category.
+    """
+    folders, categories = find_designs(design_name, simulator)
+    n = 0
+    while os.path.exists(os.path.join(path, f"test_{n}")):
+        n += 1
+    print(f"{len(folders)} designs, {n} samples per design")
+
+    result_dic = {design: dict(syntax_success=0, func_success=0) for design in folders}
+    rows = []
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(test_one_sample, design, folder, i,
+                                   os.path.join(path, f"test_{i}", f"{design}.v"),
+                                   simulator, compile_timeout, timeout)
+                   for i in range(n) for design, folder in folders.items()]
+        for future in tqdm.tqdm(as_completed(futures), total=len(futures)):
+            row = future.result()
+            rows.append(row)
+            result_dic[row["design"]]["syntax_success"] += row["syntax"]
+            result_dic[row["design"]]["func_success"] += row["func"]
+
+    summary = dict(simulator=simulator, n=n, designs=result_dic)
+    design_categories = [categories[design] for design in result_dic]
+    syntax = summarize(n, [r["syntax_success"] for r in result_dic.values()], ks, design_categories,
+                       ci="bootstrap", prefix="syntax_")
+    func = summarize(n, [r["func_success"] for r in result_dic.values()], ks, design_categories,
+                     ci="bootstrap", prefix="func_")
+    by_category = {category: dict(syntax["by_category"][category], **func["by_category"][category])
+                   for category in syntax.get("by_category", {})}
+    summary.update({key: value for key, value in syntax.items() if key != "by_category"})
+    summary.update({key: value for key, value in func.items() if key != "by_category"})
+    summary["by_category"] = by_category
+    for k in ks:
+        if f"syntax_pass@{k}" in summary:
+            print(f'syntax pass@{k}: {summary[f"syntax_pass@{k}"]},   func pass@{k}: {summary[f"func_pass@{k}"]}')
+    for category, values in by_category.items():
+        print(f"  {category}: " + ", ".join(f"{key} {value:.4f}" for key, value in values.items()
+                                             if not key.endswith("_ci")))
+    summary["total_syntax_success"] = sum(r["syntax_success"] > 0 for r in result_dic.values())
+    summary["total_func_success"] = sum(r["func_success"] > 0 for r in result_dic.values())
+    print(f'total_syntax_success: {summary["total_syntax_success"]}/{len(result_dic)}')
+    print(f'total_func_success: {summary["total_func_success"]}/{len(result_dic)}')
+
+    # Write to a private file first, so concurrent runs never see a partial file.
+    out_file = out_file or os.path.join(path, f"rtllm_results_{simulator}.jsonl")
+    rows.sort(key=lambda row: (row["design"], row["sample"]))
+    fd, tmp_file = tempfile.mkstemp(suffix=os.path.splitext(out_file)[1],
+                                    dir=os.path.dirname(os.path.abspath(out_file)))
+    os.close(fd)
+    write_jsonl(tmp_file, [dict(summary=summary), *rows])
+    os.replace(tmp_file, out_file)
+    print(f"Results written to {out_file}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate generated RTLLM designs in parallel")
+    parser.add_argument("--path", default="/nfs_global/S/huanglei/RTLLM_Evaluation/Original-CodeV",
+                        help="folder holding test_0, test_1, ... with one <design>.v per design")
+    parser.add_argument("--out", default=None, help="results file, default <path>/rtllm_results_<simulator>.jsonl")
+    parser.add_argument("--simulator", default="iverilog", choices=sorted(SIMULATORS))
+    parser.add_argument("--n_workers", type=int, default=16)
+    parser.add_argument("--compile_timeout", type=float, default=60.0)
+    parser.add_argument("--timeout", type=float, default=8.0)
+    parser.add_argument("--k", default="1,5", help="comma-separated k values of pass@k")
+    args = parser.parse_args()
+
+    evaluate(args.path, args.out, args.simulator, args.n_workers, args.compile_timeout, args.timeout,
+             tuple(map(int, args.k.split(","))))
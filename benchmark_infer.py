@@ -1,19 +1,33 @@
 
 import json
 import re
-from vllm import LLM, SamplingParams
 from functools import partial
 import os
 import argparse
 import subprocess
 import shutil
-import math
+import numpy as np
 import warnings
+import itertools
+import dataclasses
+import zlib
+import queue
+import threading
 from transformers import AutoModelForCausalLM, AutoTokenizer
-from execution import check_correctness
 from collections import defaultdict
 import sys
 
+from generation_backends import BACKENDS, SamplingParams, make_backend
+from generation_cache import CachedBackend, GenerationCache, model_fingerprint
+from verilog_extract import code_results, code_results_batch, extract_code
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "verilog-eval-2", "evaluation"))
+from data import JsonlWriter, stream_jsonl, write_jsonl
+from execution import check_correctness
+from evaluation import evaluate_functional_correctness
+from passk import pass_at_k
+from results_store import ResultStore
+
 def calculate_task_pass_at_k(input_file_path, k=5):
     """
     计算JSONL文件中每个任务的pass@k
@@ -59,35 +73,22 @@ def calculate_task_pass_at_k(input_file_path, k=5):
             task_results[task_id].append(is_pass)
     
     # 计算每个任务的pass@k
-    task_pass_dict = {}
     expected_trials = 20  # 每个任务预期20次结果
-    
-    for task_id, results in task_results.items():
-        m = len(results)  # 该任务实际的尝试次数
-        s = sum(results)  # 该任务的通过次数
-        
-        # 校验尝试次数是否为20次（给出警告）
+    task_ids = list(task_results)
+    total = np.array([len(task_results[task_id]) for task_id in task_ids])  # 每个任务实际的尝试次数
+    correct = np.array([sum(task_results[task_id]) for task_id in task_ids])  # 每个任务的通过次数
+
+    # 校验尝试次数是否为20次（给出警告）
+    for task_id, m in zip(task_ids, total):
         if m != expected_trials:
             warnings.warn(
                 f"任务{task_id}实际尝试次数为{m}（预期20次），"
                 "计算结果可能不准确，请检查数据"
             )
-        
-        # 核心逻辑计算pass@k
-        if s == 0:
-            # 无通过记录，pass@k=0
-            pass_k = 0.0
-        elif k >= m:
-            # 抽取次数≥总尝试数，必然包含通过记录，pass@k=1
-            pass_k = 1.0
-        else:
-            # 计算组合数：从失败次数中选k次的概率（全失败）
-            failed_count = m - s
-            comb_failed = math.comb(failed_count, k)  # 失败组合数
-            comb_total = math.comb(m, k)              # 总组合数
-            pass_k = 1.0 - (comb_failed / comb_total)  # 至少一次通过的概率
-        
-        task_pass_dict[task_id] = round(pass_k, 4)  # 保留4位小数
+
+    # 抽取次数≥总尝试数时，只要有通过记录pass@k即为1；无通过记录时为0
+    task_pass = np.where(correct == 0, 0.0, pass_at_k(total, correct, k)) if task_ids else []
+    task_pass_dict = {task_id: round(float(p), 4) for task_id, p in zip(task_ids, task_pass)}  # 保留4位小数
     
     # 计算所有任务的平均pass@k
     total_tasks = len(task_pass_dict)
@@ -118,77 +119,184 @@ def get_code(file_content):
     return code
 
 def get_code_wo_notes(file_content):
-    # 提取 "## Code Implementation" 后的部分
-    file_content = file_content.split("## Code Implementation")[-1]
-
-    # 提取 Verilog 代码块（```verilog ... ```) 或原始内容
-    verilog_blocks = re.findall(r"```verilog\s*(.*?)```", file_content, re.DOTALL)
-    # code = "\n".join(verilog_blocks) if verilog_blocks else file_content
-    if verilog_blocks:
-        code = verilog_blocks[-1]
-    else:
-        code = file_content
-
-    # 去除 /* 多行注释 */
-    code = re.sub(r"/\*.*?\*/", "", code, flags=re.DOTALL)
-
-    # 去除 // 单行注释（不跨行）
-    code = re.sub(r"//.*", "", code)
-
-    # 可选：去除空行和多余空格
-    code = "\n".join(line.rstrip() for line in code.splitlines() if line.strip())
-
-    return code
+    # 提取 "## Code Implementation" 后最后一个 Verilog 代码块，去除注释和空行
+    return extract_code(file_content)[0]
 
 def extract_verilog(content):
-    verilog_code = get_code(content)
-    lines = verilog_code.splitlines()
-    header_lines = []
-    remaining_lines = []
-    in_module = False
-    header_complete = False
-    
-    for line in lines:
-        if not header_complete:
-            header_lines.append(line)
-            if not in_module and line.strip().startswith('module'):
-                in_module = True
-            if in_module and line.strip().endswith(');'):
-                header_complete = True
-        else:
-            remaining_lines.append(line)
-    
-    header = '\n'.join(header_lines)
-    remaining = '\n'.join(remaining_lines)
+    # 单次扫描：提取代码（去除注释）并拆分为模块头和其余部分
+    _, header, remaining = extract_code(content)
     return header, remaining
 
+def fill_record_v1(record, code_results):
+    record["completion"] = code_results['code_body']
+    record["full_code"] = code_results['full_code']
+    record["code_header"] = code_results['code_header']
+    record["redes"] = code_results['direct_output']
+    record["maintain"] = record["description"] in record["redes"]
+    return record
+
+def fill_record_v2(record, code_results, task):
+    if task=='spec-to-rtl':
+        record["interface"] = code_results['code_header']
+        record["completion"] = code_results['full_code']
+    else:
+        record["completion"] = code_results['code_body']
+    record["full_code"] = code_results['full_code']
+    record["code_header"] = code_results['code_header']
+    record["redes"] = code_results['direct_output']
+    record["maintain"] = record["description"] in record["redes"]
+    return record
+
 def parse_out(text, mode="high"):
-    pattern = r"\{'pass@1': ([\d.]+), 'pass@5': ([\d.]+), 'pass@10': ([\d.]+)\}"
-    if mode=='low':
-        pattern = r"\{'pass@1': ([\d.]+)\}"
+    # Accepts plain floats as well as numpy 2 reprs such as np.float64(0.5).
+    pattern = r"'pass@(\d+)': (?:np\.float64\()?([\d.eE+-]+)\)?"
     if not isinstance(text, str):
         text = str(text)
-    match = re.search(pattern, text)
-
-    if match:
-        if mode == 'low':
-            pass_at_1 = float(match.group(1))
-            return {'pass@1': pass_at_1}
-        pass_at_1 = float(match.group(1))
-        pass_at_5 = float(match.group(2))
-        pass_at_10 = float(match.group(3))
-        return {'pass@1': pass_at_1, 'pass@5': pass_at_5, 'pass@10': pass_at_10}
+    pass_rate = {f"pass@{k}": float(v) for k, v in re.findall(pattern, text)}
+    if mode == 'low':
+        pass_rate = {k: v for k, v in pass_rate.items() if k == 'pass@1'}
+
+    if pass_rate:
+        return pass_rate
     else:
         print("未找到 pass 数据。")
         return text
     
 
+def per_prompt(value, n):
+    """
+    Returns value as a list with one entry per prompt: lists are kept,
+    anything else is repeated n times.
+    """
+    return list(value) if isinstance(value, (list, tuple)) else [value] * n
+
+
+class GenerationJob:
+    """
+    The generation requests of one benchmark run and the consumer of their
+    outputs. Every prompt is sampled response_batch times with
+    sampling_params. add(idx, i, code_results) receives sample i of prompt
+    idx, finish() is called as soon as every sample has been added and must
+    not block, close() once generation is over, and abort() if generation
+    fails before every sample has been added. Jobs that evaluate their
+    samples while they are generated have start, which is called as
+    start(n_workers) with their share of the evaluation workers before
+    generation begins.
+    """
+
+    def __init__(self, name, prompts, sampling_params, response_batch, add, close=None, abort=None, start=None,
+                 finish=None):
+        self.name = name
+        self.prompts = prompts
+        self.sampling_params = sampling_params
+        self.response_batch = response_batch
+        self.add = add
+        self.close = close or (lambda: None)
+        self.abort = abort or (lambda: None)
+        self.start = start
+        self.finish = finish or (lambda: None)
+        self.remaining = len(prompts) * response_batch
+
+
+class StreamingEvaluation:
+    """
+    Overlaps generation and simulation: every record passed to put() is
+    appended to outfile and queued for evaluate, which start(n_workers)
+    runs in a background thread as evaluate(outfile, samples, n_workers)
+    with samples being the queued records. finish() ends the samples
+    without waiting for evaluate, and close() returns whatever evaluate
+    returns once it is done.
+    """
+
+    def __init__(self, outfile, evaluate):
+        self.outfile = outfile
+        self.evaluate = evaluate
+        self.samples = queue.Queue()
+        self.evaluation = {}
+        self.file = JsonlWriter(outfile, append=True)
+        self.worker = None
+        self.finished = False
+
+    def start(self, n_workers):
+        self.worker = threading.Thread(target=self.run_evaluation, args=(n_workers,))
+        self.worker.start()
+
+    def queued_samples(self):
+        while True:
+            sample = self.samples.get()
+            if sample is None:
+                return
+            yield sample
+
+    def run_evaluation(self, n_workers):
+        try:
+            self.evaluation["pass_rate"] = self.evaluate(self.outfile, self.queued_samples(), n_workers)
+        except BaseException as e:
+            self.evaluation["error"] = e
+
+    def put(self, record):
+        self.file.write(record)
+        self.file.flush()
+        self.samples.put(record)
+
+    def finish(self):
+        if not self.finished:
+            self.finished = True
+            self.samples.put(None)
+
+    def abort(self):
+        self.finish()
+        if self.worker is not None:
+            self.worker.join()
+        self.file.close()
+
+    def close(self):
+        self.abort()
+        if "error" in self.evaluation:
+            raise self.evaluation["error"]
+        return self.evaluation["pass_rate"]
+
+
 class VerilogGenBenchmark:
-    def __init__(self, model_path, use_template=True):
+    def __init__(self, model_path, use_template=True, stream=False, n_way=True, seed=None, prefix_caching=True,
+                 backend="vllm", generation_cache=None, rebuild=False, results_db=None, eval_workers=32,
+                 **backend_options):
+        """
+        backend is a GenerationBackend or the name of one, which is then
+        created by make_backend with model_path, prefix_caching and
+        backend_options (e.g. api_base for the openai backend).
+
+        With generation_cache set to a directory, generated texts are cached
+        there and reruns only generate what is not cached. With rebuild set,
+        no backend is created at all and every output is rebuilt from the
+        cache, e.g. to rerun post-processing and evaluation.
+
+        With results_db set to a file, the results of every VerilogEval run
+        are ingested into that results store once they are scored (see
+        results_store.ResultStore).
+
+        With stream set, eval_workers simulation workers are shared by all
+        the VerilogEval runs that are evaluated while generation goes on.
+        """
         self.use_template = use_template
         self.model_path = model_path
-        self.llm = LLM(model=model_path) #, tensor_parallel_size=8)
-
+        self.model_name = os.path.basename(os.path.normpath(model_path))
+        self.stream = stream
+        # With n_way set, each prompt is one request that draws all of its
+        # samples (n=response_batch), so the prompt is prefilled once.
+        self.n_way = n_way
+        self.seed = seed
+        self.results_db = results_db
+        self.eval_workers = eval_workers
+        if rebuild:
+            if generation_cache is None:
+                raise ValueError("rebuild needs a generation_cache to rebuild from.")
+            backend = None
+        elif isinstance(backend, str):
+            backend = make_backend(backend, model_path, prefix_caching=prefix_caching, **backend_options)
+        if generation_cache is not None:
+            backend = CachedBackend(GenerationCache(generation_cache), model_fingerprint(model_path), backend)
+        self.backend = backend
     
     def sampling_parameters(self, temperature, top_p=None):
         if top_p:
@@ -202,57 +310,193 @@ class VerilogGenBenchmark:
             sampling_params = SamplingParams(temperature=temperature, max_tokens=4096)
         return sampling_params
 
-    
-    def get_response(self, Prompts, sampling_params, response_batch=20):
-        all_conversations = []
-        for prompt in Prompts:
-            if self.use_template:
-                sys_prompt = "You are a helpful assistant."
-                full_prompt = [
-                    {
-                        "role": "system",
-                        "content": sys_prompt
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ]
+    def request_seed(self, *key):
+        """
+        The seed of the request identified by key, e.g. (job name, prompt
+        index), derived from self.seed so that it does not depend on which
+        other requests share the batch. None if no seed is set.
+        """
+        if self.seed is None:
+            return None
+        return zlib.crc32(repr((self.seed,) + key).encode("utf-8")) & 0x7fffffff
+
+    def request_params(self, sampling_params, n, seed):
+        """
+        Returns sampling_params drawing n samples with the given seed, or
+        sampling_params itself if it already does.
+        """
+        if sampling_params.n == n and sampling_params.seed == seed:
+            return sampling_params
+        return dataclasses.replace(sampling_params, n=n, seed=seed)
+
+    def make_requests(self, Prompts, sampling_params, response_batch, seeds=None):
+        """
+        Yields (prompt index, first sample index, sampling params) for every
+        request needed to sample each prompt response_batch times: one
+        request with n=response_batch per prompt in n-way mode, else one
+        request per sample. seeds holds one base seed per prompt, or None.
+        """
+        sampling_params = per_prompt(sampling_params, len(Prompts))
+        response_batch = per_prompt(response_batch, len(Prompts))
+        seeds = per_prompt(seeds, len(Prompts))
+        for idx, (params, batch, seed) in enumerate(zip(sampling_params, response_batch, seeds)):
+            if batch == 0:
+                continue
+            if self.n_way:
+                yield idx, 0, self.request_params(params, batch, seed)
             else:
-                full_prompt = prompt
-            for i in range(response_batch):
-                all_conversations.append(full_prompt)
-        
-        print("="*20, f" Example of Intructions ", "="*20)
-        print(len(all_conversations), all_conversations[0])
-        print("="*50)
+                for i in range(batch):
+                    sample_seed = None if seed is None else zlib.crc32(f"{seed}/{i}".encode("utf-8")) & 0x7fffffff
+                    yield idx, i, self.request_params(params, 1, sample_seed)
+
+    
+    def make_conversation(self, prompt):
         if self.use_template:
-            original_list = self.llm.chat(messages=all_conversations,
-                        sampling_params=sampling_params,
-                        use_tqdm=True)
+            sys_prompt = "You are a helpful assistant."
+            full_prompt = [
+                {
+                    "role": "system",
+                    "content": sys_prompt
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ]
         else:
-            original_list = self.llm.generate(all_conversations,
-                        sampling_params=sampling_params,
-                        use_tqdm=True)
-        Result_dict = []
-        for idx, output in enumerate(original_list):
-            text = output.outputs[0].text
-            verilog_code = get_code_wo_notes(text)
-    
-            header, body = extract_verilog(verilog_code)
-            code_results = {
-                'full_code': verilog_code,
-                'code_header': header,
-                'code_body': body if body else verilog_code,
-                'direct_output':  text
-            }
+            full_prompt = prompt
+        return full_prompt
+
+    def postprocess(self, text):
+        return code_results(text)
+
+    def get_response(self, Prompts, sampling_params, response_batch=20, seeds=None):
+        """
+        Samples every prompt response_batch times. sampling_params,
+        response_batch and seeds apply to all prompts, or are lists with one
+        entry per prompt. Returns the code results of all samples, with the
+        samples of each prompt next to each other.
+        """
+        requests = [(self.make_conversation(Prompts[idx]), params)
+                    for idx, _, params in self.make_requests(Prompts, sampling_params, response_batch, seeds)]
 
-            # self.Whole_Record.append(code_results)
-            Result_dict.append(code_results)
+        print("="*20, f" Example of Intructions ", "="*20)
+        print(len(requests), requests[0][0])
+        print("="*50)
+        texts = [text for outputs in self.backend.generate(requests) for text in outputs]
+        Result_dict = code_results_batch(texts)
         return Result_dict
-    
 
-    def run_VerilogEval_v1(self, temperature, top_p=None, response_batch=20, GType=None, fold_idx=""):
+    def stream_response(self, Prompts, sampling_params, response_batch=20, seeds=None):
+        """
+        Same requests as get_response, but yields (prompt index, sample
+        index, code results) as soon as each request finishes, in
+        completion order.
+        """
+        routes, requests = [], []
+        for idx, first, params in self.make_requests(Prompts, sampling_params, response_batch, seeds):
+            routes.append((idx, first))
+            requests.append((self.make_conversation(Prompts[idx]), params))
+
+        for r, texts in self.backend.stream(requests):
+            idx, first = routes[r]
+            for j, text in enumerate(texts):
+                yield idx, first + j, self.postprocess(text)
+
+    def run_jobs(self, jobs):
+        """
+        Generates the samples of all jobs in one pass, every prompt with the
+        sampling parameters of its job, so the engine never drains between
+        benchmarks. Each output is handed to its job, and a job is finished as
+        soon as its last sample arrives, which only ends its input, so that
+        generation never waits for an evaluation; the jobs are closed once
+        generation is over. With stream set, outputs arrive in completion
+        order; otherwise once generation is done, in prompt order.
+        The jobs that evaluate while generating split eval_workers between
+        them, so their simulation pools together stay within the budget.
+        """
+        Prompts, sampling_params, response_batch, seeds, routes = [], [], [], [], []
+        for job in jobs:
+            for idx, prompt in enumerate(job.prompts):
+                Prompts.append(prompt)
+                sampling_params.append(job.sampling_params)
+                response_batch.append(job.response_batch)
+                seeds.append(self.request_seed(job.name, idx))
+                routes.append((job, idx))
+        streaming = [job for job in jobs if job.start is not None]
+        try:
+            for job in streaming:
+                job.start(max(1, self.eval_workers // len(streaming)))
+            for job in jobs:
+                if job.remaining == 0:
+                    job.finish()
+            if self.stream:
+                outputs = self.stream_response(Prompts, sampling_params, response_batch, seeds)
+            else:
+                Results = iter(self.get_response(Prompts, sampling_params, response_batch, seeds))
+                outputs = ((p, i, next(Results)) for p, batch in enumerate(response_batch) for i in range(batch))
+            for p, i, code_results in outputs:
+                job, idx = routes[p]
+                job.add(idx, i, code_results)
+                job.remaining -= 1
+                if job.remaining == 0:
+                    job.finish()
+        except BaseException:
+            for job in jobs:
+                if job.remaining > 0:
+                    job.abort()
+            raise
+        finally:
+            for job in jobs:
+                if job.remaining == 0:
+                    job.close()
+
+    def verilog_eval_job(self, name, Prompts, All_Data, sampling_params, response_batch, outfile, fill_record,
+                         evaluate, command, score_file, mode="high"):
+        """
+        The job of one VerilogEval run. Samples are written to outfile in
+        prompt order and scored by running command once all of them are
+        generated. With stream set, they are instead written as they finish
+        and scored by evaluate(outfile, samples, n_workers) while generation
+        goes on, with the n_workers run_jobs assigns to the job.
+        The pass rates are appended to score_file, and the results are
+        ingested into the results store, if there is one.
+        """
+        def record_score(pass_rate):
+            if isinstance(pass_rate, dict):
+                pass_rate['model'] = self.model_name
+            write_jsonl(score_file, [pass_rate], append=True)
+            if self.results_db is not None and os.path.exists(outfile + "_results.jsonl"):
+                with ResultStore(self.results_db) as store:
+                    store.ingest(outfile + "_results.jsonl")
+
+        if self.stream:
+            evaluation = StreamingEvaluation(outfile, evaluate)
+
+            def add(idx, i, code_results):
+                evaluation.put(fill_record(dict(All_Data[idx]), code_results))
+
+            def close():
+                pass_at_k = evaluation.close()
+                record_score({k: float(v) for k, v in pass_at_k.items()})
+
+            return GenerationJob(name, Prompts, sampling_params, response_batch, add, close, evaluation.abort,
+                                 evaluation.start, evaluation.finish)
+
+        Results = [[None] * response_batch for _ in Prompts]
+
+        def add(idx, i, code_results):
+            Results[idx][i] = code_results
+
+        def close():
+            write_jsonl(outfile, (fill_record(All_Data[idx], Results[idx][i])
+                                  for idx in range(len(All_Data)) for i in range(response_batch)), append=True)
+            result = subprocess.run(command, shell=True, capture_output=True, text=True, check=True)
+            record_score(parse_out(result, mode))
+
+        return GenerationJob(name, Prompts, sampling_params, response_batch, add, close)
+
+    def plan_VerilogEval_v1(self, temperature, top_p=None, response_batch=20, GType=None, fold_idx=""):
         save_path = "./VerilogEval-v1"
         os.makedirs(save_path, exist_ok=True)
         dir_path = f"{save_path}/{self.model_name}-{fold_idx}"
@@ -266,51 +510,46 @@ class VerilogGenBenchmark:
             response_batch = 1
         if GType == None:
             GType = ["Machine", "Human"]
+        jobs = []
         for gtype in GType: 
             infile = f"./verilog-eval-v1/CompleteData/VerilogEval_{gtype}.jsonl"
             outfile = f"{save_path}/{self.model_name}-{fold_idx}/VerilogEval_{gtype}_temp{temperature}.jsonl"
             if os.path.exists(outfile):
                 os.remove(outfile)
             score_file = f"{save_path}/VerilogEval_{gtype}_temp{temperature}_score.jsonl"
-            with open(infile, "r") as f:
-                Prompts = []
-                All_Data = []
-                for line in f:
-                    data = json.loads(line)
-                    task_id = data["task_id"]
-                    official_des = data['description']
-                    module_head = data['prompt']
-                    canonical_solution = data['canonical_solution']
-                    sub_data = {
-                        "task_id": task_id,
-                        "description": official_des,
-                        "prompt": module_head,
-                    }
-                    All_Data.append(sub_data)
-                    Prompts.append(official_des.strip()+"\n"+module_head.strip())
-
-            with open(outfile, "a") as sf:
-                Results = self.get_response(Prompts, sampling_params, response_batch)
-                for idx in range(len(All_Data)):
-                    for cid in range(idx * response_batch, (idx+1) * response_batch):
-                        All_Data[idx]["completion"] = Results[cid]['code_body']
-                        All_Data[idx]["full_code"] = Results[cid]['full_code']
-                        All_Data[idx]["code_header"] = Results[cid]['code_header']
-                        All_Data[idx]["redes"] = Results[cid]['direct_output']
-                        All_Data[idx]["maintain"] = All_Data[idx]["description"] in All_Data[idx]["redes"]
-                        sf.write(json.dumps(All_Data[idx])+'\n')
-            
+            Prompts = []
+            All_Data = []
+            for data in stream_jsonl(infile):
+                task_id = data["task_id"]
+                official_des = data['description']
+                module_head = data['prompt']
+                canonical_solution = data['canonical_solution']
+                sub_data = {
+                    "task_id": task_id,
+                    "description": official_des,
+                    "prompt": module_head,
+                }
+                All_Data.append(sub_data)
+                Prompts.append(official_des.strip()+"\n"+module_head.strip())
+
+            problem_file = f"./verilog-eval-v1/data/VerilogEval_{gtype}.jsonl"
+
+            def evaluate(sample_file, samples, n_workers, problem_file=problem_file):
+                from verilog_eval.evaluation import evaluate_functional_correctness as evaluate_v1
+                return evaluate_v1(sample_file, problem_file, [1, 5, 10], n_workers=n_workers, timeout=30.0,
+                                   samples=samples, mp_context="forkserver")
+
             # evaluate_functional_correctness /workspace/S/huanglei/VerilogGen-Benchmark/VerilogEval-v1/DAPOMerge106-CD-420/VerilogEval_Human_temp0.2.jsonl --problem_file /workspace/S/huanglei/verilog-eval/data/VerilogEval_Human.jsonl
-            command = f"evaluate_functional_correctness {outfile} --problem_file ./verilog-eval-v1/data/VerilogEval_{gtype}.jsonl"
-            result = subprocess.run(command, shell=True, capture_output=True, text=True, check=True)
-            pass_rate = parse_out(result)
-            pass_rate['model'] = self.model_name
-            with open(score_file, 'a') as f:
-                json_line = json.dumps(pass_rate) + '\n'
-                f.write(json_line)
-        
+            command = f"evaluate_functional_correctness {outfile} --problem_file {problem_file}"
+            jobs.append(self.verilog_eval_job(f"VerilogEval-v1/{gtype}/temp{temperature}", Prompts, All_Data,
+                                              sampling_params, response_batch, outfile, fill_record_v1,
+                                              evaluate, command, score_file))
+        return jobs
 
-    def run_VerilogEval_v2(self, task = "code-complete-iccad2023", mode='high', fold_idx=""):
+    def run_VerilogEval_v1(self, temperature, top_p=None, response_batch=20, GType=None, fold_idx=""):
+        self.run_jobs(self.plan_VerilogEval_v1(temperature, top_p, response_batch, GType, fold_idx))
+
+    def plan_VerilogEval_v2(self, task = "code-complete-iccad2023", mode='high', fold_idx=""):
         # Only Pass@1 with number of samples n=1 (temperature=0, top_p=0.01) and n=20 (temperature=0.85, top_p=0.95)
         if mode == "high":
             temperature=0.85
@@ -342,51 +581,39 @@ class VerilogGenBenchmark:
             os.remove(outfile)
 
         score_file = f"{save_path}/VerilogEval_{mode}_score.jsonl"
-        with open(infile, 'r') as file:
-            All_Data = []
-            Prompts = []
-            for line in file:
-                data = json.loads(line)
-                task_id = data["task_id"]
-                interface = data['interface']
-                description = data['prompt']
-                ref_module = data['ref_module']
-                sub_data = {
-                    "task_id": task_id,
-                    "description": description,
-                    "interface": interface
-                }
-                All_Data.append(sub_data)
-                Prompts.append(data['prompt'])
-                # if self.use_template:
-                #     Prompts.append(data['prompt'])
-                # else:
+        All_Data = []
+        Prompts = []
+        for data in stream_jsonl(infile):
+            task_id = data["task_id"]
+            interface = data['interface']
+            description = data['prompt']
+            ref_module = data['ref_module']
+            sub_data = {
+                "task_id": task_id,
+                "description": description,
+                "interface": interface
+            }
+            All_Data.append(sub_data)
+            Prompts.append(data['prompt'])
+            # if self.use_template:
+            #     Prompts.append(data['prompt'])
+            # else:
+
+
+        problem_file = f"./verilog-eval-2/Tasks/{task}.jsonl"
+
+        def evaluate(sample_file, samples, n_workers):
+            return evaluate_functional_correctness(sample_file, problem_file, [1, 5, 10], n_workers=n_workers,
+                                                   timeout=30.0, samples=samples, mp_context="forkserver")
 
-        
-        with open(outfile, "a") as sf:
-            Results = self.get_response(Prompts, sampling_params, response_batch)
-            for idx in range(len(All_Data)):
-                for cid in range(idx * response_batch, (idx+1) * response_batch):
-                    if task=='spec-to-rtl':
-                        All_Data[idx]["interface"] = Results[cid]['code_header']
-                        All_Data[idx]["completion"] = Results[cid]['full_code']
-                    else:
-                        All_Data[idx]["completion"] = Results[cid]['code_body']
-                    All_Data[idx]["full_code"] = Results[cid]['full_code']
-                    All_Data[idx]["code_header"] = Results[cid]['code_header']
-                    All_Data[idx]["redes"] = Results[cid]['direct_output']
-                    All_Data[idx]["maintain"] = All_Data[idx]["description"] in All_Data[idx]["redes"]
-                    sf.write(json.dumps(All_Data[idx])+'\n')
         # /workspace/S/huanglei/VerilogGen-Benchmark/VerilogEval-v2/spec-to-rtl/FSM_BlockCoT_SFT-1000-/VerilogEval_low.jsonl
-        command = f"python ./verilog-eval-2/evaluation/evaluate_functional_correctness.py {outfile} --problem_file ./verilog-eval-2/Tasks/{task}.jsonl"
-        result = subprocess.run(command, shell=True, capture_output=True, text=True, check=True)
-        pass_rate = parse_out(result, mode)
-        if isinstance(pass_rate, dict):
-            pass_rate['model'] = self.model_name
-        with open(score_file, 'a') as f:
-            json_line = json.dumps(pass_rate) + '\n'
-            f.write(json_line)
-    
+        command = f"python ./verilog-eval-2/evaluation/evaluate_functional_correctness.py {outfile} --problem_file {problem_file}"
+        return [self.verilog_eval_job(f"VerilogEval-v2/{task}/{mode}", Prompts, All_Data, sampling_params,
+                                      response_batch, outfile, partial(fill_record_v2, task=task), evaluate,
+                                      command, score_file, mode)]
+
+    def run_VerilogEval_v2(self, task = "code-complete-iccad2023", mode='high', fold_idx=""):
+        self.run_jobs(self.plan_VerilogEval_v2(task, mode, fold_idx))
     
     def run_VerilogEval_v2_with_temperature(self, task ="code-complete-iccad2023", temperature=0.0, top_p=None, response_batch=20):
         sampling_params = self.sampling_parameters(temperature, top_p)
@@ -402,49 +629,35 @@ class VerilogGenBenchmark:
         if os.path.exists(outfile):
                 os.remove(outfile)
         score_file = f"{save_path}/VerilogEval_{temperature}_score.jsonl"
-        with open(infile, 'r') as file:
-            All_Data = []
-            Prompts = []
-            for line in file:
-                data = json.loads(line)
-                task_id = data["task_id"]
-                interface = data['interface']
-                description = data['prompt']
-                ref_module = data['ref_module']
-                sub_data = {
-                    "task_id": task_id,
-                    "description": description,
-                    "interface": interface
-                }
-                All_Data.append(sub_data)
-                Prompts.append(data['prompt'])
+        All_Data = []
+        Prompts = []
+        for data in stream_jsonl(infile):
+            task_id = data["task_id"]
+            interface = data['interface']
+            description = data['prompt']
+            ref_module = data['ref_module']
+            sub_data = {
+                "task_id": task_id,
+                "description": description,
+                "interface": interface
+            }
+            All_Data.append(sub_data)
+            Prompts.append(data['prompt'])
         
-        with open(outfile, "a") as sf:
-            Results = self.get_response(Prompts, sampling_params, response_batch)
-            for idx in range(len(All_Data)):
-                for cid in range(idx * response_batch, (idx+1) * response_batch):
-                    if task=='spec-to-rtl':
-                        All_Data[idx]["interface"] = Results[cid]['code_header']
-                        All_Data[idx]["completion"] = Results[cid]['full_code']
-                    else:
-                        All_Data[idx]["completion"] = Results[cid]['code_body']
-                    All_Data[idx]["full_code"] = Results[cid]['full_code']
-                    All_Data[idx]["code_header"] = Results[cid]['code_header']
-                    All_Data[idx]["redes"] = Results[cid]['direct_output']
-                    All_Data[idx]["maintain"] = All_Data[idx]["description"] in All_Data[idx]["redes"]
-                    sf.write(json.dumps(All_Data[idx])+'\n')
+        Results = self.get_response(Prompts, sampling_params, response_batch)
+        write_jsonl(outfile, (fill_record_v2(All_Data[idx], Results[cid], task)
+                              for idx in range(len(All_Data))
+                              for cid in range(idx * response_batch, (idx+1) * response_batch)), append=True)
     
         command = f"python ./verilog-eval-2/evaluation/evaluate_functional_correctness.py {outfile} --problem_file .i/verilog-eval-2/Tasks/{task}.jsonl"
         result = subprocess.run(command, shell=True, capture_output=True, text=True, check=True)
         pass_rate = parse_out(result)
         if isinstance(pass_rate, dict):
             pass_rate['model'] = self.model_name
-        with open(score_file, 'a') as f:
-            json_line = json.dumps(pass_rate) + '\n'
-            f.write(json_line)
+        write_jsonl(score_file, [pass_rate], append=True)
         
 
-    def run_RTLLM_v1(self, temperature, response_batch=20, fold_idx=""):
+    def plan_RTLLM_v1(self, temperature, response_batch=20, fold_idx=""):
         infile = "./RTLLM/complete_data.jsonl"
         bigsave_path = f"./RTLLM_Benchmark"
         os.makedirs(bigsave_path, exist_ok=True)
@@ -457,48 +670,80 @@ class VerilogGenBenchmark:
         for res_bc in range(response_batch):
             os.makedirs(f"{save_path}/test_{res_bc}", exist_ok=True)
         
-        with open(infile, 'r') as file:
-            All_Data = []
-            Prompts = []
-            for line in file:
-                data = json.loads(line)
-                task_id = data["task_id"]
-                description = data['description']
-                verified = data['verified']
-
-                sub_data = {
-                    "task_id": task_id,
-                    "description": description,
-                    "verified": verified
-                }
-                All_Data.append(sub_data)
-                ## Because the CodeV dataset was constructed by collecting publicly available Verilog code from the internet and summarizing it hierarchically using ChatGPT, many of the hierarchical design tasks in the dataset lack the corresponding lower-level modules. To address this issue, we inserted an additional instruction into the few training samples that do contain complete hierarchical designs, reminding the model that all submodules must be implemented when handling hierarchical tasks. Since RTLLM contains many such hierarchical design examples, we included the same instruction in our prompt to ensure consistent model behavior.
-                description = description.replace("\n\nGive me the complete code.", "If there are sub modules in the code, you need to implement them to form a complete executable Verilog code.\n\nGive me the complete code.") 
-                # if self.use_template:
-                Prompts.append(description.strip())
-                # else:
-                #     Prompts.append(data['description'].strip() + "\n" + data['interface'])
+        All_Data = []
+        Prompts = []
+        for data in stream_jsonl(infile):
+            task_id = data["task_id"]
+            description = data['description']
+            verified = data['verified']
+
+            sub_data = {
+                "task_id": task_id,
+                "description": description,
+                "verified": verified
+            }
+            All_Data.append(sub_data)
+            ## Because the CodeV dataset was constructed by collecting publicly available Verilog code from the internet and summarizing it hierarchically using ChatGPT, many of the hierarchical design tasks in the dataset lack the corresponding lower-level modules. To address this issue, we inserted an additional instruction into the few training samples that do contain complete hierarchical designs, reminding the model that all submodules must be implemented when handling hierarchical tasks. Since RTLLM contains many such hierarchical design examples, we included the same instruction in our prompt to ensure consistent model behavior.
+            description = description.replace("\n\nGive me the complete code.", "If there are sub modules in the code, you need to implement them to form a complete executable Verilog code.\n\nGive me the complete code.") 
+            # if self.use_template:
+            Prompts.append(description.strip())
+            # else:
+            #     Prompts.append(data['description'].strip() + "\n" + data['interface'])
         
-        Results = self.get_response(Prompts, sampling_params, response_batch)
-        for idx in range(len(All_Data)):
-            for cid in range(idx * response_batch, (idx+1) * response_batch):
-                full_code = Results[cid]['full_code']
-                write_to_txt(f"{save_path}/test_{cid % response_batch}/{All_Data[idx]['task_id']}.v", full_code, 'w')
+        def add(idx, i, code_results):
+            full_code = code_results['full_code']
+            write_to_txt(f"{save_path}/test_{i}/{All_Data[idx]['task_id']}.v", full_code, 'w')
+
+        return [GenerationJob(f"RTLLM/temperature_{temperature}", Prompts, sampling_params, response_batch, add)]
+
+    def run_RTLLM_v1(self, temperature, response_batch=20, fold_idx=""):
+        self.run_jobs(self.plan_RTLLM_v1(temperature, response_batch, fold_idx))
 
 #### 只需要指定模型就行
-parser = argparse.ArgumentParser(description='input gtype')
-parser.add_argument('--model', help='model_path')
-args = parser.parse_args()
-
-VGB = VerilogGenBenchmark(model_path=args.model)
-
-VGB.run_VerilogEval_v2(task = "code-complete-iccad2023",mode='high')
-VGB.run_VerilogEval_v2(task = "code-complete-iccad2023",mode='low')
-VGB.run_VerilogEval_v2(task = "spec-to-rtl",mode='high')
-VGB.run_VerilogEval_v2(task = "spec-to-rtl",mode='low')
-for t in [0.2, 0.5, 0.8]:
-    VGB.run_RTLLM_v1(temperature=t)
-    VGB.run_VerilogEval_v1(temperature=t, response_batch=20, GType=None)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='input gtype')
+    parser.add_argument('--model', help='model_path')
+    parser.add_argument('--stream', action='store_true', help='simulate VerilogEval samples while generation is still running')
+    parser.add_argument('--duplicate_requests', action='store_true',
+                        help='send one request per sample instead of one n-way request per prompt')
+    parser.add_argument('--seed', type=int, default=None, help='base seed that makes sampling reproducible')
+    parser.add_argument('--no_prefix_caching', action='store_true', help='disable automatic prefix caching in vLLM')
+    parser.add_argument('--backend', default='vllm', choices=BACKENDS,
+                        help='vllm runs the model in-process, openai sends requests to an OpenAI-compatible server, stub returns canned modules')
+    parser.add_argument('--api_base', default=None, help='server URL of the openai backend, e.g. http://localhost:8000/v1')
+    parser.add_argument('--served_model', default=None, help='model name on the server, default --model')
+    parser.add_argument('--max_concurrency', type=int, default=64, help='requests in flight with the openai backend')
+    parser.add_argument('--max_retries', type=int, default=5)
+    parser.add_argument('--generation_cache', default=None, help='directory of the on-disk cache of generated outputs')
+    parser.add_argument('--results_db', default=None,
+                        help='SQLite results store the VerilogEval results are ingested into, see results_query.py')
+    parser.add_argument('--eval_workers', type=int, default=32,
+                        help='simulation workers shared by the VerilogEval runs evaluated with --stream')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='rebuild all outputs from --generation_cache without loading the model, e.g. after a post-processing fix')
+    args = parser.parse_args()
+
+    backend_options = {}
+    if args.backend == 'openai':
+        backend_options = dict(api_base=args.api_base, served_model=args.served_model,
+                               api_key=os.environ.get('OPENAI_API_KEY'), max_concurrency=args.max_concurrency,
+                               max_connections=args.max_concurrency, max_retries=args.max_retries)
+    VGB = VerilogGenBenchmark(model_path=args.model, stream=args.stream, n_way=not args.duplicate_requests,
+                              seed=args.seed, prefix_caching=not args.no_prefix_caching, backend=args.backend,
+                              generation_cache=args.generation_cache, rebuild=args.rebuild,
+                              results_db=args.results_db, eval_workers=args.eval_workers, **backend_options)
+
+    # All benchmarks are generated in a single pass, see run_jobs.
+    jobs = []
+    jobs += VGB.plan_VerilogEval_v2(task = "code-complete-iccad2023",mode='high')
+    jobs += VGB.plan_VerilogEval_v2(task = "code-complete-iccad2023",mode='low')
+    jobs += VGB.plan_VerilogEval_v2(task = "spec-to-rtl",mode='high')
+    jobs += VGB.plan_VerilogEval_v2(task = "spec-to-rtl",mode='low')
+    for t in [0.2, 0.5, 0.8]:
+        jobs += VGB.plan_RTLLM_v1(temperature=t)
+        jobs += VGB.plan_VerilogEval_v1(temperature=t, response_batch=20, GType=None)
+    VGB.run_jobs(jobs)
+    VGB.backend.close()
 
         
         
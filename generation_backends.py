@@ -0,0 +1,248 @@
+"""
+Generation backends of benchmark_infer.py. A backend turns requests into
+sampled texts; a request is (prompt, sampling_params) where prompt is either
+a list of chat messages or a plain string.
+"""
+import asyncio
+import dataclasses
+import hashlib
+import itertools
+import json
+import queue
+import random
+import threading
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+
+@dataclasses.dataclass(frozen=True)
+class SamplingParams:
+    """The sampling parameters the benchmarks use, independent of the backend."""
+    n: int = 1
+    temperature: float = 1.0
+    top_p: float = 1.0
+    max_tokens: int = 16
+    seed: Optional[int] = None
+
+
+class GenerationBackend:
+    """
+    Base class of the backends. stream() yields (request index, texts) as
+    requests finish, with one text per requested sample; generate() returns
+    the texts of all requests in request order.
+    """
+
+    def stream(self, requests: Sequence[Tuple[object, SamplingParams]]) -> Iterator[Tuple[int, List[str]]]:
+        raise NotImplementedError
+
+    def generate(self, requests: Sequence[Tuple[object, SamplingParams]]) -> List[List[str]]:
+        results = [None] * len(requests)
+        for idx, texts in self.stream(requests):
+            results[idx] = texts
+        return results
+
+    def close(self):
+        pass
+
+
+class VLLMBackend(GenerationBackend):
+    """Runs the model in-process with vLLM."""
+
+    def __init__(self, model_path: str, prefix_caching: bool = True, **llm_options):
+        from vllm import LLM
+        self.llm = LLM(model=model_path, enable_prefix_caching=prefix_caching, **llm_options) #, tensor_parallel_size=8)
+        self.request_ids = itertools.count()
+
+    @staticmethod
+    def vllm_params(params: SamplingParams):
+        from vllm import SamplingParams as VLLMSamplingParams
+        return VLLMSamplingParams(n=params.n, temperature=params.temperature, top_p=params.top_p,
+                                  max_tokens=params.max_tokens, seed=params.seed)
+
+    def generate(self, requests):
+        results = [None] * len(requests)
+        chat = [idx for idx, (prompt, _) in enumerate(requests) if not isinstance(prompt, str)]
+        text = [idx for idx, (prompt, _) in enumerate(requests) if isinstance(prompt, str)]
+        for indices, method in ((chat, self.llm.chat), (text, self.llm.generate)):
+            if not indices:
+                continue
+            prompts = [requests[idx][0] for idx in indices]
+            params = [self.vllm_params(requests[idx][1]) for idx in indices]
+            outputs = method(prompts, sampling_params=params, use_tqdm=True)
+            for idx, output in zip(indices, outputs):
+                results[idx] = [sample.text for sample in output.outputs]
+        return results
+
+    def stream(self, requests):
+        """Drives the engine step by step, so finished requests are yielded at once."""
+        engine = self.llm.llm_engine
+        tokenizer = self.llm.get_tokenizer()
+        routes = {}
+        for idx, (prompt, params) in enumerate(requests):
+            if not isinstance(prompt, str):
+                prompt = tokenizer.apply_chat_template(prompt, tokenize=False, add_generation_prompt=True)
+            request_id = str(next(self.request_ids))
+            routes[request_id] = idx
+            engine.add_request(request_id, prompt, self.vllm_params(params))
+
+        try:
+            while engine.has_unfinished_requests():
+                for output in engine.step():
+                    if output.finished:
+                        yield routes.pop(output.request_id), [sample.text for sample in output.outputs]
+        finally:
+            if routes:
+                engine.abort_request(list(routes))
+
+
+class OpenAIBackend(GenerationBackend):
+    """
+    Client of an OpenAI-compatible server (vLLM, SGLang, TGI, ...). Requests
+    are sent from one asyncio event loop over a pool of at most
+    max_connections connections, with at most max_concurrency requests in
+    flight. Connection errors, timeouts, 429 and 5xx responses are retried up
+    to max_retries times with exponential backoff.
+    """
+
+    RETRY_STATUS = (408, 409, 429, 500, 502, 503, 504)
+
+    def __init__(self, api_base: str, model: str, api_key: Optional[str] = None, max_connections: int = 64,
+                 max_concurrency: int = 64, max_retries: int = 5, timeout: float = 1800.0, backoff: float = 1.0):
+        self.api_base = api_base.rstrip("/")
+        self.model = model
+        self.api_key = api_key
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff = backoff
+
+    def payload(self, prompt, params: SamplingParams):
+        body = dict(model=self.model, n=params.n, temperature=params.temperature, top_p=params.top_p,
+                    max_tokens=params.max_tokens)
+        if params.seed is not None:
+            body["seed"] = params.seed
+        if isinstance(prompt, str):
+            return "/completions", dict(body, prompt=prompt)
+        return "/chat/completions", dict(body, messages=prompt)
+
+    @staticmethod
+    def texts(response):
+        choices = sorted(response["choices"], key=lambda choice: choice.get("index", 0))
+        return [choice["text"] if "text" in choice else choice["message"]["content"] or "" for choice in choices]
+
+    async def complete(self, session, semaphore, prompt, params):
+        import aiohttp
+        path, body = self.payload(prompt, params)
+        for attempt in itertools.count():
+            async with semaphore:
+                try:
+                    async with session.post(self.api_base + path, json=body) as response:
+                        if response.status == 200:
+                            return self.texts(await response.json())
+                        error = f"HTTP {response.status}: {(await response.text())[:500]}"
+                        if response.status not in self.RETRY_STATUS:
+                            raise RuntimeError(f"{self.api_base + path} failed with {error}")
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = repr(e)
+            if attempt >= self.max_retries:
+                raise RuntimeError(f"{self.api_base + path} failed after {attempt + 1} attempts: {error}")
+            # Back off outside the semaphore so other requests keep the slots busy.
+            await asyncio.sleep(self.backoff * 2 ** attempt * (0.5 + random.random()))
+
+    async def run(self, requests, put):
+        import aiohttp
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        connector = aiohttp.TCPConnector(limit=self.max_connections)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers) as session:
+            async def one(idx, prompt, params):
+                return idx, await self.complete(session, semaphore, prompt, params)
+
+            tasks = [asyncio.ensure_future(one(idx, prompt, params)) for idx, (prompt, params) in enumerate(requests)]
+            try:
+                for task in asyncio.as_completed(tasks):
+                    put(await task)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stream(self, requests):
+        """
+        Runs the event loop in a background thread and yields its results as
+        they arrive. Closing the generator cancels the outstanding requests.
+        """
+        results = queue.Queue()
+        done = object()
+        cancel = []
+
+        async def main():
+            loop, task = asyncio.get_running_loop(), asyncio.current_task()
+            cancel.append(lambda: loop.call_soon_threadsafe(task.cancel))
+            await self.run(requests, results.put)
+
+        def worker_main():
+            try:
+                asyncio.run(main())
+            except asyncio.CancelledError:
+                pass
+            except BaseException as e:
+                results.put(e)
+            results.put(done)
+
+        worker = threading.Thread(target=worker_main, daemon=True)
+        worker.start()
+        try:
+            while True:
+                item = results.get()
+                if item is done:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            if worker.is_alive() and cancel:
+                try:
+                    cancel[0]()
+                except RuntimeError:
+                    pass  # the loop has already finished
+            worker.join()
+
+
+class StubBackend(GenerationBackend):
+    """
+    Deterministic local backend for tests: every sample is a small Verilog
+    module whose body is a digest of the prompt, the sampling parameters and
+    the sample index, so identical requests always give identical texts.
+    """
+
+    def __init__(self, template: str = "```verilog\nmodule TopModule();\n  // {digest}\nendmodule\n```"):
+        self.template = template
+
+    def stream(self, requests):
+        for idx, (prompt, params) in enumerate(requests):
+            key = json.dumps([prompt, dataclasses.astuple(params)], sort_keys=True)
+            yield idx, [self.template.format(digest=hashlib.sha1(f"{key}/{j}".encode("utf-8")).hexdigest())
+                        for j in range(params.n)]
+
+
+BACKENDS = ("vllm", "openai", "stub")
+
+
+def make_backend(name: str, model_path: str, prefix_caching: bool = True, api_base: Optional[str] = None,
+                 served_model: Optional[str] = None, **options) -> GenerationBackend:
+    """
+    Creates the backend called name. The openai backend needs api_base and
+    asks for served_model, by default model_path; options are passed on to
+    the backend.
+    """
+    if name == "vllm":
+        return VLLMBackend(model_path, prefix_caching, **options)
+    elif name == "openai":
+        if api_base is None:
+            raise ValueError("The openai backend needs api_base, e.g. http://localhost:8000/v1.")
+        return OpenAIBackend(api_base, served_model or model_path, **options)
+    elif name == "stub":
+        return StubBackend(**options)
+    raise ValueError(f"Unknown generation backend {name!r}, expected one of {', '.join(BACKENDS)}.")
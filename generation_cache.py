@@ -0,0 +1,177 @@
+"""
+On-disk cache of generated texts, so that reruns of benchmark_infer.py only
+generate what they have not generated before.
+"""
+from typing import List, Optional
+from collections import Counter
+import dataclasses
+import glob
+import hashlib
+import json
+import os
+import sys
+import zlib
+
+from generation_backends import GenerationBackend
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "verilog-eval-2", "evaluation"))
+from kvstore import KVStore
+
+
+WEIGHT_PATTERNS = ("*.safetensors", "*.bin", "*.pt", "*.pth", "*.gguf")
+CONFIG_FILES = ("config.json", "generation_config.json", "tokenizer_config.json", "tokenizer.json")
+
+
+def model_fingerprint(model_path: str, sample_bytes: int = 1 << 20) -> str:
+    """
+    Fingerprint of the model at model_path. For a local checkpoint it covers
+    the config and tokenizer files (which hold the chat template) and, for
+    every weight file, its name, size and the hash of its first and last
+    sample_bytes, so that it is cheap even for large checkpoints. Anything
+    that is not a directory, such as the model name on a server, is used
+    as is.
+    """
+    if not os.path.isdir(model_path):
+        return model_path
+    digest = hashlib.sha256()
+    for name in CONFIG_FILES:
+        path = os.path.join(model_path, name)
+        if os.path.exists(path):
+            digest.update(name.encode("utf-8") + b"\0")
+            with open(path, "rb") as file:
+                digest.update(file.read())
+    weights = sorted({path for pattern in WEIGHT_PATTERNS for path in glob.glob(os.path.join(model_path, pattern))})
+    for path in weights:
+        size = os.path.getsize(path)
+        digest.update(f"{os.path.basename(path)}\0{size}\0".encode("utf-8"))
+        with open(path, "rb") as file:
+            digest.update(file.read(sample_bytes))
+            if size > sample_bytes:
+                file.seek(max(sample_bytes, size - sample_bytes))
+                digest.update(file.read())
+    return digest.hexdigest()
+
+
+class GenerationCache:
+    """
+    Generated texts keyed by model fingerprint, prompt, sampling parameters
+    (including n and the seed) and the occurrence of the request among
+    identical ones. Texts are stored zlib-compressed in a KVStore, the
+    store of the evaluation result cache. Entries that have not been used
+    for max_age_days are dropped, and the least recently used entries are
+    dropped once the database grows beyond max_size_mb.
+    """
+
+    def __init__(self, cache_dir: str, max_size_mb: float = 4096.0, max_age_days: float = 90.0,
+                 commit_every: int = 256):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.store = KVStore(os.path.join(self.cache_dir, "generations.sqlite3"), "generations",
+                             dict(texts="BLOB NOT NULL"), max_size_mb, max_age_days, commit_every)
+
+    @property
+    def hits(self) -> int:
+        return self.store.hits
+
+    @property
+    def misses(self) -> int:
+        return self.store.misses
+
+    @staticmethod
+    def make_key(fingerprint: str, prompt, sampling_params, occurrence: int = 0) -> str:
+        """
+        occurrence tells apart identical requests, e.g. the samples of a
+        prompt drawn one request each without a seed; the first occurrence
+        keeps the key it had before occurrences were counted.
+        """
+        digest = hashlib.sha256()
+        parts = [fingerprint, json.dumps(prompt, sort_keys=True),
+                 json.dumps(dataclasses.asdict(sampling_params), sort_keys=True)]
+        if occurrence:
+            parts.append(str(occurrence))
+        for part in parts:
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        row = self.store.get(key)
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def put(self, key: str, texts: List[str]):
+        self.store.put(key, zlib.compress(json.dumps(texts).encode("utf-8"), 6))
+
+    def evict(self):
+        self.store.evict()
+
+    def flush(self):
+        self.store.flush()
+
+    def close(self):
+        self.store.close()
+
+
+class CachedBackend(GenerationBackend):
+    """
+    Serves requests from cache and passes the rest on to backend, caching
+    what it returns. Without a backend (rebuild mode) every request must be
+    cached, and nothing is generated.
+    """
+
+    def __init__(self, cache: GenerationCache, fingerprint: str, backend: Optional[GenerationBackend] = None):
+        self.cache = cache
+        self.fingerprint = fingerprint
+        self.backend = backend
+
+    def lookup(self, requests):
+        """
+        Returns the cache keys, the cached texts (None if missing) and the
+        indices of the missing requests. Identical requests, such as the
+        samples of a prompt drawn one request each without a seed, are
+        keyed by their occurrence, so that each keeps its own texts.
+        """
+        occurrences = Counter()
+        keys = []
+        for prompt, params in requests:
+            key = self.cache.make_key(self.fingerprint, prompt, params)
+            occurrence = occurrences[key]
+            occurrences[key] += 1
+            keys.append(self.cache.make_key(self.fingerprint, prompt, params, occurrence) if occurrence else key)
+        cached = [self.cache.get(key) for key in keys]
+        missing = [idx for idx, texts in enumerate(cached) if texts is None]
+        print(f"Generation cache: {len(requests) - len(missing)} of {len(requests)} requests cached")
+        if missing and self.backend is None:
+            raise RuntimeError(f"{len(missing)} of {len(requests)} requests are not in the generation cache "
+                               f"at {self.cache.cache_dir}; generate them first.")
+        return keys, cached, missing
+
+    def generate(self, requests):
+        keys, results, missing = self.lookup(requests)
+        if missing:
+            try:
+                for idx, texts in zip(missing, self.backend.generate([requests[idx] for idx in missing])):
+                    self.cache.put(keys[idx], texts)
+                    results[idx] = texts
+            finally:
+                self.cache.flush()
+        return results
+
+    def stream(self, requests):
+        keys, cached, missing = self.lookup(requests)
+        try:
+            for idx, texts in enumerate(cached):
+                if texts is not None:
+                    yield idx, texts
+            if missing:
+                for m, texts in self.backend.stream([requests[idx] for idx in missing]):
+                    self.cache.put(keys[missing[m]], texts)
+                    yield missing[m], texts
+        finally:
+            self.cache.flush()
+
+    def close(self):
+        if self.backend is not None:
+            self.backend.close()
+        self.cache.close()
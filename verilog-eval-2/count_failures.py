@@ -9,6 +9,10 @@ import os
 import pandas as pd
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "evaluation"))
+from data import stream_jsonl
+from failures import FAILURE_CODES, count_codes, report_order
+
 # Function to process a CSV file and count codes
 def process_csv(directory):
     file_path = os.path.join(directory, 'summary.csv')
@@ -16,25 +20,25 @@ def process_csv(directory):
         print(f"No summary.csv found in {directory}")
         return {}
 
-    # Load the CSV file
-    df = pd.read_csv(file_path)
+    # Load the CSV file, keeping codes such as '0' as strings
+    df = pd.read_csv(file_path, dtype=str)
 
     # Ignore the first 3 columns
     df = df.iloc[:, 4:]
 
-    # Initialize a dictionary to store the counts of each code
-    code_counts = {}
+    # Count the codes of all cells at once
+    return df.stack().value_counts().to_dict()
 
-    # Iterate over each row in the dataframe
-    for index, row in df.iterrows():
-        for code in row:
-            if code in code_counts:
-                code_counts[code] += 1
-            else:
-                code_counts[code] = 1
+# Function to count the codes of a results file of the evaluation, which
+# records the code of every sample in its "failure" field
+def process_results(file_path):
+    return count_codes(sample.get("failure") for sample in stream_jsonl(file_path))
 
-    # Return the counts dictionary
-    return code_counts
+# Function to count codes of a summary.csv directory or a results file
+def process(path):
+    if os.path.isdir(path):
+        return process_csv(path)
+    return process_results(path)
 
 # Function to print counts for a directory
 def print_counts(directory, code_counts):
@@ -45,10 +49,7 @@ def print_counts(directory, code_counts):
     print(f'Total counts across all categories in {directory}: {total_counts}')
 
     # Sort the code counts by code, with '.' always at the top
-    sorted_codes = sorted(code_counts.keys())
-    if '.' in sorted_codes:
-        sorted_codes.remove('.')
-    sorted_codes.insert(0, '.')
+    sorted_codes = report_order(code_counts.keys())
 
     # Print out the counts of each code with human-readable names
     for code in sorted_codes:
@@ -57,32 +58,19 @@ def print_counts(directory, code_counts):
         print(f'{code} ({reason}): {count}')
 
 # Mapping of codes to human-readable names
-code_to_reason = {
-    '.': 'Pass',
-    'S': 'Syntax Error',
-    'e': 'Explicit Cast Required',
-    '0': 'Sized Numeric Constant Error',
-    'n': 'No Sensitivities Warning',
-    'w': 'Declared as Wire',
-    'm': 'Unknown Module Type',
-    'p': 'Unable to Bind Wire/Reg',
-    'c': 'Unable to Bind Wire/Reg `clk`',
-    'T': 'Timeout',
-    '.': 'No Mismatches',
-    'r': 'Async reset found',
-    'C': 'Compiler error',
-    'R': 'Runtime error'
-}
+code_to_reason = FAILURE_CODES
 
 
 # Main script
 if __name__ == "__main__":
+    # Directories with a summary.csv of sv-iv-analyze, or results files of
+    # evaluate_functional_correctness.py
     directories = sys.argv[1:]
     all_counts = {}
 
     for directory in directories:
-        print(f"\nProcessing directory: {directory}")
-        counts = process_csv(directory)
+        print(f"\nProcessing: {directory}")
+        counts = process(directory)
         all_counts[directory] = counts
         print_counts(directory, counts)
 
@@ -94,13 +82,8 @@ if __name__ == "__main__":
     for counts in all_counts.values():
         all_codes.update(counts.keys())
 
-    # Sort codes with '.' at the top
-    sorted_codes = sorted(all_codes)
-    if '.' in sorted_codes:
-        sorted_codes.remove('.')
-    sorted_codes.insert(0, '.')
-
-    sorted_codes = [code for code in sorted_codes if code not in ['r', 'R', 'T']] + ['r', 'R', 'T']
+    # Sort codes with '.' at the top and r, R and T at the bottom
+    sorted_codes = report_order(all_codes)
 
     # Create rows for the summary DataFrame
     for code in sorted_codes:
@@ -0,0 +1,70 @@
+import fire
+import multiprocessing
+import sys
+import time
+
+from data import read_problems
+from execution import (build_verilog_test, check_correctness, create_tempdir, get_sandbox, reference_completion,
+                       run_simulation)
+
+
+def legacy_check_correctness(problem, completion, timeout):
+    """
+    The per-sample dispatch used before SandboxWorker: a Manager server and
+    a fresh Process for every sample.
+    """
+    verilog_test = build_verilog_test(problem, completion)
+
+    def unsafe_execute():
+        with create_tempdir():
+            result.append(run_simulation(problem["task_id"], verilog_test, timeout)["result"])
+
+    manager = multiprocessing.Manager()
+    result = manager.list()
+
+    p = multiprocessing.Process(target=unsafe_execute)
+    p.start()
+    p.join(timeout=timeout + 1)
+    if p.is_alive():
+        p.kill()
+
+    if not result:
+        result.append("timed out")
+    return result[0]
+
+
+def entry_point(
+    problem_file: str,
+    n_samples: int = 200,
+    timeout: float = 30.0,
+):
+    """
+    Measures the per-sample overhead of check_correctness with the sandbox
+    worker against the legacy Manager + Process dispatch. Every sample runs
+    the reference solution of the first problem, so the simulation cost is
+    identical in both cases.
+    """
+    problem = next(iter(read_problems(problem_file).values()))
+    completion = reference_completion(problem)
+
+    start = time.perf_counter()
+    for _ in range(n_samples):
+        legacy_check_correctness(problem, completion, timeout)
+    legacy = (time.perf_counter() - start) / n_samples
+
+    get_sandbox().start()
+    start = time.perf_counter()
+    for idx in range(n_samples):
+        check_correctness(problem, completion, timeout, idx)
+    sandbox = (time.perf_counter() - start) / n_samples
+
+    print(f"legacy : {legacy * 1000:8.2f} ms/sample")
+    print(f"sandbox: {sandbox * 1000:8.2f} ms/sample")
+    print(f"saved  : {(legacy - sandbox) * 1000:8.2f} ms/sample")
+
+
+def main():
+    fire.Fire(entry_point)
+
+
+sys.exit(main())
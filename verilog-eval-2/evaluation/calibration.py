@@ -0,0 +1,57 @@
+"""
+Per-task timeouts calibrated from the runtime of the reference solutions.
+The calibration pass simulates the reference of every task against its own
+testbench once and keeps the measured wall time of each stage in a sidecar
+of the problem file. A task then times out after a multiple of its
+reference's runtime instead of the flat timeout.
+"""
+from typing import Dict, Optional, Sequence
+import json
+import os
+
+STAGES = ("compile", "simulate")
+
+
+def calibration_file(problem_file: str) -> str:
+    return problem_file + ".calibration.json"
+
+
+def load_calibration(path: str) -> Dict[str, Dict]:
+    """Returns the calibration entries of path by task_id, or none if it does not exist or cannot be parsed."""
+    try:
+        with open(path, "r") as fp:
+            return json.load(fp)["tasks"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def save_calibration(path: str, entries: Dict[str, Dict]):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as fp:
+        json.dump(dict(tasks=entries), fp, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def calibration_entry(key: str, result: Dict) -> Dict:
+    """
+    The calibration entry of a reference run: its cache key (see
+    ResultCache.make_key), which tells when the entry is stale, its result
+    and the wall time of each stage it ran.
+    """
+    usage = result.get("usage") or {}
+    return dict(key=key, result=result["result"],
+                runtime={stage: usage[stage]["wall"] for stage in STAGES if "wall" in usage.get(stage, {})})
+
+
+def derive_timeout(entry: Optional[Dict], timeout: float, stages: Sequence[str] = STAGES,
+                   scale: float = 10.0, slack: float = 2.0) -> float:
+    """
+    Timeout of a task whose calibration entry is entry: scale times the
+    runtime of the reference in stages plus slack seconds, but never more
+    than timeout. Tasks whose reference was not simulated to the end keep
+    timeout.
+    """
+    if entry is None or entry["result"] == "timed out" or "simulate" not in entry["runtime"]:
+        return timeout
+    runtime = sum(entry["runtime"].get(stage, 0.0) for stage in stages)
+    return min(timeout, scale * runtime + slack)
@@ -1,30 +1,268 @@
-from typing import Iterable, Dict
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Iterable, Dict, List, Optional, Sequence, Union
+import collections
 import gzip
+import hashlib
+import io
 import json
+import mmap
 import os
+import shutil
+import tempfile
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 ROOT = os.path.dirname(os.path.abspath(__file__))
 
-def read_problems(evalset_file: str) -> Dict[str, Dict]:
+# JSON lines are encoded and decoded by orjson if it is installed, and by
+# json otherwise. Files ending in .gz are gzip compressed and files ending in
+# .zst or .zstd zstd compressed, which needs the zstandard package.
+ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY) if orjson is not None else 0
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+ZSTD_SUFFIXES = (".zst", ".zstd")
+# Encoded lines a JsonlWriter collects before it writes them out at once.
+WRITE_BUFFER_BYTES = 1 << 20
+# Size of the chunks of lines stream_jsonl hands to each decoding worker.
+CHUNK_BYTES = 16 << 20
+# The sidecar index of an IndexedJsonl file is f"{filename}{INDEX_SUFFIX}".
+INDEX_SUFFIX = ".idx.npz"
+INDEX_VERSION = 1
+
+
+def read_problems(evalset_file: str, lazy: bool = False) -> Dict[str, Dict]:
+    """
+    Returns the problems of evalset_file by task_id. With lazy set, the
+    problems are decoded from the memory-mapped file only when they are
+    looked up (see IndexedJsonl), so looking up a few of them does not
+    decode every testbench.
+    """
+    if lazy and _compression(os.path.expanduser(evalset_file)) is None:
+        return LazyProblems(IndexedJsonl(evalset_file))
     return {task["task_id"]: task for task in stream_jsonl(evalset_file)}
 
 
-def stream_jsonl(filename: str) -> Iterable[Dict]:
+def dumps_json(obj) -> bytes:
+    """Encodes obj as one line of JSON, without the newline."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=ORJSON_OPTIONS)
+        except TypeError:
+            # E.g. integers beyond 64 bits, which json encodes.
+            pass
+    return json.dumps(obj).encode("utf-8")
+
+
+def loads_json(line: Union[bytes, str]):
+    """Decodes one line of JSON; errors are json.JSONDecodeError either way."""
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+def _compression(filename: str) -> Optional[str]:
+    if filename.endswith(".gz"):
+        return "gzip"
+    if filename.endswith(ZSTD_SUFFIXES):
+        return "zstd"
+    return None
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compressed files need the zstandard package: pip install zstandard")
+    return zstandard
+
+
+def open_jsonl(filename: str, mode: str = "rb"):
+    """
+    Opens filename as a binary file, "rb", "wb" or "ab", decompressing or
+    compressing it according to its suffix. Appending to a compressed file
+    adds a gzip member or zstd frame; JsonlWriter avoids that.
+    """
+    filename = os.path.expanduser(filename)
+    compression = _compression(filename)
+    if compression == "gzip":
+        return gzip.open(filename, mode, compresslevel=GZIP_LEVEL)
+    if compression == "zstd":
+        zstandard = _zstandard()
+        fp = open(filename, mode)
+        if mode == "rb":
+            reader = zstandard.ZstdDecompressor().stream_reader(fp, read_across_frames=True, closefd=True)
+            # The reader can read but not readline, which iterating over lines needs.
+            return io.BufferedReader(reader, buffer_size=1 << 20)
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(fp, closefd=True)
+    return open(filename, mode)
+
+
+def _read_lines(fp, chunk_bytes: int) -> Iterable[bytes]:
+    """Yields the contents of fp in chunks of whole lines of about chunk_bytes."""
+    rest = b""
+    while True:
+        block = fp.read(chunk_bytes)
+        if not block:
+            break
+        block = rest + block
+        cut = block.rfind(b"\n") + 1
+        rest = block[cut:]
+        if cut:
+            yield block[:cut]
+    if rest:
+        yield rest
+
+
+def _select(record: Dict, keys: Optional[Sequence[str]]) -> Dict:
+    return record if keys is None else {key: record[key] for key in keys if key in record}
+
+
+def _decode_lines(chunk: bytes, keys: Optional[Sequence[str]] = None) -> List[Dict]:
+    return [_select(loads_json(line), keys) for line in chunk.splitlines() if line.strip()]
+
+
+def _decode_range(filename: str, start: int, end: int, keys: Optional[Sequence[str]] = None) -> List[Dict]:
+    with open(filename, "rb") as fp:
+        fp.seek(start)
+        return _decode_lines(fp.read(end - start), keys)
+
+
+def _line_ranges(filename: str, chunk_bytes: int) -> Iterable[tuple]:
+    """Splits an uncompressed file into (start, end) byte ranges of whole lines of about chunk_bytes."""
+    size = os.path.getsize(filename)
+    with open(filename, "rb") as fp:
+        start = 0
+        while start < size:
+            fp.seek(min(start + chunk_bytes, size))
+            fp.readline()
+            end = fp.tell()
+            yield start, end
+            start = end
+
+
+def _stream_parallel(filename: str, n_workers: int, chunk_bytes: int, keys: Optional[Sequence[str]]) -> Iterable[Dict]:
+    """
+    stream_jsonl with n_workers decoding processes. Uncompressed files are
+    split into byte ranges that every worker reads itself; compressed files
+    are decompressed here and their lines handed to the workers. At most
+    2 * n_workers chunks are decoded ahead of the caller.
+    """
+    with ProcessPoolExecutor(n_workers) as executor:
+        if _compression(filename) is None:
+            submit = (executor.submit(_decode_range, filename, start, end, keys)
+                      for start, end in _line_ranges(filename, chunk_bytes))
+            fp = None
+        else:
+            fp = open_jsonl(filename, "rb")
+            submit = (executor.submit(_decode_lines, chunk, keys) for chunk in _read_lines(fp, chunk_bytes))
+        try:
+            pending = collections.deque()
+            for future in submit:
+                pending.append(future)
+                if len(pending) >= 2 * n_workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            if fp is not None:
+                fp.close()
+
+
+def stream_jsonl(filename: str, n_workers: int = 1, chunk_bytes: int = CHUNK_BYTES,
+                 keys: Optional[Sequence[str]] = None) -> Iterable[Dict]:
     """
     Parses each jsonl line and yields it as a dictionary
+    If keys is given, only those keys of every line are kept.
+    With n_workers > 1, chunks of about chunk_bytes are decoded by as many
+    processes and yielded in order. The decoded lines are pickled back to
+    the caller, so this pays off on files of hundreds of megabytes when
+    only a few small keys are kept, or when orjson is not installed.
     """
-    if filename.endswith(".gz"):
-        with open(filename, "rb") as gzfp:
-            with gzip.open(gzfp, 'rt') as fp:
-                for line in fp:
-                    if any(not x.isspace() for x in line):
-                        yield json.loads(line)
-    else:
-        with open(filename, "r") as fp:
-            for line in fp:
-                if any(not x.isspace() for x in line):
-                    yield json.loads(line)
+    filename = os.path.expanduser(filename)
+    if n_workers > 1:
+        yield from _stream_parallel(filename, n_workers, chunk_bytes, keys)
+        return
+    with open_jsonl(filename, "rb") as fp:
+        for line in fp:
+            if line.strip():
+                yield _select(loads_json(line), keys)
+
+
+class JsonlWriter:
+    """
+    Writes dictionaries to a jsonl file, compressed according to its suffix
+    (see open_jsonl), skipping None. Lines are buffered and written in
+    batches; flush writes them out.
+    Appending to a compressed file rewrites it as a single stream: the
+    existing lines are recompressed into a temporary file next to it, which
+    replaces the file on close. An error inside the with block leaves the
+    file as it was.
+    """
+
+    def __init__(self, filename: str, append: bool = False):
+        self.filename = os.path.expanduser(filename)
+        self.buffer = []
+        self.buffered = 0
+        self.tmp_file = None
+        if append and _compression(self.filename) is not None and os.path.exists(self.filename):
+            fd, self.tmp_file = tempfile.mkstemp(prefix=os.path.basename(self.filename) + ".",
+                                                 suffix=os.path.splitext(self.filename)[1],
+                                                 dir=os.path.dirname(os.path.abspath(self.filename)))
+            os.close(fd)
+            self.fp = open_jsonl(self.tmp_file, "wb")
+            last = b"\n"
+            with open_jsonl(self.filename, "rb") as old:
+                for chunk in iter(lambda: old.read(1 << 20), b""):
+                    self.fp.write(chunk)
+                    last = chunk[-1:]
+            if last != b"\n":
+                self.fp.write(b"\n")
+        else:
+            self.fp = open_jsonl(self.filename, "ab" if append else "wb")
+
+    def write(self, record: Optional[Dict]):
+        if record:
+            line = dumps_json(record) + b"\n"
+            self.buffer.append(line)
+            self.buffered += len(line)
+            if self.buffered >= WRITE_BUFFER_BYTES:
+                self._write_buffer()
+
+    def _write_buffer(self):
+        if self.buffer:
+            self.fp.write(b"".join(self.buffer))
+            self.buffer, self.buffered = [], 0
+
+    def flush(self):
+        self._write_buffer()
+        self.fp.flush()
+
+    def close(self, discard: bool = False):
+        if self.fp is None:
+            return
+        if not discard:
+            self._write_buffer()
+        self.fp.close()
+        self.fp = None
+        if self.tmp_file is not None:
+            if discard:
+                os.remove(self.tmp_file)
+            else:
+                shutil.copymode(self.filename, self.tmp_file)
+                os.replace(self.tmp_file, self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(discard=exc_type is not None and self.tmp_file is not None)
 
 
 def write_jsonl(filename: str, data: Iterable[Dict], append: bool = False):
@@ -32,19 +270,161 @@ def write_jsonl(filename: str, data: Iterable[Dict], append: bool = False):
     Writes an iterable of dictionaries to jsonl
     Skipping None in data
     """
-    if append:
-        mode = 'ab'
-    else:
-        mode = 'wb'
-    filename = os.path.expanduser(filename)
-    if filename.endswith(".gz"):
-        with open(filename, mode) as fp:
-            with gzip.GzipFile(fileobj=fp, mode='wb') as gzfp:
-                for x in data:
-                    if x:
-                        gzfp.write((json.dumps(x) + "\n").encode('utf-8'))
-    else:
-        with open(filename, mode) as fp:
-            for x in data:
-                if x:
-                    fp.write((json.dumps(x) + "\n").encode('utf-8'))
+    with JsonlWriter(filename, append) as writer:
+        for x in data:
+            writer.write(x)
+
+
+def _file_digest(filename: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filename, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class IndexedJsonl:
+    """
+    Random access to the records of an uncompressed jsonl file, by position
+    or by the value of key and its ordinal among the records with that
+    value, e.g. the samples of one task_id in order, which are numbered
+    like the completion_ids of the evaluation.
+    The byte offsets and keys of the records are kept in a sidecar index
+    next to the file (see INDEX_SUFFIX) and reused as long as the file has
+    the same size and either the same mtime or the same content digest;
+    otherwise the index is built again with one scan. The file is
+    memory-mapped and records are decoded only when they are read.
+    """
+
+    def __init__(self, filename: str, key: str = "task_id"):
+        self.filename = os.path.expanduser(filename)
+        if _compression(self.filename) is not None:
+            raise ValueError(f"Only uncompressed files can be indexed, not {filename}.")
+        self.key = key
+        self.index_file = self.filename + INDEX_SUFFIX
+        self._fp = open(self.filename, "rb")
+        stat = os.fstat(self._fp.fileno())
+        # mmap cannot map an empty file.
+        self._mm = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b""
+        index = self._load_index(stat)
+        if index is None:
+            index = self._build_index(stat)
+            self._save_index(index)
+        self.starts, self.ends, self.codes, meta = index
+        self._keys = meta["keys"]
+        # Positions of the records of every key, in file order.
+        order = np.argsort(self.codes, kind="stable")
+        bounds = np.searchsorted(self.codes[order], np.arange(len(self._keys) + 1))
+        self._positions = {value: order[bounds[i]:bounds[i + 1]] for i, value in enumerate(self._keys)}
+
+    def _load_index(self, stat: os.stat_result) -> Optional[tuple]:
+        try:
+            with np.load(self.index_file, allow_pickle=False) as index:
+                starts, ends, codes = index["starts"], index["ends"], index["codes"]
+                meta = loads_json(index["meta"].tobytes())
+        except (OSError, KeyError, ValueError):
+            return None
+        if (meta.get("version"), meta.get("key"), meta.get("size")) != (INDEX_VERSION, self.key, stat.st_size):
+            return None
+        if meta.get("mtime_ns") != stat.st_mtime_ns:
+            # Touched or copied but maybe not changed: compare the contents.
+            if meta.get("digest") != _file_digest(self.filename):
+                return None
+            meta["mtime_ns"] = stat.st_mtime_ns
+            self._save_index((starts, ends, codes, meta))
+        return starts, ends, codes, meta
+
+    def _build_index(self, stat: os.stat_result) -> tuple:
+        starts, ends, codes, keys = [], [], [], {}
+        mm, size, position = self._mm, stat.st_size, 0
+        while position < size:
+            end = mm.find(b"\n", position)
+            if end < 0:
+                end = size
+            line = mm[position:end]
+            if line.strip():
+                value = loads_json(line).get(self.key)
+                starts.append(position)
+                ends.append(end)
+                codes.append(keys.setdefault(value, len(keys)))
+            position = end + 1
+        meta = dict(version=INDEX_VERSION, key=self.key, size=stat.st_size, mtime_ns=stat.st_mtime_ns,
+                    digest=_file_digest(self.filename), keys=list(keys))
+        return (np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64),
+                np.array(codes, dtype=np.int32), meta)
+
+    def _save_index(self, index: tuple):
+        """Writes the index atomically; a directory that is not writable only costs the next reader a scan."""
+        starts, ends, codes, meta = index
+        try:
+            fd, tmp_file = tempfile.mkstemp(prefix=os.path.basename(self.index_file) + ".",
+                                            dir=os.path.dirname(os.path.abspath(self.index_file)))
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                np.savez(fp, starts=starts, ends=ends, codes=codes,
+                         meta=np.frombuffer(dumps_json(meta), dtype=np.uint8))
+            os.replace(tmp_file, self.index_file)
+        except OSError:
+            os.remove(tmp_file)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, position: int) -> Dict:
+        """The record at position, in file order."""
+        return loads_json(self._mm[self.starts[position]:self.ends[position]])
+
+    def __iter__(self) -> Iterable[Dict]:
+        for position in range(len(self)):
+            yield self[position]
+
+    def __contains__(self, value: Any) -> bool:
+        return value in self._positions
+
+    def keys(self) -> List[Any]:
+        """The values of key, in the order of their first record."""
+        return list(self._keys)
+
+    def count(self, value: Any) -> int:
+        positions = self._positions.get(value)
+        return 0 if positions is None else len(positions)
+
+    def get(self, value: Any, ordinal: int = 0) -> Dict:
+        """The ordinal-th record whose key is value; raises KeyError or IndexError if there is none."""
+        return self[self._positions[value][ordinal]]
+
+    def records(self, value: Any) -> Iterable[Dict]:
+        """The records whose key is value, in file order."""
+        for position in self._positions.get(value, ()):
+            yield self[position]
+
+    def close(self):
+        if self._fp is not None:
+            if isinstance(self._mm, mmap.mmap):
+                self._mm.close()
+            self._fp.close()
+            self._fp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LazyProblems(Mapping):
+    """The problems of an IndexedJsonl by task_id, decoded on every lookup; see read_problems."""
+
+    def __init__(self, index: IndexedJsonl):
+        self.index = index
+
+    def __getitem__(self, task_id: str) -> Dict:
+        return self.index.get(task_id)
+
+    def __iter__(self):
+        return iter(self.index.keys())
+
+    def __len__(self) -> int:
+        return len(self.index.keys())
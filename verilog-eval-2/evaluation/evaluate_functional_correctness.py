@@ -12,16 +12,47 @@ def entry_point(
     timeout: float = 30.0,
     unit_test: bool = False,
     clean_up: bool = True,
+    cache_dir: str = None,
+    staged: bool = False,
+    n_compile_workers: int = None,
+    compile_timeout: float = None,
+    resume: bool = False,
+    window: int = None,
+    scratch: str = "tmpfs",
+    engine: str = "process",
+    calibrate: bool = False,
+    timeout_scale: float = 10.0,
+    timeout_slack: float = 2.0,
+    stall_timeout: float = None,
+    heartbeat: int = None,
+    simulator: str = "icarus",
+    verilator_threshold: int = 20000,
+    harness_dir: str = "~/.cache/verilog-eval/verilator",
+    verilator_build_timeout: float = 120.0,
+    task_ids: str = None,
 ):
     """
     Evaluates the functional correctness of generated samples, and writes
     results to f"{sample_file}_results.jsonl.gz"
+    task_ids, a comma-separated list, evaluates only the samples of those tasks.
     """
     if type(k) == tuple:
         k = list(k)
     else:
         k = list(map(int, k.split(",")))
-    results = evaluate_functional_correctness(sample_file, problem_file, k, n_workers, timeout, unit_test, clean_up)
+    if isinstance(task_ids, str):
+        task_ids = task_ids.split(",")
+    results = evaluate_functional_correctness(sample_file, problem_file, k, n_workers, timeout, unit_test, clean_up,
+                                              cache_dir=cache_dir, staged=staged,
+                                              n_compile_workers=n_compile_workers,
+                                              compile_timeout=compile_timeout, resume=resume,
+                                              window=window, scratch=scratch, engine=engine,
+                                              calibrate=calibrate, timeout_scale=timeout_scale,
+                                              timeout_slack=timeout_slack, stall_timeout=stall_timeout,
+                                              heartbeat=heartbeat, simulator=simulator,
+                                              verilator_threshold=verilator_threshold, harness_dir=harness_dir,
+                                              verilator_build_timeout=verilator_build_timeout,
+                                              task_ids=task_ids)
     print(results)
 
 
@@ -0,0 +1,79 @@
+from typing import Optional, Dict, Tuple
+import hashlib
+import json
+import os
+
+from data import dumps_json, loads_json
+
+
+def completion_digest(completion: str) -> str:
+    return hashlib.sha1(completion.encode("utf-8")).hexdigest()
+
+
+class ResultJournal:
+    """
+    Append-only JSONL journal of per-sample results, one line per
+    (task_id, completion_id), flushed as soon as each result is known.
+
+    An interrupted evaluation keeps every result that reached the journal.
+    With resume=True the existing journal is reloaded and lookup() returns
+    the journaled result of a sample as long as its completion is unchanged.
+    """
+
+    def __init__(self, path: str, resume: bool = False, fsync_every: int = 256):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.pending = 0
+        self.done = self.load(path) if resume and os.path.exists(path) else {}
+
+        if resume and os.path.exists(path):
+            # A crash may have left a torn last line; start on a fresh line.
+            torn = False
+            with open(path, "rb") as fp:
+                if fp.seek(0, os.SEEK_END) > 0:
+                    fp.seek(-1, os.SEEK_END)
+                    torn = fp.read(1) != b"\n"
+            self.fp = open(path, "ab")
+            if torn:
+                self.fp.write(b"\n")
+        else:
+            self.fp = open(path, "wb")
+
+    @staticmethod
+    def load(path: str) -> Dict[Tuple[str, int], Dict]:
+        """
+        Reads a journal into a dict keyed by (task_id, completion_id). Later
+        lines win, and lines that cannot be parsed are skipped.
+        """
+        done = {}
+        with open(path, "rb") as fp:
+            for line in fp:
+                try:
+                    entry = loads_json(line)
+                except json.JSONDecodeError:
+                    continue
+                done[(entry["task_id"], entry["completion_id"])] = entry
+        return done
+
+    def lookup(self, task_id: str, completion_id: int, digest: str) -> Optional[Dict]:
+        entry = self.done.get((task_id, completion_id))
+        if entry is not None and entry.get("completion_digest") == digest:
+            return entry
+        return None
+
+    def record(self, result: Dict, digest: str):
+        entry = dict(result, completion_digest=digest)
+        entry.pop("vvp", None)
+        self.fp.write(dumps_json(entry) + b"\n")
+        self.fp.flush()
+        self.pending += 1
+        if self.pending >= self.fsync_every:
+            os.fsync(self.fp.fileno())
+            self.pending = 0
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.flush()
+            os.fsync(self.fp.fileno())
+            self.fp.close()
+            self.fp = None
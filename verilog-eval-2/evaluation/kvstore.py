@@ -0,0 +1,137 @@
+"""
+Key-value table in a SQLite database that several processes may read and
+write at once, the storage of the result and generation caches.
+"""
+from typing import Dict, Optional, Tuple
+import contextlib
+import sqlite3
+import time
+
+
+class KVStore:
+    """
+    Rows of the columns given by name and SQL type, keyed by a string, in
+    table of the SQLite database at path. Entries that have not been used
+    for max_age_days are dropped, and the least recently used entries are
+    dropped once the database grows beyond max_size_mb.
+
+    The database is in WAL mode, so readers never wait for a writer, and
+    the connection is in autocommit mode, so a lookup holds no lock once it
+    returns. Writes, new entries and the access times of hits alike, are
+    buffered and written by flush in a single BEGIN IMMEDIATE transaction
+    that commits at once, every commit_every writes and on close. Another
+    process on the same database waits for at most one such batch; entries
+    it writes meanwhile are visible after the batch, and the later of two
+    writes of a key wins.
+    """
+
+    def __init__(self, path: str, table: str, columns: Dict[str, str], max_size_mb: float,
+                 max_age_days: float, commit_every: int = 256):
+        self.table = table
+        self.columns = list(columns)
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.max_age_seconds = max_age_days * 24 * 3600
+        self.commit_every = commit_every
+        self.pending: Dict[str, Tuple] = {}
+        self.touched: Dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect(path, timeout=60.0, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self._transaction():
+            self.conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                " key TEXT PRIMARY KEY,"
+                + "".join(f" {name} {sql_type}," for name, sql_type in columns.items()) +
+                " created REAL NOT NULL,"
+                " accessed REAL NOT NULL)"
+            )
+            # Tables written by older versions lack the columns added since,
+            # which are therefore nullable.
+            existing = [row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+            for name, sql_type in columns.items():
+                if name not in existing:
+                    self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {sql_type}")
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed)")
+        self.evict()
+
+    def get(self, key: str) -> Optional[Tuple]:
+        """The values of the columns of key, or None if it is not stored."""
+        if key in self.pending:
+            self.hits += 1
+            return self.pending[key]
+        rows = self.conn.execute(f"SELECT {', '.join(self.columns)} FROM {self.table} WHERE key = ?",
+                                 (key,)).fetchall()
+        if not rows:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.touched[key] = time.time()
+        self._maybe_flush()
+        return rows[0]
+
+    def put(self, key: str, *values):
+        """Stores the values of the columns, in their order, under key."""
+        self.pending[key] = values
+        self.touched.pop(key, None)
+        self._maybe_flush()
+
+    def flush(self):
+        """Writes the buffered entries and access times."""
+        if not self.pending and not self.touched:
+            return
+        now = time.time()
+        names = ", ".join(self.columns)
+        placeholders = ", ".join("?" for _ in self.columns)
+        with self._transaction():
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, {names}, created, accessed) "
+                f"VALUES (?, {placeholders}, ?, ?)",
+                [(key, *values, now, now) for key, values in self.pending.items()])
+            self.conn.executemany(f"UPDATE {self.table} SET accessed = ? WHERE key = ?",
+                                  [(accessed, key) for key, accessed in self.touched.items()])
+        self.pending.clear()
+        self.touched.clear()
+
+    def evict(self):
+        """
+        Drops expired entries, then the least recently used entries until the
+        database fits into max_size_mb.
+        """
+        self.flush()
+        with self._transaction():
+            self.conn.execute(f"DELETE FROM {self.table} WHERE accessed < ?", (time.time() - self.max_age_seconds,))
+            page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+            page_count = self.conn.execute("PRAGMA page_count").fetchone()[0]
+            free_count = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+            used_bytes = (page_count - free_count) * page_size
+            if used_bytes > self.max_size_bytes:
+                n_rows = self.conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+                n_drop = n_rows - int(n_rows * 0.9 * self.max_size_bytes / used_bytes)
+                self.conn.execute(f"DELETE FROM {self.table} WHERE key IN "
+                                  f"(SELECT key FROM {self.table} ORDER BY accessed LIMIT ?)", (n_drop,))
+
+    def close(self):
+        if self.conn is not None:
+            self.flush()
+            self.conn.close()
+            self.conn = None
+
+    def _maybe_flush(self):
+        if len(self.pending) + len(self.touched) >= self.commit_every:
+            self.flush()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front (waiting up to the
+        # connection timeout for it), so the transaction cannot fail halfway
+        # because another process started writing after it began reading.
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
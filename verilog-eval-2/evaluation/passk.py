@@ -0,0 +1,152 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from collections import defaultdict
+
+import numpy as np
+
+
+ArrayLike = Union[int, Sequence[int], np.ndarray]
+
+
+def _log_tail_products(max_n: int, ks: np.ndarray) -> np.ndarray:
+    """
+    Returns T with T[j, m] = sum(log(1 - ks[j] / i) for i in ks[j]+1 .. m),
+    and 0 for m <= ks[j]. Then comb(n - c, k) / comb(n, k) equals
+    exp(T[j, n] - T[j, n - c]) whenever n - c >= k.
+    """
+    i = np.arange(max_n + 1, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        terms = np.log1p(-ks[:, None] / np.where(i == 0, 1.0, i)[None, :])
+    terms[i[None, :] <= ks[:, None]] = 0.0
+    return np.cumsum(terms, axis=1)
+
+
+def pass_at_k(
+    num_samples: ArrayLike,
+    num_correct: ArrayLike,
+    ks: Union[int, Sequence[int]],
+) -> np.ndarray:
+    """
+    Unbiased pass@k, 1 - comb(n - c, k) / comb(n, k), for every element of
+    the broadcast of num_samples and num_correct, which may have any shape
+    (e.g. runs x tasks). If ks is a sequence, a trailing axis with one entry
+    per k is appended to the result.
+    """
+    n, c = np.broadcast_arrays(np.asarray(num_samples, dtype=np.int64), np.asarray(num_correct, dtype=np.int64))
+    scalar_k = np.ndim(ks) == 0
+    ks = np.atleast_1d(np.asarray(ks, dtype=np.int64))
+
+    table = _log_tail_products(int(n.max(initial=0)), ks)
+    rows = np.arange(len(ks)).reshape((-1,) + (1,) * n.ndim)
+    log_ratio = table[rows, n[None]] - table[rows, (n - c)[None]]
+    result = np.where((n - c)[None] < ks.reshape(rows.shape), 1.0, -np.expm1(log_ratio))
+    # pass@1 is exactly c / n; avoid the rounding of the log-space product.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result[ks == 1] = np.where(n > 0, c / np.maximum(n, 1), 1.0)[None]
+    result = np.moveaxis(result, 0, -1)
+    return result[..., 0] if scalar_k else result
+
+
+def estimate_pass_at_k(
+    num_samples: Union[int, List[int], np.ndarray],
+    num_correct: Union[List[int], np.ndarray],
+    k: int
+) -> np.ndarray:
+    """
+    Estimates pass@k of each problem and returns them in an array.
+    """
+    return pass_at_k(num_samples, num_correct, k)
+
+
+def confidence_interval(
+    per_task: np.ndarray,
+    alpha: float = 0.05,
+    method: str = "bootstrap",
+    n_bootstrap: int = 1000,
+    seed: Optional[int] = 0,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Confidence interval of the mean over the last axis of per_task, the
+    per-task pass@k values. "bootstrap" resamples tasks with replacement,
+    "normal" uses the normal approximation of the mean. Returns the lower
+    and upper bounds, each with the shape of per_task without its last axis.
+    """
+    per_task = np.asarray(per_task, dtype=np.float64)
+    n_tasks = per_task.shape[-1]
+    if method == "bootstrap":
+        # Each resample is a vector of how often every task was drawn, so all
+        # resampled means are one matrix product.
+        rng = np.random.default_rng(seed)
+        counts = rng.multinomial(n_tasks, np.full(n_tasks, 1.0 / n_tasks), size=n_bootstrap)
+        means = per_task @ counts.T / n_tasks
+        low, high = np.quantile(means, [alpha / 2, 1 - alpha / 2], axis=-1)
+        return low, high
+    elif method == "normal":
+        from statistics import NormalDist
+        z = NormalDist().inv_cdf(1 - alpha / 2)
+        mean = per_task.mean(axis=-1)
+        sem = per_task.std(axis=-1, ddof=1) / np.sqrt(n_tasks) if n_tasks > 1 else np.zeros_like(mean)
+        return mean - z * sem, mean + z * sem
+    raise ValueError(f"Unknown confidence interval method {method!r}, expected 'bootstrap' or 'normal'.")
+
+
+def count_results(
+    results: Iterable[Dict],
+    key: str = "passed",
+    group: str = "task_id",
+) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """
+    Groups result rows by group and counts the rows and the rows whose key
+    is truthy. Returns (group values in first-seen order, num_samples,
+    num_correct).
+    """
+    total, correct = defaultdict(int), defaultdict(int)
+    for row in results:
+        total[row[group]] += 1
+        correct[row[group]] += bool(row[key])
+    names = list(total)
+    return (names, np.array([total[name] for name in names], dtype=np.int64),
+            np.array([correct[name] for name in names], dtype=np.int64))
+
+
+def summarize(
+    num_samples: ArrayLike,
+    num_correct: ArrayLike,
+    ks: Sequence[int] = (1, 10, 100),
+    categories: Optional[Sequence[str]] = None,
+    ci: Optional[str] = None,
+    alpha: float = 0.05,
+    n_bootstrap: int = 1000,
+    seed: Optional[int] = 0,
+    prefix: str = "",
+) -> Dict:
+    """
+    Mean pass@k over tasks (the last axis) for every k in ks that every task
+    has enough samples for, keyed f"{prefix}pass@{k}". With ci set to
+    "bootstrap" or "normal", f"{prefix}pass@{k}_ci" holds the interval; with
+    categories (one per task) given, "by_category" holds the same summary
+    per category. Values are floats, or lists of floats when num_samples
+    has more than one axis (one entry per run).
+    """
+    n = np.asarray(num_samples, dtype=np.int64)
+    c = np.asarray(num_correct, dtype=np.int64)
+    n = np.broadcast_to(n, c.shape)
+    ks = [k for k in ks if (n >= k).all()]
+    summary = {}
+    if not ks:
+        return summary
+
+    per_task = pass_at_k(n, c, ks)
+    for j, k in enumerate(ks):
+        summary[f"{prefix}pass@{k}"] = per_task[..., j].mean(axis=-1).tolist()
+        if ci is not None:
+            low, high = confidence_interval(per_task[..., j], alpha, ci, n_bootstrap, seed)
+            summary[f"{prefix}pass@{k}_ci"] = np.stack([low, high], axis=-1).tolist()
+
+    if categories is not None:
+        categories = np.asarray(categories)
+        summary["by_category"] = {
+            str(category): summarize(n[..., categories == category], c[..., categories == category], ks,
+                                     None, ci, alpha, n_bootstrap, seed, prefix)
+            for category in dict.fromkeys(categories.tolist())
+        }
+    return summary
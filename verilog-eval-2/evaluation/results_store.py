@@ -0,0 +1,326 @@
+"""
+Indexed store of evaluation results. ResultStore ingests results files, the
+"<samples>_results.jsonl" files of evaluate_functional_correctness and the
+"rtllm_results_<simulator>.jsonl" files of RTLLM/auto_run.py, into a SQLite
+database with one row per sample (pass/fail, failure class and timings),
+and keeps the sample and pass counts of every (run, task) next to them, so
+that pass@k, failure and timing breakdowns grouped by benchmark, model,
+mode or temperature are computed from the counts instead of re-reading
+the results files. Files that have not changed since they were ingested
+are skipped.
+"""
+from collections import defaultdict
+from typing import Dict, Iterable, List, Sequence, Tuple, Union
+import fnmatch
+import os
+import re
+import sqlite3
+import time
+
+import numpy as np
+
+from data import stream_jsonl
+from passk import summarize
+
+# Run metadata by path, matching the layout benchmark_infer.py writes, and
+# the prefix of the benchmark name. Results files elsewhere are ingested
+# with the metadata given to ingest.
+RUN_PATTERNS = [
+    (re.compile(r"VerilogEval-v2/(?P<benchmark>[^/]+)/(?P<model>[^/]+)/"
+                r"VerilogEval_(?P<mode>high|low)\.jsonl_results\.jsonl(\.gz)?$"), "VerilogEval-v2/"),
+    (re.compile(r"VerilogEval-v2/(?P<benchmark>[^/]+)/(?P<model>[^/]+)/"
+                r"VerilogEval_(?P<temperature>[0-9.]+)\.jsonl_results\.jsonl(\.gz)?$"), "VerilogEval-v2/"),
+    (re.compile(r"VerilogEval-v1/(?P<model>[^/]+)/VerilogEval_(?P<benchmark>[^/_]+)_"
+                r"temp(?P<temperature>[0-9.]+)\.jsonl_results\.jsonl(\.gz)?$"), "VerilogEval-v1/"),
+    (re.compile(r"RTLLM_Benchmark/(?P<model>[^/]+)/temperature_(?P<temperature>[0-9.]+)/"
+                r"rtllm_results_\w+\.jsonl$"), "RTLLM"),
+]
+# Sampling temperature of the VerilogEval v2 modes.
+MODE_TEMPERATURES = {"high": 0.85, "low": 0.0}
+RESULTS_FILES = ("*_results.jsonl", "*_results.jsonl.gz", "rtllm_results_*.jsonl")
+RUN_FIELDS = ("benchmark", "model", "mode", "temperature")
+SAMPLE_COLUMNS = ("run_id", "task_id", "completion_id", "passed", "result", "failure", "mismatches", "elapsed",
+                  "compile_wall", "simulate_wall", "cpu", "maxrss_kb", "code")
+
+MISMATCH = re.compile(r"failed: ([0-9]+) out of ([0-9]+) samples")
+
+
+def failure_class(result: str) -> str:
+    """
+    The failure class of a result string of check_correctness (or of
+    RTLLM/auto_run.py): "passed", "syntax error", "compile error",
+    "mismatch", "no summary", "timed out", "stalled", "cancelled" or "other".
+    """
+    if result == "passed":
+        return "passed"
+    if result in ("failed: syntax error.", "syntax error"):
+        return "syntax error"
+    if result == "failed: compile error.":
+        return "compile error"
+    if MISMATCH.match(result) or result == "failed":
+        return "mismatch"
+    if result == "failed: info string not matched.":
+        return "no summary"
+    if result in ("timed out", "compile timed out"):
+        return "timed out"
+    if result in ("stalled", "cancelled"):
+        return result
+    return "other"
+
+
+def run_metadata(path: str) -> Dict:
+    """The benchmark, model, mode and temperature of a results file, as far as its path tells them."""
+    path = os.path.abspath(path).replace(os.sep, "/")
+    for pattern, prefix in RUN_PATTERNS:
+        match = pattern.search(path)
+        if match is None:
+            continue
+        fields = match.groupdict()
+        mode = fields.get("mode")
+        temperature = fields.get("temperature")
+        benchmark = prefix + (fields.get("benchmark") or "")
+        # benchmark_infer.py names run directories f"{model}-{fold}", with an empty fold by default.
+        model = fields["model"][:-1] if fields["model"].endswith("-") else fields["model"]
+        return dict(benchmark=benchmark, model=model, mode=mode,
+                    temperature=float(temperature) if temperature is not None else MODE_TEMPERATURES.get(mode))
+    return dict(benchmark=None, model=None, mode=None, temperature=None)
+
+
+def _sample_rows(path: str) -> Iterable[Tuple]:
+    """
+    Yields (task_id, completion_id, passed, result, failure, mismatches,
+    elapsed, compile_wall, simulate_wall, cpu, maxrss_kb, code) for every
+    sample of a results file; elapsed is the wall time of all stages,
+    maxrss_kb the peak RSS of its tools and code the failure code recorded by the evaluation, if any (see
+    failures.FAILURE_CODES). Samples without a completion_id are numbered
+    per task.
+    """
+    seen = defaultdict(int)
+    for row in stream_jsonl(path):
+        if "summary" in row:
+            continue
+        if "design" in row:
+            # RTLLM/auto_run.py
+            task_id, completion_id, passed = row["design"], row["sample"], row["func"]
+            result = row.get("result", "passed" if passed else "failed")
+            elapsed, usage, code = row.get("elapsed"), {}, None
+        else:
+            task_id = row["task_id"]
+            completion_id = row.get("completion_id", seen[task_id])
+            passed, result = row.get("passed", False), row.get("result", "")
+            usage = row.get("usage") or {}
+            elapsed = sum(stage.get("wall", 0.0) for stage in usage.values()) if usage else None
+            code = row.get("failure")
+        seen[task_id] = completion_id + 1
+        match = MISMATCH.match(result)
+        stages = usage.values()
+        peaks = [stage["maxrss_kb"] for stage in stages if stage.get("maxrss_kb")]
+        yield (task_id, completion_id, int(bool(passed)), result, failure_class(result),
+               int(match.group(1)) if match else None, elapsed,
+               usage.get("compile", {}).get("wall"), usage.get("simulate", {}).get("wall"),
+               sum(stage.get("user", 0.0) + stage.get("sys", 0.0) for stage in stages) if usage else None,
+               max(peaks) if peaks else None, code)
+
+
+class ResultStore:
+    """
+    SQLite store of evaluation results; see the module docstring. Like
+    ResultCache, the database runs in WAL mode, so it can be queried while
+    another process ingests.
+    """
+
+    def __init__(self, path: str):
+        path = os.path.expanduser(path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60.0)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            " run_id INTEGER PRIMARY KEY,"
+            " path TEXT UNIQUE NOT NULL,"
+            " benchmark TEXT, model TEXT, mode TEXT, temperature REAL,"
+            " mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL, ingested REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS runs_group ON runs (benchmark, model, temperature);"
+            "CREATE TABLE IF NOT EXISTS samples ("
+            " run_id INTEGER NOT NULL, task_id TEXT NOT NULL, completion_id INTEGER NOT NULL,"
+            " passed INTEGER NOT NULL, result TEXT NOT NULL, failure TEXT NOT NULL, mismatches INTEGER,"
+            " elapsed REAL, compile_wall REAL, simulate_wall REAL, cpu REAL, maxrss_kb INTEGER, code TEXT,"
+            " PRIMARY KEY (run_id, task_id, completion_id)) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS task_counts ("
+            " run_id INTEGER NOT NULL, task_id TEXT NOT NULL, n INTEGER NOT NULL, c INTEGER NOT NULL,"
+            " PRIMARY KEY (run_id, task_id)) WITHOUT ROWID;"
+        )
+        # Stores written before failure codes, or peak RSS measurements, were
+        # recorded lack their columns.
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(samples)")]
+        for name, sql_type in (("code", "TEXT"), ("maxrss_kb", "INTEGER")):
+            if name not in columns:
+                self.conn.execute(f"ALTER TABLE samples ADD COLUMN {name} {sql_type}")
+        self.conn.commit()
+
+    def ingest(self, path: str, force: bool = False, **metadata) -> int:
+        """
+        Ingests the results file path as one run and returns its number of
+        samples, or 0 if it is unchanged since it was last ingested (unless
+        force is set). A changed file replaces the samples of its run.
+        metadata (benchmark, model, mode, temperature) overrides what
+        run_metadata reads from the path, and both override the fields
+        the run was ingested with before.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        row = self.conn.execute("SELECT run_id, mtime_ns, size FROM runs WHERE path = ?", (path,)).fetchone()
+        if row is not None and not force and row[1:] == (stat.st_mtime_ns, stat.st_size):
+            return 0
+        unknown = set(metadata) - set(RUN_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown run fields {sorted(unknown)}, expected some of {RUN_FIELDS}.")
+        # A run keeps the fields it was ingested with unless they are given again.
+        fields = dict.fromkeys(RUN_FIELDS)
+        if row is not None:
+            stored = self.conn.execute(f"SELECT {', '.join(RUN_FIELDS)} FROM runs WHERE run_id = ?", (row[0],))
+            fields.update(zip(RUN_FIELDS, stored.fetchone()))
+        for source in (run_metadata(path), metadata):
+            fields.update({key: value for key, value in source.items() if value is not None})
+
+        samples = list(_sample_rows(path))
+        with self.conn:
+            if row is not None:
+                run_id = row[0]
+                self.conn.execute("DELETE FROM samples WHERE run_id = ?", (run_id,))
+                self.conn.execute("DELETE FROM task_counts WHERE run_id = ?", (run_id,))
+                self.conn.execute("UPDATE runs SET benchmark = ?, model = ?, mode = ?, temperature = ?, "
+                                  "mtime_ns = ?, size = ?, ingested = ? WHERE run_id = ?",
+                                  (*[fields[key] for key in RUN_FIELDS], stat.st_mtime_ns, stat.st_size,
+                                   time.time(), run_id))
+            else:
+                run_id = self.conn.execute(
+                    "INSERT INTO runs (path, benchmark, model, mode, temperature, mtime_ns, size, ingested) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (path, *[fields[key] for key in RUN_FIELDS], stat.st_mtime_ns, stat.st_size, time.time()),
+                ).lastrowid
+            # Columns are named, since columns added to older stores come last.
+            self.conn.executemany(f"INSERT OR REPLACE INTO samples ({', '.join(SAMPLE_COLUMNS)}) "
+                                  f"VALUES ({', '.join('?' for _ in SAMPLE_COLUMNS)})",
+                                  ((run_id, *sample) for sample in samples))
+            self.conn.execute("INSERT INTO task_counts SELECT run_id, task_id, COUNT(*), SUM(passed) "
+                              "FROM samples WHERE run_id = ? GROUP BY task_id", (run_id,))
+        return len(samples)
+
+    def ingest_tree(self, root: str, force: bool = False) -> Dict[str, int]:
+        """Ingests every results file (see RESULTS_FILES) below root; returns the samples ingested per file."""
+        ingested = {}
+        for dirpath, _, filenames in os.walk(root):
+            for name in sorted(filenames):
+                if any(fnmatch.fnmatch(name, pattern) for pattern in RESULTS_FILES):
+                    path = os.path.join(dirpath, name)
+                    ingested[path] = self.ingest(path, force)
+        return ingested
+
+    @staticmethod
+    def _where(filters: Dict) -> Tuple[str, List]:
+        """SQL condition on runs r selecting runs whose fields equal (or, for lists, are in) filters."""
+        clauses, params = [], []
+        for key, value in filters.items():
+            if key not in RUN_FIELDS + ("path",):
+                raise ValueError(f"Unknown run field {key!r}, expected one of {RUN_FIELDS}.")
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple)):
+                clauses.append(f"r.{key} IN ({', '.join('?' * len(value))})")
+                params.extend(value)
+            else:
+                clauses.append(f"r.{key} = ?")
+                params.append(value)
+        return " AND ".join(clauses) or "1", params
+
+    @staticmethod
+    def _group_columns(group_by: Union[str, Sequence[str]]) -> List[str]:
+        group_by = [group_by] if isinstance(group_by, str) else list(group_by)
+        for key in group_by:
+            if key not in RUN_FIELDS:
+                raise ValueError(f"Cannot group by {key!r}, expected some of {RUN_FIELDS}.")
+        return group_by
+
+    def runs(self, **filters) -> List[Dict]:
+        where, params = self._where(filters)
+        cursor = self.conn.execute(
+            "SELECT r.run_id, r.path, r.benchmark, r.model, r.mode, r.temperature, COUNT(t.task_id), SUM(t.n) "
+            f"FROM runs r LEFT JOIN task_counts t USING (run_id) WHERE {where} GROUP BY r.run_id "
+            "ORDER BY r.benchmark, r.model, r.temperature", params)
+        return [dict(zip(("run_id", "path", "benchmark", "model", "mode", "temperature", "tasks", "samples"), row))
+                for row in cursor]
+
+    def pass_at_k(self, ks: Sequence[int] = (1,), group_by: Union[str, Sequence[str]] = ("benchmark", "model"),
+                  **filters) -> List[Dict]:
+        """
+        Mean pass@k over tasks of every group of runs selected by filters
+        (see passk.summarize). Samples of the same task in several runs of a
+        group are pooled.
+        """
+        group_by = self._group_columns(group_by)
+        where, params = self._where(filters)
+        columns = ", ".join(f"r.{key}" for key in group_by)
+        cursor = self.conn.execute(
+            f"SELECT {columns}, t.task_id, SUM(t.n), SUM(t.c) FROM task_counts t JOIN runs r USING (run_id) "
+            f"WHERE {where} GROUP BY {columns}, t.task_id ORDER BY {columns}", params)
+        counts = defaultdict(list)
+        for row in cursor:
+            counts[row[:len(group_by)]].append(row[-2:])
+        rows = []
+        for group, task_counts in counts.items():
+            total, correct = np.array(task_counts, dtype=np.int64).T
+            rows.append(dict(zip(group_by, group), tasks=len(task_counts), samples=int(total.sum()),
+                             **summarize(total, correct, ks)))
+        return rows
+
+    def failures(self, group_by: Union[str, Sequence[str]] = ("benchmark", "model"), codes: bool = False,
+                 **filters) -> List[Dict]:
+        """
+        Number of samples of every failure class (see failure_class) in every
+        group of runs, or with codes set of every failure code recorded by
+        the evaluation (see failures.FAILURE_CODES), None for samples
+        without one.
+        """
+        group_by = self._group_columns(group_by)
+        where, params = self._where(filters)
+        columns = ", ".join(f"r.{key}" for key in group_by)
+        failure = "s.code" if codes else "s.failure"
+        cursor = self.conn.execute(
+            f"SELECT {columns}, {failure}, COUNT(*) FROM samples s JOIN runs r USING (run_id) "
+            f"WHERE {where} GROUP BY {columns}, {failure} ORDER BY {columns}", params)
+        groups = {}
+        for row in cursor:
+            group = groups.setdefault(row[:len(group_by)], dict(zip(group_by, row[:len(group_by)])))
+            group[row[-2]] = row[-1]
+        return list(groups.values())
+
+    def timings(self, group_by: Union[str, Sequence[str]] = ("benchmark", "model"), **filters) -> List[Dict]:
+        """
+        Total wall time of the samples, total and mean wall time of the
+        compile and simulate stages, total CPU time and largest peak RSS of
+        every group of runs.
+        """
+        group_by = self._group_columns(group_by)
+        where, params = self._where(filters)
+        columns = ", ".join(f"r.{key}" for key in group_by)
+        cursor = self.conn.execute(
+            f"SELECT {columns}, COUNT(*), SUM(s.elapsed), SUM(s.compile_wall), SUM(s.simulate_wall), SUM(s.cpu), "
+            f"MAX(s.maxrss_kb), AVG(s.compile_wall), AVG(s.simulate_wall) "
+            f"FROM samples s JOIN runs r USING (run_id) WHERE {where} GROUP BY {columns} ORDER BY {columns}",
+            params)
+        names = ("samples", "elapsed", "compile_wall", "simulate_wall", "cpu", "maxrss_kb", "mean_compile_wall",
+                 "mean_simulate_wall")
+        return [dict(zip(group_by, row[:len(group_by)]), **dict(zip(names, row[len(group_by):]))) for row in cursor]
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
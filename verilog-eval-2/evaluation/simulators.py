@@ -0,0 +1,147 @@
+"""
+Choice of the simulator of every task. Icarus Verilog (iverilog and vvp)
+simulates every task by default. Verilator compiles the testbench and the
+design to a native executable, which costs a C++ build per sample but runs
+the long testbenches many times faster than vvp interprets them, so "auto"
+hands it the tasks whose testbench runs at least a threshold of repeat
+iterations.
+Every Verilator task gets a harness: the Verilator build directory of its
+reference solution, built once and cached. Each sample is built in a copy
+of it, so that the Verilator runtime is not compiled again for every sample.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+from execution import (build_verilog_test, reference_completion, simulator_version, IVERILOG_FLAGS,
+                       VERILATOR_BINARY, VERILATOR_BUILD_TIMEOUT, VERILATOR_FLAGS, VERILATOR_MDIR,
+                       VERILATOR_SOURCE)
+
+SIMULATORS = ("icarus", "verilator", "auto")
+HARNESS_CACHE_DIR = "~/.cache/verilog-eval/verilator"
+
+_verilator_version = None
+
+
+def verilator_version() -> Optional[str]:
+    """Returns the version banner of the verilator in the current run path, or None if there is none."""
+    global _verilator_version
+    if _verilator_version is None:
+        try:
+            out = subprocess.run(["verilator", "--version"], capture_output=True, text=True).stdout
+            _verilator_version = out.strip() or "unknown"
+        except OSError:
+            _verilator_version = ""
+    return _verilator_version or None
+
+
+def simulator_key(simulator: Optional[Dict]) -> Tuple[str, str]:
+    """The flags and version that cached results of simulator are keyed by (see ResultCache.make_key)."""
+    if simulator is None:
+        return IVERILOG_FLAGS, simulator_version()
+    return IVERILOG_FLAGS + " " + VERILATOR_FLAGS, simulator_version() + " " + verilator_version()
+
+
+def testbench_length(verilog_test: str) -> int:
+    """Number of iterations of all repeat loops of verilog_test, a proxy of its simulation time."""
+    return sum(int(count) for count in re.findall(r"repeat\s*\(\s*([0-9]+)\s*\)", verilog_test))
+
+
+def prepare_harness(task_id: str, verilog_test: str, cache_dir: str = HARNESS_CACHE_DIR,
+                    timeout: float = 600.0) -> Optional[str]:
+    """
+    Returns the harness of a task, whose reference solution against its
+    testbench is verilog_test, building it first unless it is cached.
+    Harnesses are keyed by the Verilator version, flags and build layout
+    and by verilog_test. A harness is built the way _build_flow in execution
+    builds the samples in a copy of it: from VERILATOR_SOURCE into
+    VERILATOR_MDIR, relative to the harness directory. Returns None if
+    Verilator cannot build the reference, which is remembered next to the
+    harness.
+    """
+    cache_dir = os.path.expanduser(cache_dir)
+    digest = hashlib.sha256()
+    for part in (verilator_version(), VERILATOR_FLAGS, VERILATOR_SOURCE, VERILATOR_MDIR, verilog_test):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    path = os.path.join(cache_dir, "{}-{}".format(task_id, digest.hexdigest()[:16]))
+    if os.path.isdir(path):
+        return path
+    if os.path.exists(path + ".failed"):
+        return None
+
+    os.makedirs(cache_dir, exist_ok=True)
+    build = tempfile.mkdtemp(prefix=task_id + "-", dir=cache_dir)
+    try:
+        with open(os.path.join(build, VERILATOR_SOURCE), "w") as f:
+            f.write(verilog_test)
+        objdir = os.path.join(build, VERILATOR_MDIR)
+        try:
+            p = subprocess.run(["verilator", *VERILATOR_FLAGS.split(), "-j", "0", "--Mdir", VERILATOR_MDIR,
+                                VERILATOR_SOURCE], capture_output=True, text=True, timeout=timeout, cwd=build)
+            log = p.stdout + p.stderr
+        except subprocess.TimeoutExpired:
+            return None
+        if not os.path.exists(os.path.join(objdir, VERILATOR_BINARY)):
+            with open(path + ".failed", "w") as f:
+                f.write(log[-10000:])
+            return None
+        # Without the reference's executable in the harness, a sample that
+        # Verilator fails to build cannot end up running the reference.
+        os.remove(os.path.join(objdir, VERILATOR_BINARY))
+        try:
+            os.rename(build, path)
+        except OSError:
+            # Another run has just built the same harness.
+            pass
+        return path
+    finally:
+        shutil.rmtree(build, ignore_errors=True)
+
+
+def select_simulators(problems: Dict[str, Dict], simulator: str = "icarus", threshold: int = 20000,
+                      cache_dir: str = HARNESS_CACHE_DIR, unit_test_length: Optional[int] = None,
+                      n_workers: int = 4, build_timeout: float = VERILATOR_BUILD_TIMEOUT) -> Dict[str, Optional[Dict]]:
+    """
+    Returns the simulator of every task: None for Icarus Verilog, or
+    {"name": "verilator", "harness": path, "build_timeout": build_timeout}
+    for Verilator, where build_timeout limits the Verilator build of each
+    sample (see build_timeout in execution), with simulator one of
+    SIMULATORS. "verilator" uses Verilator for every task and "auto" for
+    the tasks whose testbench_length is at least threshold. Harnesses are
+    built by n_workers threads; tasks without a harness, and all tasks when
+    Verilator is not installed, stay on Icarus Verilog. Verilator builds are
+    cached by ccache if it is installed.
+    """
+    if simulator not in SIMULATORS:
+        raise ValueError(f"Unknown simulator {simulator!r}, expected one of {SIMULATORS}.")
+    chosen = {task_id: None for task_id in problems}
+    if simulator == "icarus":
+        return chosen
+    if verilator_version() is None:
+        print("Verilator is not installed, simulating every task with Icarus Verilog.")
+        return chosen
+
+    tests = {}
+    for task_id, problem in problems.items():
+        verilog_test = build_verilog_test(problem, reference_completion(problem), unit_test_length)
+        if simulator == "verilator" or testbench_length(verilog_test) >= threshold:
+            tests[task_id] = verilog_test
+    if shutil.which("ccache"):
+        os.environ.setdefault("OBJCACHE", "ccache")
+
+    print(f"Preparing Verilator harnesses of {len(tests)} tasks in {cache_dir}...")
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        harnesses = dict(zip(tests, executor.map(prepare_harness, tests, tests.values(),
+                                                 [cache_dir] * len(tests))))
+    for task_id, harness in harnesses.items():
+        if harness is None:
+            print(f"Verilator cannot build the reference of {task_id}, simulating it with Icarus Verilog.")
+        else:
+            chosen[task_id] = dict(name="verilator", harness=harness, build_timeout=build_timeout)
+    return chosen
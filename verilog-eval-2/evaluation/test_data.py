@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from data import IndexedJsonl, write_jsonl, INDEX_SUFFIX
+
+RECORDS = [dict(task_id=task_id, completion=f"c{i}") for i, task_id in enumerate("abacab")]
+
+
+def test_records_by_key_and_position(tmp_path):
+    path = str(tmp_path / "samples.jsonl")
+    write_jsonl(path, RECORDS)
+    with IndexedJsonl(path) as index:
+        assert len(index) == len(RECORDS)
+        assert index[3] == RECORDS[3]
+        assert list(index) == RECORDS
+        assert index.keys() == ["a", "b", "c"]
+        assert [record["completion"] for record in index.records("a")] == ["c0", "c2", "c4"]
+        assert index.get("b", 1) == RECORDS[5]
+        assert index.count("c") == 1 and index.count("d") == 0
+        assert "d" not in index
+        with pytest.raises(IndexError):
+            index.get("c", 1)
+    assert os.path.exists(path + INDEX_SUFFIX)
+
+
+def test_sidecar_is_reused_while_the_content_is_unchanged(tmp_path, monkeypatch):
+    path = str(tmp_path / "samples.jsonl")
+    write_jsonl(path, RECORDS)
+    IndexedJsonl(path).close()
+
+    def build_index(self, stat):
+        raise AssertionError("index rebuilt")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(IndexedJsonl, "_build_index", build_index)
+        # A new mtime alone does not invalidate the index.
+        os.utime(path, ns=(0, 0))
+        IndexedJsonl(path).close()
+        IndexedJsonl(path).close()
+
+
+def test_sidecar_is_rebuilt_when_the_file_changes(tmp_path):
+    path = str(tmp_path / "samples.jsonl")
+    write_jsonl(path, RECORDS)
+    IndexedJsonl(path).close()
+
+    # Same size, other keys: the digest tells the change.
+    records = [dict(record, task_id="d" if record["task_id"] == "a" else record["task_id"]) for record in RECORDS]
+    size = os.path.getsize(path)
+    write_jsonl(path, records)
+    os.utime(path, ns=(0, 0))
+    assert os.path.getsize(path) == size
+    with IndexedJsonl(path) as index:
+        assert index.keys() == ["d", "b", "c"]
+
+    write_jsonl(path, records + [dict(task_id="e", completion="c6")])
+    with IndexedJsonl(path) as index:
+        assert index.keys() == ["d", "b", "c", "e"]
+        assert index.get("e") == dict(task_id="e", completion="c6")
@@ -0,0 +1,83 @@
+import asyncio
+import math
+import random
+
+import evaluation
+from data import stream_jsonl, write_jsonl
+from journal import completion_digest, ResultJournal
+
+TASKS = ["Prob001_a", "Prob002_b", "Prob003_c"]
+
+
+class FakeCheck:
+    """check_correctness_async that passes completions ending in "ok" after a random delay."""
+
+    def __init__(self):
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+
+    async def __call__(self, problem, completion, timeout, completion_id=None, unit_test_length=None,
+                       stall_timeout=None, heartbeat=None, scratch=None):
+        self.calls.append((problem["task_id"], completion_id))
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(random.random() * 0.005)
+        self.running -= 1
+        passed = completion.endswith("ok")
+        return dict(task_id=problem["task_id"], passed=passed,
+                    result="passed" if passed else "failed: 1 out of 2 samples.", completion_id=completion_id,
+                    elapsed=0.0, failure="." if passed else "R")
+
+
+def write_inputs(tmp_path, n_per_task=20):
+    problem_file = str(tmp_path / "problems.jsonl")
+    write_jsonl(problem_file, [dict(task_id=task_id, prompt="", canonical_solution="", test="") for task_id in TASKS])
+    samples = [dict(task_id=task_id, completion=f"{task_id} {i} {'ok' if i % 3 == 0 else 'no'}")
+               for i in range(n_per_task) for task_id in TASKS]
+    sample_file = str(tmp_path / "samples.jsonl")
+    write_jsonl(sample_file, samples)
+    return problem_file, sample_file, samples
+
+
+def results_of(sample_file):
+    return [row for row in stream_jsonl(sample_file + "_results.jsonl") if "summary" not in row]
+
+
+def test_results_are_written_in_input_order_within_the_window(tmp_path, monkeypatch):
+    random.seed(0)
+    check = FakeCheck()
+    monkeypatch.setattr(evaluation, "check_correctness_async", check)
+    problem_file, sample_file, samples = write_inputs(tmp_path)
+
+    pass_at_k = evaluation.evaluate_functional_correctness(sample_file, problem_file, k=[1], n_workers=4,
+                                                           engine="async", window=8)
+    results = results_of(sample_file)
+    assert [(row["task_id"], row["completion"]) for row in results] == \
+        [(sample["task_id"], sample["completion"]) for sample in samples]
+    assert all(row["passed"] == row["completion"].endswith("ok") for row in results)
+    assert math.isclose(pass_at_k["pass@1"], sum(row["passed"] for row in results) / len(results))
+    assert len(check.calls) == len(samples)
+    assert 1 < check.max_running <= 4
+
+
+def test_resume_skips_journaled_samples(tmp_path, monkeypatch):
+    check = FakeCheck()
+    monkeypatch.setattr(evaluation, "check_correctness_async", check)
+    problem_file, sample_file, samples = write_inputs(tmp_path, n_per_task=4)
+
+    # An interrupted run journaled the first completion of every task as passed,
+    # and the second one of a completion that has changed since.
+    journal = ResultJournal(sample_file + "_results.journal.jsonl")
+    for task_id in TASKS:
+        completion = next(sample["completion"] for sample in samples if sample["task_id"] == task_id)
+        journal.record(dict(task_id=task_id, completion_id=0, passed=True, result="passed", elapsed=0.0,
+                            failure="."), completion_digest(completion))
+        journal.record(dict(task_id=task_id, completion_id=1, passed=True, result="passed", elapsed=0.0,
+                            failure="."), completion_digest("changed"))
+    journal.close()
+
+    evaluation.evaluate_functional_correctness(sample_file, problem_file, k=[1], n_workers=2, engine="async",
+                                               resume=True)
+    assert sorted(check.calls) == sorted((task_id, cid) for task_id in TASKS for cid in (1, 2, 3))
+    assert len(results_of(sample_file)) == len(samples)
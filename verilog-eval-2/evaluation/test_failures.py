@@ -0,0 +1,75 @@
+import ast
+import os
+import re
+from dataclasses import dataclass
+
+import pytest
+
+from failures import failure_code, scan_log
+
+SV_IV_ANALYZE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts", "sv-iv-analyze")
+
+LOGS = [
+    "Mismatches: 0 in 100 samples\n",
+    "Mismatches: 3 in 100 samples\n",
+    "Hint: Output 'out' has 3 mismatches.\nMismatches: 3 in 100 samples\n",
+    "top.sv:4: syntax error\nI give up.\n",
+    "top.sv:7: error: This assignment requires an explicit cast.\n1 error(s) during elaboration.\n",
+    "top.sv:3: error: Sized numeric constant must have a size greater than zero.\n",
+    "top.sv:9: warning: always_comb process has no sensitivities.\nMismatches: 0 in 20 samples\n",
+    "top.sv:9: sorry: constant selects in always_* processes are not currently supported "
+    "(found no sensitivities so it will never trigger).\n",
+    "top.sv:5: error: reg out; cannot be driven by primitives or continuous assignment.\n"
+    "top.sv:2:      : out is declared here as wire.\n",
+    "top.sv:12: error: Unknown module type: dff\n",
+    "top.sv:8: error: Unable to bind wire/reg/memory `clk' in `tb.top_module1'\n",
+    "top.sv:8: error: Unable to bind wire/reg/memory `q_next' in `tb.top_module1'\n",
+    "top.sv:8: error: Unable to bind wire/reg/memory `q_next' in `tb.top_module1'\n"
+    "top.sv:8: error: Unknown module type: foo\n",
+    "TIMEOUT\nMismatches: 10 in 10 samples\n",
+    "top.sv:1: error: port ``x'' is not a port of top_module1.\n",
+    "",
+]
+COMPLETIONS = [
+    "always @(posedge clk) q <= d;\n",
+    "always @(posedge clk, posedge reset) if (reset) q <= 0;\n",
+    "always @(negedge reset) q <= 0;\n",
+    "always @(posedge clk or posedge r) q <= 0;\n",
+]
+
+
+def load_analyze_result():
+    """analyze_result of sv-iv-analyze, without the script's own imports and command line."""
+    with open(SV_IV_ANALYZE) as fp:
+        tree = ast.parse(fp.read())
+    nodes = [node for node in tree.body
+             if isinstance(node, (ast.ClassDef, ast.FunctionDef)) and node.name in ("ResultRecord", "analyze_result")]
+    namespace = dict(re=re, dataclass=dataclass)
+    exec(compile(ast.Module(body=nodes, type_ignores=[]), SV_IV_ANALYZE, "exec"), namespace)
+    return namespace["analyze_result"]
+
+
+class Recorder:
+    def add_result(self, problem, sample, record):
+        self.record = record
+
+
+@pytest.mark.parametrize("completion", COMPLETIONS)
+@pytest.mark.parametrize("log", LOGS)
+def test_codes_match_sv_iv_analyze(tmp_path, log, completion):
+    analyze_result = load_analyze_result()
+    paths = {}
+    for name, text in (("generate", ""), ("compile", log), ("verilog", completion)):
+        paths[name] = tmp_path / f"{name}.log"
+        paths[name].write_text(text)
+    results = Recorder()
+    analyze_result(results, "Prob001", 1, paths["generate"], paths["compile"], paths["verilog"])
+    result = "passed" if results.record.passfail == "." else "failed: info string not matched."
+    assert failure_code(result, scan_log(log), completion) == results.record.passfail
+
+
+def test_timeouts_and_pending_samples():
+    assert failure_code("timed out", None, "") == "T"
+    assert failure_code("stalled", None, "") == "T"
+    assert failure_code("cancelled", "S", "") is None
+    assert failure_code("compiled", None, "") is None
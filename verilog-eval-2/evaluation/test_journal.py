@@ -0,0 +1,40 @@
+from journal import completion_digest, ResultJournal
+
+
+def result(task_id, completion_id, passed):
+    return dict(task_id=task_id, completion_id=completion_id, passed=passed,
+                result="passed" if passed else "failed: 1 out of 2 samples.")
+
+
+def test_resume_returns_results_of_unchanged_completions(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = ResultJournal(path)
+    journal.record(result("a", 0, True), completion_digest("x"))
+    journal.record(result("a", 1, False), completion_digest("y"))
+    journal.close()
+
+    journal = ResultJournal(path, resume=True)
+    assert journal.lookup("a", 0, completion_digest("x"))["passed"] is True
+    assert journal.lookup("a", 1, completion_digest("changed")) is None
+    assert journal.lookup("b", 0, completion_digest("x")) is None
+    journal.close()
+
+
+def test_resume_after_torn_line(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = ResultJournal(path)
+    journal.record(result("a", 0, False), completion_digest("x"))
+    journal.close()
+    with open(path, "ab") as fp:
+        fp.write(b'{"task_id": "a", "completion_id": 1, "pass')
+
+    journal = ResultJournal(path, resume=True)
+    assert set(journal.done) == {("a", 0)}
+    journal.record(result("a", 0, True), completion_digest("x"))
+    journal.record(result("a", 1, True), completion_digest("y"))
+    journal.close()
+
+    done = ResultJournal.load(path)
+    assert set(done) == {("a", 0), ("a", 1)}
+    # Later lines win.
+    assert done[("a", 0)]["passed"] is True
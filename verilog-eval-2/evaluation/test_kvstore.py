@@ -0,0 +1,65 @@
+import time
+
+from kvstore import KVStore
+
+COLUMNS = dict(value="BLOB NOT NULL")
+
+
+def test_put_get_and_reopen(tmp_path):
+    path = str(tmp_path / "store.sqlite3")
+    store = KVStore(path, "entries", COLUMNS, max_size_mb=16, max_age_days=1)
+    store.put("a", b"1")
+    assert store.get("a") == (b"1",)
+    assert store.get("b") is None
+    assert (store.hits, store.misses) == (1, 1)
+    store.close()
+
+    store = KVStore(path, "entries", dict(COLUMNS, note="TEXT"), max_size_mb=16, max_age_days=1)
+    assert store.get("a") == (b"1", None)
+    store.close()
+
+
+def test_evicts_expired_entries(tmp_path):
+    store = KVStore(str(tmp_path / "store.sqlite3"), "entries", COLUMNS, max_size_mb=16, max_age_days=1)
+    store.put("old", b"1")
+    store.put("new", b"2")
+    store.flush()
+    store.conn.execute("UPDATE entries SET accessed = ? WHERE key = 'old'", (time.time() - 2 * 24 * 3600,))
+    store.evict()
+    assert store.get("old") is None
+    assert store.get("new") == (b"2",)
+    store.close()
+
+
+def test_evicts_least_recently_used_entries(tmp_path):
+    store = KVStore(str(tmp_path / "store.sqlite3"), "entries", COLUMNS, max_size_mb=0.25, max_age_days=1,
+                    commit_every=10 ** 6)
+    keys = [f"key{i}" for i in range(200)]
+    for key in keys:
+        store.put(key, bytes(4096))
+    store.flush()
+    time.sleep(0.01)
+    recent = keys[:10]
+    for key in recent:
+        assert store.get(key) is not None
+    store.flush()
+
+    store.evict()
+    remaining = [key for key in keys if store.get(key) is not None]
+    assert 10 <= len(remaining) < len(keys)
+    assert set(recent) <= set(remaining)
+    store.close()
+
+
+def test_concurrent_stores_see_each_others_batches(tmp_path):
+    path = str(tmp_path / "store.sqlite3")
+    first = KVStore(path, "entries", COLUMNS, max_size_mb=16, max_age_days=1)
+    second = KVStore(path, "entries", COLUMNS, max_size_mb=16, max_age_days=1)
+    first.put("a", b"1")
+    assert second.get("a") is None
+    first.flush()
+    assert second.get("a") == (b"1",)
+    second.put("a", b"2")
+    second.close()
+    assert first.get("a") == (b"2",)
+    first.close()
@@ -0,0 +1,45 @@
+import math
+
+import numpy as np
+
+from passk import pass_at_k, summarize
+
+
+def comb_pass_at_k(n: int, c: int, k: int) -> float:
+    return 1.0 - math.comb(n - c, k) / math.comb(n, k)
+
+
+def test_pass_at_k_matches_comb():
+    rng = np.random.default_rng(0)
+    n = rng.integers(1, 300, size=2000)
+    c = rng.integers(0, n + 1)
+    ks = [1, 2, 5, 10, 100]
+    got = pass_at_k(n, c, ks)
+    assert got.shape == (len(n), len(ks))
+    for i in range(len(n)):
+        for j, k in enumerate(ks):
+            if n[i] >= k:
+                assert math.isclose(got[i, j], comb_pass_at_k(int(n[i]), int(c[i]), k), rel_tol=1e-9, abs_tol=1e-12)
+
+
+def test_pass_at_1_is_exact():
+    n = np.array([3, 7, 10, 1000])
+    c = np.array([1, 3, 0, 333])
+    assert (pass_at_k(n, c, 1) == c / n).all()
+
+
+def test_pass_at_k_broadcasts_runs_and_tasks():
+    n = np.array([10, 20, 30])
+    c = np.array([[0, 5, 30], [10, 1, 2]])
+    got = pass_at_k(n, c, [1, 10])
+    assert got.shape == (2, 3, 2)
+    for run in range(2):
+        for task in range(3):
+            for j, k in enumerate([1, 10]):
+                assert math.isclose(got[run, task, j], comb_pass_at_k(int(n[task]), int(c[run, task]), k),
+                                    rel_tol=1e-9, abs_tol=1e-12)
+
+
+def test_summarize_skips_k_beyond_samples():
+    summary = summarize([5, 5], [1, 5], ks=(1, 10))
+    assert summary == {"pass@1": 0.6}
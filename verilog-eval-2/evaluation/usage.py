@@ -0,0 +1,172 @@
+"""
+Resource usage of the simulator tools. Every job records, per stage
+("compile" for iverilog, "simulate" for vvp), the user and system CPU time
+and the wall time of the processes it ran, as reported by wait4, and their
+peak resident set size, as measured by PeakRss. UsageSummary aggregates
+them per task and per run and keeps the slowest samples.
+"""
+from typing import Dict, Iterable, Optional
+import heapq
+import itertools
+import resource
+
+
+class PeakRss:
+    """
+    Peak resident set size of the tool pid, in kB. The ru_maxrss that wait4
+    reports does not do on its own: Linux carries it over from the process
+    that forked the tool, so for a tool started by a Python worker it is
+    never below the worker's RSS. The peak is therefore the largest VmHWM
+    of /proc/<pid>/status sampled while the tool runs, and ru_maxrss if it
+    exceeds the peak RSS of this process, which bounds what was carried
+    over. None if neither tells, e.g. for a tool that stayed below this
+    process and exited before it was first sampled.
+    """
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.peak_kb = None
+
+    def sample(self):
+        try:
+            with open("/proc/{}/status".format(self.pid), "rb") as f:
+                for line in f:
+                    if line.startswith(b"VmHWM:"):
+                        kb = int(line.split()[1])
+                        self.peak_kb = kb if self.peak_kb is None else max(self.peak_kb, kb)
+                        return
+        except (OSError, ValueError, IndexError):
+            # No /proc, or the tool has exited; a zombie has no VmHWM.
+            pass
+
+    def result(self, rusage) -> Optional[int]:
+        """The peak RSS of the tool once it is reaped, with its struct_rusage (None if unknown)."""
+        if rusage is not None and rusage.ru_maxrss > self.baseline_kb:
+            return max(self.peak_kb or 0, rusage.ru_maxrss)
+        return self.peak_kb
+
+
+def add_usage(usage: Optional[Dict], rusage, wall: float, maxrss_kb: Optional[int] = None):
+    """
+    Adds a reaped process, its struct_rusage (None if unknown), its wall
+    time in seconds and its peak RSS (see PeakRss), to usage, the running
+    usage of one stage.
+    """
+    if usage is None:
+        return
+    if rusage is not None:
+        usage["user"] = round(usage.get("user", 0.0) + rusage.ru_utime, 6)
+        usage["sys"] = round(usage.get("sys", 0.0) + rusage.ru_stime, 6)
+    if maxrss_kb is not None:
+        usage["maxrss_kb"] = max(usage.get("maxrss_kb", 0), maxrss_kb)
+    usage["wall"] = round(usage.get("wall", 0.0) + wall, 6)
+
+
+def _empty() -> Dict:
+    return dict(samples=0, user=0.0, sys=0.0, wall=0.0, maxrss_kb=0)
+
+
+def _accumulate(totals: Dict, usage: Dict, samples: int = 1):
+    totals["samples"] += samples
+    for field in ("user", "sys", "wall"):
+        totals[field] += usage.get(field, 0.0)
+    totals["maxrss_kb"] = max(totals["maxrss_kb"], usage.get("maxrss_kb", 0))
+
+
+def _rounded(totals: Dict) -> Dict:
+    return {field: round(value, 3) if isinstance(value, float) else value for field, value in totals.items()}
+
+
+class UsageSummary:
+    """
+    Streaming aggregate of per-sample usage: totals per task and per stage,
+    and the top slowest samples by wall time. Memory grows with the number
+    of tasks, not of samples.
+    """
+
+    def __init__(self, top: int = 10):
+        self.top = top
+        self.tasks = {}
+        self.slowest = []
+        self.order = itertools.count()
+
+    def add(self, task_id: str, completion_id: int, result: str, usage: Optional[Dict]):
+        if not usage:
+            return
+        task = self.tasks.setdefault(task_id, dict(_empty(), stages={}))
+        sample = _empty()
+        for stage, stage_usage in usage.items():
+            _accumulate(task["stages"].setdefault(stage, _empty()), stage_usage)
+            _accumulate(sample, stage_usage, samples=0)
+        _accumulate(task, sample)
+        del sample["samples"]
+        entry = (sample["wall"], next(self.order), dict(
+            task_id=task_id, completion_id=completion_id, result=result, **_rounded(sample), stages=usage))
+        if len(self.slowest) < self.top:
+            heapq.heappush(self.slowest, entry)
+        else:
+            heapq.heappushpop(self.slowest, entry)
+
+    def summary(self) -> Dict:
+        """
+        Returns {"run": totals, "tasks": {task_id: totals}, "slowest_tasks":
+        [...], "slowest_samples": [...]}, where totals hold the number of
+        samples, the summed user, sys and wall seconds, the largest maxrss_kb
+        and the same per stage under "stages".
+        """
+        run = dict(_empty(), stages={})
+        for task in self.tasks.values():
+            _accumulate(run, task, samples=task["samples"])
+            for stage, totals in task["stages"].items():
+                _accumulate(run["stages"].setdefault(stage, _empty()), totals, samples=totals["samples"])
+
+        def rounded(group):
+            return dict(_rounded({k: v for k, v in group.items() if k != "stages"}),
+                        stages={stage: _rounded(totals) for stage, totals in group["stages"].items()})
+
+        tasks = {task_id: rounded(task) for task_id, task in self.tasks.items()}
+        slowest_tasks = sorted(tasks, key=lambda task_id: tasks[task_id]["wall"], reverse=True)[:self.top]
+        return dict(
+            run=rounded(run),
+            tasks=tasks,
+            slowest_tasks=[dict(task_id=task_id, **tasks[task_id]) for task_id in slowest_tasks],
+            slowest_samples=[sample for _, _, sample in sorted(self.slowest, reverse=True)],
+        )
+
+
+def format_report(summary: Dict) -> str:
+    """Renders the run totals and the slowest tasks and samples of summary as text."""
+    lines = ["Resource usage per stage (CPU = user + sys):"]
+    for stage, totals in summary["run"]["stages"].items():
+        lines.append(f"  {stage:<9} {totals['samples']:>7} samples  cpu {totals['user'] + totals['sys']:10.2f}s  "
+                     f"wall {totals['wall']:10.2f}s  max RSS {totals['maxrss_kb'] / 1024:8.1f} MiB")
+    if summary["slowest_tasks"]:
+        lines.append("Slowest tasks (total wall time of their samples):")
+        for task in summary["slowest_tasks"]:
+            lines.append(f"  {task['task_id']:<40} {task['wall']:10.2f}s  cpu {task['user'] + task['sys']:10.2f}s  "
+                         f"{task['samples']:>5} samples  max RSS {task['maxrss_kb'] / 1024:8.1f} MiB")
+    if summary["slowest_samples"]:
+        lines.append("Slowest samples:")
+        for sample in summary["slowest_samples"]:
+            name = f"{sample['task_id']}/{sample['completion_id']}"
+            lines.append(f"  {name:<44} {sample['wall']:10.2f}s  cpu {sample['user'] + sample['sys']:10.2f}s  "
+                         f"{sample['result']}")
+    return "\n".join(lines)
+
+
+def summarize_usage(results: Iterable[Dict], top: int = 10) -> Dict:
+    """
+    UsageSummary of result rows, as written to the results files. Rows
+    without a completion_id are numbered per task in order, and summary
+    rows are skipped.
+    """
+    summary = UsageSummary(top)
+    seen = {}
+    for row in results:
+        if "summary" in row:
+            continue
+        completion_id = row.get("completion_id", seen.get(row["task_id"], 0))
+        seen[row["task_id"]] = completion_id + 1
+        summary.add(row["task_id"], completion_id, row.get("result"), row.get("usage"))
+    return summary.summary()
@@ -20,6 +20,8 @@ setup(
     entry_points={
         "console_scripts": [
             "evaluate_functional_correctness = verilog_eval.evaluate_functional_correctness",
+            "usage_report = verilog_eval.usage_report",
+            "results_query = verilog_eval.results_query",
         ]
     }
 )
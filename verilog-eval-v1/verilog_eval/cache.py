@@ -0,0 +1,56 @@
+from typing import Optional, Dict
+import hashlib
+import os
+
+from verilog_eval.kvstore import KVStore
+
+
+class ResultCache:
+    """
+    On-disk cache of simulation outcomes keyed by a content hash of the
+    simulated source, the simulator flags and the simulator version.
+
+    Entries live in a KVStore, so several evaluation runs may read and write
+    the same cache directory at once. Entries that have not been used for
+    max_age_days are dropped, and the least recently used entries are
+    dropped once the database grows beyond max_size_mb.
+    """
+
+    def __init__(self, cache_dir: str, max_size_mb: float = 1024.0, max_age_days: float = 30.0,
+                 commit_every: int = 256):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.store = KVStore(os.path.join(self.cache_dir, "results.sqlite3"), "results",
+                             dict(result="TEXT NOT NULL", elapsed="REAL NOT NULL", failure="TEXT"),
+                             max_size_mb, max_age_days, commit_every)
+
+    @property
+    def hits(self) -> int:
+        return self.store.hits
+
+    @property
+    def misses(self) -> int:
+        return self.store.misses
+
+    @staticmethod
+    def make_key(verilog_test: str, flags: str, simulator_version: str) -> str:
+        digest = hashlib.sha256()
+        for part in (simulator_version, flags, verilog_test):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        row = self.store.get(key)
+        if row is None:
+            return None
+        return dict(result=row[0], elapsed=row[1], failure=row[2])
+
+    def put(self, key: str, result: str, elapsed: float, failure: Optional[str] = None):
+        self.store.put(key, result, elapsed, failure)
+
+    def evict(self):
+        self.store.evict()
+
+    def close(self):
+        self.store.close()
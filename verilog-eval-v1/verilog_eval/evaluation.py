@@ -1,39 +1,132 @@
 from collections import defaultdict, Counter
 from concurrent.futures import ProcessPoolExecutor, as_completed
-from typing import List, Union, Iterable, Dict, Tuple, Optional
-import itertools
+from typing import List, Union, Iterable, Dict, Tuple, Optional, Sequence
+import asyncio
+import contextlib
+import functools
+import json
+import multiprocessing
+import os
+import queue
+import uuid
 
 import numpy as np
 import tqdm
 
-from verilog_eval.data import read_problems, stream_jsonl, write_jsonl
-from verilog_eval.execution import check_correctness, clean_up_simulation
+from verilog_eval.cache import ResultCache
+from verilog_eval.calibration import (calibration_entry, calibration_file, derive_timeout, load_calibration,
+                         save_calibration)
+from verilog_eval.data import read_problems, stream_jsonl, write_jsonl, IndexedJsonl
+from verilog_eval.journal import ResultJournal, completion_digest
+from verilog_eval.passk import estimate_pass_at_k, summarize
+from verilog_eval.simulators import select_simulators, simulator_key, HARNESS_CACHE_DIR
+from verilog_eval.usage import UsageSummary, format_report
+from verilog_eval.execution import (check_correctness, compile_verilog, simulate_verilog, clean_up_simulation,
+                       build_verilog_test, reference_completion, set_scratch_backend, AsyncExecutor,
+                       check_correctness_async, compile_verilog_async, simulate_verilog_async, is_simulator_outcome,
+                       RUN_ENV, VERILATOR_BUILD_TIMEOUT)
 
 
-def estimate_pass_at_k(
-    num_samples: Union[int, List[int], np.ndarray],
-    num_correct: Union[List[int], np.ndarray],
-    k: int
-) -> np.ndarray:
+# Per-problem cancellation flags of the pool workers of find_passing_completions.
+_cancel_flags = None
+# Problems by task_id of the pool workers, passed once to every worker by the
+# pool initializer, so that jobs carry the task_id rather than the problem
+# with its testbench and reference module.
+_problems = {}
+
+
+def _init_worker(scratch: str, problems: Optional[Dict[str, Dict]] = None, run: Optional[str] = None):
+    global _problems
+    set_scratch_backend(scratch)
+    _problems = problems or {}
+    if run is not None:
+        # Inherited by the sandbox and the tools it starts.
+        os.environ[RUN_ENV] = run
+
+
+def _init_cancel_flags(flags, scratch: str, problems: Dict[str, Dict], run: Optional[str] = None):
+    global _cancel_flags
+    _cancel_flags = flags
+    _init_worker(scratch, problems, run)
+
+
+def _with_problem(fn, problems: Optional[Dict[str, Dict]], task_id: str, *args, **kwargs):
     """
-    Estimates pass@k of each problem and returns them in an array.
+    Calls fn with the problem of task_id in place of task_id: from problems,
+    or from the problems of the pool worker if problems is None.
     """
+    return fn((_problems if problems is None else problems)[task_id], *args, **kwargs)
 
-    def estimator(n: int, c: int, k: int) -> float:
-        """
-        Calculates 1 - comb(n - c, k) / comb(n, k).
-        """
-        if n - c < k:
-            return 1.0
-        return 1.0 - np.prod(1.0 - k / np.arange(n - c + 1, n + 1))
 
-    if isinstance(num_samples, int):
-        num_samples_it = itertools.repeat(num_samples, len(num_correct))
-    else:
-        assert len(num_samples) == len(num_correct)
-        num_samples_it = iter(num_samples)
+def _check_unless_cancelled(index: int, task_id: str, completion: str, timeout: float,
+                            completion_id: int, unit_test_length: Optional[int]) -> Dict:
+    """
+    Runs check_correctness unless problem number index, task_id of the
+    problems of the worker, was already solved, and stops the simulation as
+    soon as it is.
+    """
+    def cancelled():
+        return bool(_cancel_flags[index])
+
+    if cancelled():
+        return dict(task_id=task_id, passed=False, result="cancelled",
+                    completion_id=completion_id, elapsed=0.0)
+    return check_correctness(_problems[task_id], completion, timeout, completion_id, unit_test_length, cancelled)
+
+
+def find_passing_completions(
+    problems: Dict[str, Dict],
+    completions: Dict[str, List[str]],
+    n_workers: int = 4,
+    timeout: float = 30.0,
+    unit_test_length: Optional[int] = None,
+    clean_up: bool = True,
+    mp_context: Optional[str] = None,
+    scratch: str = "tmpfs",
+) -> Dict[str, Tuple[bool, str]]:
+    """
+    Looks for a passing completion of every problem in completions, over one
+    shared pool of n_workers workers. Completions are interleaved across
+    problems, and once a problem has a passing completion its queued checks
+    are cancelled and its running simulations are killed, so each problem
+    costs about as much as finding its first passing completion.
+    Returns (True, completion) or (False, "") for every task_id.
+    """
+    task_ids = list(completions)
+    index_of = {task_id: index for index, task_id in enumerate(task_ids)}
+    found = {task_id: (False, "") for task_id in task_ids}
+    ctx = multiprocessing.get_context(mp_context)
+    flags = ctx.RawArray("b", len(task_ids))
+    worker_problems = {task_id: problems[task_id] for task_id in task_ids}
+    run = uuid.uuid4().hex
 
-    return np.array([estimator(int(n), int(c), k) for n, c in zip(num_samples_it, num_correct)])
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx, initializer=_init_cancel_flags,
+                             initargs=(flags, scratch, worker_problems, run)) as executor:
+
+        futures = defaultdict(list)
+        # Round-robin over the problems, so that every problem gets its
+        # first completions checked early.
+        for idx in range(max(map(len, completions.values()), default=0)):
+            for index, task_id in enumerate(task_ids):
+                if idx < len(completions[task_id]):
+                    args = (index, task_id, completions[task_id][idx], timeout, idx, unit_test_length)
+                    futures[index].append(executor.submit(_check_unless_cancelled, *args))
+
+        for future in as_completed([f for fs in futures.values() for f in fs]):
+            if future.cancelled():
+                continue
+            result = future.result()
+            index = index_of[result["task_id"]]
+            if result["passed"] and not flags[index]:
+                flags[index] = 1
+                found[result["task_id"]] = (True, completions[result["task_id"]][result["completion_id"]])
+                for f in futures[index]:
+                    f.cancel()
+
+    if clean_up:
+        clean_up_simulation(run)
+
+    return found
 
 
 def contain_passing_completion(
@@ -44,26 +137,86 @@ def contain_passing_completion(
     unit_test_length: Optional[int] = None,
     clean_up: bool = True,
 ) -> Tuple[bool, str]:
+    """
+    Returns (True, completion) for the first passing completion of problem,
+    or (False, "") if none passes. See find_passing_completions.
+    """
+    found = find_passing_completions({problem["task_id"]: problem}, {problem["task_id"]: completions},
+                                     n_workers, timeout, unit_test_length, clean_up)
+    return found[problem["task_id"]]
+
+
+def make_executor(engine: str, max_workers: int, scratch: str = "tmpfs", mp_context=None,
+                  problems: Optional[Dict[str, Dict]] = None, run: Optional[str] = None):
+    """
+    The executor the check functions of engine are submitted to: an
+    AsyncExecutor for "async", otherwise a pool of processes that each own
+    a sandbox and hold problems, for the functions that task_function wraps.
+    The tools the pool runs are marked with run (see
+    execution.clean_up_simulation). The async engine runs them as children
+    of this process, which kill them on timeout and cancellation, so they
+    are not left behind.
+    """
+    if engine == "async":
+        return AsyncExecutor(max_workers, scratch)
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context,
+                               initializer=_init_worker, initargs=(scratch, problems, run))
+
+
+def task_function(fn, engine: str, problems: Dict[str, Dict]):
+    """
+    Wraps fn, a function that takes a problem first, into one that takes
+    its task_id instead, for the executors of make_executor. The problems
+    are looked up in the pool workers, which were handed them once, and
+    are not pickled with every job; the async engine runs in this process
+    and looks them up in problems.
+    """
+    return functools.partial(_with_problem, fn, problems if engine == "async" else None)
 
-    with ProcessPoolExecutor(max_workers=n_workers) as executor:
-        
-        futures = []
-        
-        for idx, completion in enumerate(completions):
-            args = (problem, completion, timeout, idx, unit_test_length)
-            future = executor.submit(check_correctness, *args)
-            futures.append(future)
-            
-        for future in as_completed(futures):
+
+def calibrate_timeouts(
+    problems: Dict[str, Dict],
+    problem_file: str,
+    timeout: float = 30.0,
+    n_workers: int = 4,
+    unit_test_length: Optional[int] = None,
+    scratch: str = "tmpfs",
+    engine: str = "process",
+    mp_context=None,
+    simulators: Optional[Dict[str, Optional[Dict]]] = None,
+) -> Dict[str, Dict]:
+    """
+    Simulates the reference of every problem against its own testbench,
+    under timeout, and returns the calibration entries by task_id (see
+    calibration.calibration_entry). Entries are kept in the sidecar of
+    problem_file, and only tasks whose simulated source or simulator has
+    changed since are simulated again. simulators holds the simulator of
+    each task (see simulators.select_simulators), Icarus Verilog by default.
+    """
+    path = calibration_file(problem_file)
+    entries = load_calibration(path)
+    simulators = simulators or {}
+    keys = {}
+    for task_id, problem in problems.items():
+        verilog_test = build_verilog_test(problem, reference_completion(problem), unit_test_length)
+        keys[task_id] = ResultCache.make_key(verilog_test, *simulator_key(simulators.get(task_id)))
+    stale = [task_id for task_id in problems if entries.get(task_id, {}).get("key") != keys[task_id]]
+    if not stale:
+        return entries
+
+    print(f"Calibrating timeouts of {len(stale)} tasks, writing to {path}...")
+    check = check_correctness_async if engine == "async" else check_correctness
+    with make_executor(engine, n_workers, scratch, mp_context) as executor:
+        futures = [executor.submit(functools.partial(check, simulator=simulators.get(task_id)), problems[task_id],
+                                   reference_completion(problems[task_id]), timeout, 0, unit_test_length)
+                   for task_id in stale]
+        for future in tqdm.tqdm(as_completed(futures), total=len(futures)):
             result = future.result()
-            if result["passed"]:
-                return True, completions[result["completion_id"]]
-            
-    if clean_up:
-        clean_up_simulation()
-            
-    return False, ""
-            
+            entries[result["task_id"]] = calibration_entry(keys[result["task_id"]], result)
+    save_calibration(path, entries)
+    return entries
+
+
 def evaluate_functional_correctness(
     sample_file: str,
     problem_file: str,
@@ -72,70 +225,330 @@ def evaluate_functional_correctness(
     timeout: float = 30.0,
     unit_test: bool = False,
     clean_up: bool = True,
+    cache_dir: Optional[str] = None,
+    staged: bool = False,
+    n_compile_workers: Optional[int] = None,
+    compile_timeout: Optional[float] = None,
+    samples: Optional[Iterable[Dict]] = None,
+    mp_context: Optional[str] = None,
+    resume: bool = False,
+    window: Optional[int] = None,
+    scratch: str = "tmpfs",
+    engine: str = "process",
+    calibrate: bool = False,
+    timeout_scale: float = 10.0,
+    timeout_slack: float = 2.0,
+    stall_timeout: Optional[float] = None,
+    heartbeat: Optional[int] = None,
+    simulator: str = "icarus",
+    verilator_threshold: int = 20000,
+    harness_dir: str = HARNESS_CACHE_DIR,
+    verilator_build_timeout: float = VERILATOR_BUILD_TIMEOUT,
+    task_ids: Optional[Sequence[str]] = None,
 ):
     """
     Evaluates the functional correctness of generated samples, and writes
     results to f"{sample_file}_results.jsonl.gz"
+    If cache_dir is given, samples whose simulated source was already
+    evaluated with the same simulator are answered from the cache.
+    If staged is set, samples are first compiled by n_compile_workers
+    workers under compile_timeout, and only samples that compiled are
+    simulated by the n_workers simulation workers. Each result then records
+    the stage that decided it, and the number of samples each stage
+    ("compile", "simulate" or "cache") decided is returned alongside pass@k
+    as f"{stage}_decided", written to the usage file under "decided" and
+    appended to the results file as a row {"summary": {"decided": ...}}.
+    If samples is given, it is consumed instead of sample_file, so samples
+    can be evaluated while they are still being produced. mp_context selects the multiprocessing start
+    method of the worker pools (e.g. "forkserver" inside a process that
+    holds a GPU context).
+    Results are journaled to f"{sample_file}_results.journal.jsonl" as they
+    complete, and the journal is removed once the results file is written.
+    With resume set, samples already in the journal of an interrupted run
+    are not evaluated again.
+    Samples are written in input order as soon as they are decided, and at
+    most window samples (default 16 * n_workers) are read but not yet
+    written, so memory does not grow with the number of samples.
+    scratch selects where the sandboxes keep their scratch files, one of
+    "disk", "tmpfs" or "memfd" (see SandboxWorker).
+    engine "process" runs every simulation in the sandbox worker of a pool
+    process; engine "async" runs the simulators as asyncio subprocesses of
+    one event loop, with n_workers (n_compile_workers in the compile stage)
+    bounding how many run at once.
+    Every sample records its failure code in "failure" (see
+    failures.FAILURE_CODES), found in the simulator output as it is
+    evaluated; count_failures.py counts them per results file.
+    Every simulated sample records in "usage" the CPU time, peak RSS and wall
+    time of its compile and simulate stages. Their totals per task and
+    per run and the slowest tasks and samples are written to
+    f"{sample_file}_usage.json" (see usage.UsageSummary).
+    With calibrate set, each task times out after timeout_scale times the
+    runtime of its reference plus timeout_slack seconds, at most timeout
+    (compile_timeout in the compile stage); see calibrate_timeouts.
+    With stall_timeout set, a simulation that makes no progress for that
+    many seconds is killed early and its result is "stalled" rather than
+    "timed out"; heartbeat injects a heartbeat with that period (in time
+    units of the testbench) so that busy loops are caught too (see
+    execution.StallWatchdog).
+    simulator chooses the simulator of every task: "icarus" (Icarus
+    Verilog), "verilator", or "auto", which simulates the tasks whose
+    testbench runs at least verilator_threshold repeat iterations with
+    Verilator, whose per-task harnesses are cached in harness_dir (see
+    simulators.select_simulators). Verilator builds a native executable per
+    sample, which pays off only for long testbenches; the build runs under
+    its own time limit of verilator_build_timeout seconds.
+    With task_ids set, only the samples of those tasks are evaluated, and
+    the outputs are named after f"{sample_file}.subset" instead of
+    sample_file. Their problems and samples are read through the sidecar
+    indexes of the problem and sample files (see data.IndexedJsonl), so
+    spot-checking a task does not scan or decode the whole files.
     """
 
-    problems = read_problems(problem_file)
+    run_file = sample_file
+    # Marks the simulations of this evaluation, see execution.clean_up_simulation.
+    run = uuid.uuid4().hex
+    if task_ids is not None:
+        task_ids = [task_ids] if isinstance(task_ids, str) else list(task_ids)
+        lazy_problems = read_problems(problem_file, lazy=True)
+        problems = {task_id: lazy_problems[task_id] for task_id in task_ids}
+        if samples is None:
+            index = IndexedJsonl(sample_file)
+            samples = (sample for task_id in task_ids for sample in index.records(task_id))
+        run_file = sample_file + ".subset"
+    else:
+        problems = read_problems(problem_file)
+    cache = ResultCache(cache_dir) if cache_dir else None
+    if staged:
+        n_compile_workers = n_compile_workers or max(1, n_workers // 4)
+        compile_timeout = compile_timeout or timeout
+    window = window or 16 * n_workers
 
-    # Check the generated samples against test suites.
-    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+    if engine == "async":
+        check, compile_, simulate = check_correctness_async, compile_verilog_async, simulate_verilog_async
+    elif engine == "process":
+        check, compile_, simulate = check_correctness, compile_verilog, simulate_verilog
+    else:
+        raise ValueError(f"Unknown engine {engine!r}, expected 'process' or 'async'.")
+    check = functools.partial(check, stall_timeout=stall_timeout, heartbeat=heartbeat)
+    compile_ = functools.partial(compile_, heartbeat=heartbeat)
+    simulate = functools.partial(simulate, stall_timeout=stall_timeout, heartbeat=heartbeat)
+    if mp_context is not None:
+        mp_context = multiprocessing.get_context(mp_context)
+    unit_test_length = 100 if unit_test else None
+    simulators = select_simulators(problems, simulator, verilator_threshold, harness_dir, unit_test_length,
+                                   build_timeout=verilator_build_timeout)
+    # Tasks simulated by Verilator get the check and compile functions with their simulator bound.
+    # Both take the task_id in place of the problem (see task_function).
+    task_check, task_compile = {}, {}
+    for task_id, spec in simulators.items():
+        task_check[task_id] = task_function(functools.partial(check, simulator=spec) if spec else check,
+                                            engine, problems)
+        task_compile[task_id] = task_function(functools.partial(compile_, simulator=spec) if spec else compile_,
+                                              engine, problems)
 
-        futures = []
-        completion_id = Counter()
-        n_samples = 0
-        results = defaultdict(list)
+    # Per-task timeouts of the check (or the simulate) and the compile stage.
+    timeouts, compile_timeouts = defaultdict(lambda: timeout), defaultdict(lambda: compile_timeout)
+    if calibrate:
+        entries = calibrate_timeouts(problems, problem_file, timeout, n_workers, unit_test_length, scratch,
+                                     engine, mp_context, simulators)
+        stages = ("simulate",) if staged else ("compile", "simulate")
+        for task_id in problems:
+            entry = entries.get(task_id)
+            timeouts[task_id] = derive_timeout(entry, timeout, stages, timeout_scale, timeout_slack)
+            if staged:
+                compile_timeouts[task_id] = derive_timeout(entry, compile_timeout, ("compile",),
+                                                           timeout_scale, timeout_slack)
+        print(f"Calibrated timeouts: median {np.median(list(timeouts.values())):.2f}s, "
+              f"max {max(timeouts.values()):.2f}s")
+    if samples is None:
+        samples = stream_jsonl(sample_file)
 
-        print("Reading samples...")
-        for sample in tqdm.tqdm(stream_jsonl(sample_file)):
-            task_id = sample["task_id"]
-            completion = sample["completion"]
-            if unit_test:
-                args = (problems[task_id], completion, timeout, completion_id[task_id], 100)
-            else:
-                args = (problems[task_id], completion, timeout, completion_id[task_id])
-            future = executor.submit(check_correctness, *args)
-            futures.append(future)
-            completion_id[task_id] += 1
-            n_samples += 1
+    journal_file = run_file + "_results.journal.jsonl"
+    journal = ResultJournal(journal_file, resume=resume)
 
-        assert len(completion_id) == len(problems), "Some problems are not attempted."
+    completion_id = Counter()
+    total, correct = Counter(), Counter()
+    stage_counts = Counter()
+    usage_summary = UsageSummary()
+    n_resumed = 0
 
-        print("Running test suites...")
-        for future in tqdm.tqdm(as_completed(futures), total=len(futures)):
-            result = future.result()
-            results[result["task_id"]].append((result["completion_id"], result))
+    def ordered_results():
+        """
+        Reads samples, checks them against test suites and yields them with
+        their results in input order. At most window samples are read but
+        not yet yielded, so memory stays flat however long the input is.
+        """
+        nonlocal n_resumed
+        # Samples that are read but not yet yielded, keyed by input position,
+        # with their result once it is known.
+        buffered = {}
+        # Bookkeeping of in-flight futures: input position, completion digest,
+        # cache key and the time and resources already spent in the compile stage.
+        in_flight = {}
+        done = queue.SimpleQueue()
+        n_read = 0
+        n_written = 0
+
+        def submit(fn, *args, info):
+            future = fn(*args)
+            in_flight[future] = info
+            future.add_done_callback(done.put)
+
+        def collect():
+            # Blocks until at least one future is done, then handles all done ones.
+            future = done.get()
+            while True:
+                result = future.result()
+                info = in_flight.pop(future)
+                if result["result"] == "compiled":
+                    # Hand the compiled image over to the simulation stage.
+                    info["compile_elapsed"] = result["elapsed"]
+                    info["compile_usage"] = result.get("usage")
+                    submit(executor.submit, simulate, result["task_id"], result.pop("vvp"),
+                           timeouts[result["task_id"]], result["completion_id"], result.pop("native"),
+                           buffered[info["seq"]][0]["completion"], info=info)
+                else:
+                    result.pop("vvp", None)
+                    result.pop("native", None)
+                    result["elapsed"] += info["compile_elapsed"]
+                    if info["compile_usage"]:
+                        result["usage"] = dict(info["compile_usage"], **(result.get("usage") or {}))
+                    journal.record(result, info["digest"])
+                    # Only outcomes of the source are cached: timeouts and stalls depend on the time
+                    # limits and the machine load, and errors of the evaluation on the host.
+                    if cache is not None and is_simulator_outcome(result["result"]):
+                        cache.put(info["key"], result["result"], result["elapsed"], result.get("failure"))
+                    buffered[info["seq"]][1] = result
+                try:
+                    future = done.get_nowait()
+                except queue.Empty:
+                    return
+
+        def flush():
+            nonlocal n_written
+            while n_written in buffered and buffered[n_written][1] is not None:
+                sample, result = buffered.pop(n_written)
+                n_written += 1
+                total[result["task_id"]] += 1
+                correct[result["task_id"]] += result["passed"]
+                stage_counts[result.get("stage")] += 1
+                usage_summary.add(result["task_id"], result["completion_id"], result["result"], result.get("usage"))
+                sample["result"] = result["result"]
+                sample["passed"] = result["passed"]
+                sample["failure"] = result.get("failure")
+                if "stage" in result:
+                    sample["stage"] = result["stage"]
+                if result.get("usage"):
+                    sample["usage"] = result["usage"]
+                yield sample
+
+        # Check the generated samples against test suites.
+        with make_executor(engine, n_workers, scratch, mp_context, problems, run) as executor, \
+                (make_executor(engine, n_compile_workers, scratch, mp_context, problems, run) if staged
+                 else contextlib.nullcontext()) as compile_executor:
+
+            for sample in samples:
+                task_id = sample["task_id"]
+                completion = sample["completion"]
+                cid = completion_id[task_id]
+                completion_id[task_id] += 1
+                seq = n_read
+                n_read += 1
+                digest = completion_digest(completion)
+                result = journal.lookup(task_id, cid, digest)
+                if result is not None:
+                    n_resumed += 1
+                    buffered[seq] = [sample, result]
+                else:
+                    key = None
+                    if cache is not None:
+                        verilog_test = build_verilog_test(problems[task_id], completion, unit_test_length)
+                        key = ResultCache.make_key(verilog_test, *simulator_key(simulators[task_id]))
+                        hit = cache.get(key)
+                        if hit is not None:
+                            result = dict(
+                                task_id=task_id,
+                                passed=hit["result"] == "passed",
+                                result=hit["result"],
+                                completion_id=cid,
+                                elapsed=hit["elapsed"],
+                                failure=hit["failure"],
+                            )
+                            if staged:
+                                result["stage"] = "cache"
+                            journal.record(result, digest)
+                    buffered[seq] = [sample, result]
+                    if result is None:
+                        info = dict(seq=seq, digest=digest, key=key, compile_elapsed=0.0, compile_usage=None)
+                        if staged:
+                            args = (task_id, completion, compile_timeouts[task_id], cid, unit_test_length)
+                            submit(compile_executor.submit, task_compile[task_id], *args, info=info)
+                        else:
+                            args = (task_id, completion, timeouts[task_id], cid, unit_test_length)
+                            submit(executor.submit, task_check[task_id], *args, info=info)
+
+                yield from flush()
+                # Backpressure: stop reading until the oldest samples are written.
+                while n_read - n_written >= window:
+                    collect()
+                    yield from flush()
+
+            while in_flight:
+                collect()
+                yield from flush()
+            yield from flush()
+
+    out_file = run_file + "_results.jsonl"
+    print(f"Running test suites, writing results to {out_file}...")
+    write_jsonl(out_file, tqdm.tqdm(ordered_results()))
+
+    journal.close()
+    if cache is not None:
+        cache.close()
+    os.remove(journal_file)
     
     if clean_up:
-        clean_up_simulation()
+        clean_up_simulation(run)
+
+    assert len(completion_id) == len(problems), "Some problems are not attempted."
+
+    n_samples = sum(completion_id.values())
+    if resume:
+        print(f"Resumed from journal: {n_resumed}/{n_samples}")
+    if cache is not None:
+        print(f"Cache hits: {cache.hits}/{n_samples}")
+    decided = {stage: n for stage, n in stage_counts.items() if stage is not None}
+    if staged:
+        print("Samples decided per stage:", decided)
+        # The counts are known once every sample is written, so they follow the samples.
+        write_jsonl(out_file, [dict(summary=dict(decided=decided))], append=True)
+
+    usage = usage_summary.summary()
+    if staged:
+        usage["decided"] = decided
+    with open(run_file + "_usage.json", "w") as fp:
+        json.dump(usage, fp, indent=1)
+    print(format_report(usage))
 
     # Calculate pass@k.
-    total, correct = [], []
-    for result in results.values():
-        result.sort()
-        passed = [r[1]["passed"] for r in result]
-        total.append(len(passed))
-        correct.append(sum(passed))
-    total = np.array(total)
-    correct = np.array(correct)
-
-    ks = k
-    pass_at_k = {f"pass@{k}": estimate_pass_at_k(total, correct, k).mean()
-                 for k in ks if (total >= k).all()}
-
-    # Finally, save the results in one file:
-    def combine_results():
-        for sample in stream_jsonl(sample_file):
-            task_id = sample["task_id"]
-            result = results[task_id].pop(0)
-            sample["result"] = result[1]["result"]
-            sample["passed"] = result[1]["passed"]
-            yield sample
-
-    out_file = sample_file + "_results.jsonl"
-    print(f"Writing results to {out_file}...")
-    write_jsonl(out_file, tqdm.tqdm(combine_results(), total=n_samples))
+    total = np.array([total[task_id] for task_id in completion_id])
+    correct = np.array([correct[task_id] for task_id in completion_id])
+
+    pass_at_k = summarize(total, correct, k)
+    if staged:
+        pass_at_k.update({f"{stage}_decided": n for stage, n in decided.items()})
 
     return pass_at_k
+
+
+async def evaluate_functional_correctness_async(sample_file: str, problem_file: str, **kwargs):
+    """
+    Awaitable evaluate_functional_correctness with the async engine. The
+    reading, bookkeeping and writing run in a thread of the default
+    executor, and the simulators on the evaluator's own event loop, so the
+    calling event loop stays responsive.
+    """
+    kwargs.setdefault("engine", "async")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(evaluate_functional_correctness, sample_file,
+                                                              problem_file, **kwargs))
@@ -1,69 +1,441 @@
-from typing import Optional, Callable, Dict
+from typing import Optional, Callable, Dict, List, NamedTuple, Sequence, Tuple
 import ast
+import asyncio
+import concurrent.futures
 import contextlib
 import faulthandler
 import io
+import itertools
+import math
 import os
 import multiprocessing
 import platform
+import selectors
+import shutil
 import signal
+import sys
 import tempfile
+import threading
 
 import subprocess
 import re
-from threading import Timer
+import time
 
-def clean_up_simulation() -> None:
+from verilog_eval.failures import failure_code, scan_log
+from verilog_eval.usage import add_usage, PeakRss
+
+IVERILOG_FLAGS = "-Wall -Winfloop -Wno-timescale -g2012 -s tb"
+# Verilator builds a native executable, VERILATOR_BINARY in its object
+# directory, of the same source for the long-running testbenches. Harnesses
+# and samples alike are built in a directory of their own, from
+# VERILATOR_SOURCE into VERILATOR_MDIR, both relative to it, so that the
+# dependencies recorded in a harness still hold in the copies of it.
+VERILATOR_FLAGS = ("--binary --timing -O3 -Wno-fatal -Wno-lint -Wno-style -Wno-TIMESCALEMOD "
+                   "--top-module tb -o sim")
+VERILATOR_BINARY = "sim"
+VERILATOR_SOURCE = "top.sv"
+VERILATOR_MDIR = "obj_dir"
+# Names of the processes of the simulator tools, and the environment variable
+# the pool workers of an evaluation mark them with, so that
+# clean_up_simulation can tell the tools of one evaluation from the others.
+SIMULATION_PROCESSES = ("iverilog", "ivl", "vvp", VERILATOR_BINARY)
+RUN_ENV = "VERILOG_EVAL_RUN"
+
+# How often a running simulation checks whether it has been cancelled, in seconds.
+CANCEL_POLL_INTERVAL = 0.05
+# How often the stall watchdog checks the progress of a simulation, in seconds.
+WATCHDOG_POLL_INTERVAL = 0.1
+# How often the peak RSS of a running tool is sampled, in seconds.
+RSS_SAMPLE_INTERVAL = 0.02
+# Time limit of the Verilator build of one sample, in seconds. The build runs
+# under its own limit rather than the time limit of the task, since a C++
+# build takes far longer than iverilog, and longer still on a loaded host.
+VERILATOR_BUILD_TIMEOUT = 120.0
+
+# Root module added next to tb when a heartbeat is injected. It prints the
+# simulation time every heartbeat period, so a simulation whose time no
+# longer advances falls silent.
+HEARTBEAT_MODULE = "verilog_eval_heartbeat"
+HEARTBEAT_PREFIX = "@heartbeat "
+
+_simulator_version = None
+
+
+def simulator_version() -> str:
+    """
+    Returns the version banner of the iverilog in the current run path, so
+    that cached results are not reused across simulator upgrades.
+    """
+    global _simulator_version
+    if _simulator_version is None:
+        try:
+            out = subprocess.run(["iverilog", "-V"], capture_output=True, text=True).stdout
+            _simulator_version = out.splitlines()[0] if out else "unknown"
+        except OSError:
+            _simulator_version = "unknown"
+    return _simulator_version
+
+
+def clean_up_simulation(run: Optional[str] = None) -> None:
     """
     kill all simulation process.
+    With run set, only the simulation processes started by the pool workers
+    of that evaluation (see RUN_ENV) are killed, so that the simulations of
+    evaluations running at the same time are left alone.
+    """
+    if run is None:
+        print("Killing all hanging simulation process.")
+        subprocess.run("pkill iverilog", shell=True)
+        subprocess.run("pkill vvp", shell=True)
+        return
+    print("Killing the hanging simulation processes of this evaluation.")
+    marker = "\0{}={}\0".format(RUN_ENV, run).encode("utf-8")
+    for pid in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if not pid.isdigit():
+            continue
+        try:
+            with open(os.path.join("/proc", pid, "comm")) as f:
+                if f.read().strip() not in SIMULATION_PROCESSES:
+                    continue
+            with open(os.path.join("/proc", pid, "environ"), "rb") as f:
+                if marker not in b"\0" + f.read():
+                    continue
+            os.kill(int(pid), signal.SIGKILL)
+        except OSError:
+            # Gone meanwhile, or a process of another user.
+            continue
+
+def build_verilog_test(problem: Dict, completion: str,
+                       unit_test_length: Optional[int] = None) -> str:
+    """
+    Assembles the Verilog source that is handed to the simulator from the
+    test suite of the problem and the completion.
+    """
+    verilog_test = problem["test"] + "\n" + \
+            problem["prompt"] + "\n" + \
+            completion
+
+    if unit_test_length:
+        keywords = re.findall("repeat\([0-9]*\)", verilog_test)
+        for words in keywords:
+            verilog_test = verilog_test.replace(words, "repeat({})".format(unit_test_length))
+
+    return verilog_test
+
+
+def reference_completion(problem: Dict) -> str:
+    """
+    The completion that makes build_verilog_test simulate the canonical
+    solution of problem against its own test.
     """
-    print("Killing all hanging simulation process.")
-    subprocess.run("pkill iverilog", shell=True)
-    subprocess.run("pkill vvp", shell=True)
+    return problem["canonical_solution"]
+
 
 def check_correctness(problem: Dict, completion: str, timeout: float,
-                      completion_id: Optional[int] = None, unit_test_length: Optional[int] = None) -> Dict:
+                      completion_id: Optional[int] = None, unit_test_length: Optional[int] = None,
+                      cancelled: Optional[Callable[[], bool]] = None, stall_timeout: Optional[float] = None,
+                      heartbeat: Optional[int] = None, simulator: Optional[Dict] = None) -> Dict:
     """
     Evaluates the functional correctness of a completion by running the test
-    suite provided in the problem. 
+    suite provided in the problem. The simulation runs in the sandbox worker
+    owned by the calling process, see SandboxWorker.
     :param completion_id: an optional completion ID so we can match
         the results later even if execution finishes asynchronously.
+    :param cancelled: an optional callable polled while the simulation runs;
+        once it returns True the simulation is killed and the result is
+        "cancelled".
+    :param stall_timeout: if set, a simulation that makes no progress for
+        stall_timeout seconds (see StallWatchdog) is killed and the result
+        is "stalled".
+    :param heartbeat: if set, a heartbeat that prints the simulation time
+        every heartbeat time units is injected into the testbench.
+    :param simulator: the simulator of the task, None for Icarus Verilog;
+        see select_simulators in simulators.
+    The result carries the failure code of the sample in "failure", see
+    failures.FAILURE_CODES.
     """
+    verilog_test = build_verilog_test(problem, completion, unit_test_length)
+    start = time.perf_counter()
+    outcome = get_sandbox().run("check", (problem["task_id"], verilog_test, timeout, stall_timeout, heartbeat,
+                                          simulator), timeout + build_timeout(simulator), cancelled)
+    if outcome:
+        result = outcome["result"]
+    elif cancelled is not None and cancelled():
+        result = "cancelled"
+    else:
+        result = "timed out"
 
-    def unsafe_execute():
+    return dict(
+        task_id=problem["task_id"],
+        passed=result == "passed",
+        result=result,
+        completion_id=completion_id,
+        elapsed=time.perf_counter() - start,
+        failure=failure_code(result, outcome.get("failure") if outcome else None, completion),
+        usage=outcome.get("usage") if outcome else None,
+    )
 
-        with create_tempdir():
 
-            # These system calls are needed when cleaning up tempdir.
-            import os
-            import shutil
-            rmtree = shutil.rmtree
-            rmdir = os.rmdir
-            chdir = os.chdir
+def compile_verilog(problem: Dict, completion: str, timeout: float,
+                    completion_id: Optional[int] = None, unit_test_length: Optional[int] = None,
+                    heartbeat: Optional[int] = None, simulator: Optional[Dict] = None) -> Dict:
+    """
+    First stage of the staged evaluation: a syntax-only pass followed by
+    compilation to a simulation image. Samples that compile have result
+    "compiled" and carry the image in "vvp", and whether it is a native
+    executable in "native", for simulate_verilog; all others are final and
+    carry their failure code.
+    """
+    verilog_test = build_verilog_test(problem, completion, unit_test_length)
+    start = time.perf_counter()
+    outcome = get_sandbox().run("compile", (problem["task_id"], verilog_test, timeout, heartbeat, simulator),
+                                timeout + build_timeout(simulator))
+    result = outcome["result"] if outcome else "timed out"
+
+    return dict(
+        task_id=problem["task_id"],
+        passed=False,
+        result=result,
+        completion_id=completion_id,
+        elapsed=time.perf_counter() - start,
+        stage="compile",
+        failure=failure_code(result, outcome.get("failure") if outcome else None, completion),
+        vvp=outcome.get("vvp") if outcome else None,
+        native=outcome.get("native", False) if outcome else False,
+        usage=outcome.get("usage") if outcome else None,
+    )
+
+
+def simulate_verilog(task_id: str, vvp: bytes, timeout: float, completion_id: Optional[int] = None,
+                     native: bool = False, completion: str = "", stall_timeout: Optional[float] = None,
+                     heartbeat: Optional[int] = None) -> Dict:
+    """
+    Second stage of the staged evaluation: runs an image produced by
+    compile_verilog, a native executable if native is set, and classifies
+    the simulation output. heartbeat must be the one the image was compiled
+    with; completion, the one it was compiled from, tells the failure code
+    of runtime errors.
+    """
+    start = time.perf_counter()
+    outcome = get_sandbox().run("simulate", (vvp, timeout, stall_timeout, bool(heartbeat), native), timeout)
+    result = outcome["result"] if outcome else "timed out"
+
+    return dict(
+        task_id=task_id,
+        passed=result == "passed",
+        result=result,
+        completion_id=completion_id,
+        elapsed=time.perf_counter() - start,
+        stage="simulate",
+        failure=failure_code(result, outcome.get("failure") if outcome else None, completion),
+        usage=outcome.get("usage") if outcome else None,
+    )
+
+
+# The result strings of classify_output, outcomes of the simulated source itself.
+SIMULATOR_OUTCOME = re.compile(r"passed|failed: (syntax error|compile error|info string not matched"
+                               r"|[0-9]+ out of [0-9]+ samples)\.")
+
+
+def is_simulator_outcome(result: str) -> bool:
+    """
+    Whether result is a result string of classify_output, as opposed to a
+    timeout, stall, cancellation or an error of the evaluation itself.
+    """
+    return SIMULATOR_OUTCOME.fullmatch(result) is not None
+
+
+def classify_output(out: str, err: str) -> str:
+    """
+    Maps the output of iverilog and vvp to a result string.
+    """
+    match = re.search(r'Mismatches: ([0-9]*) in ([0-9]*) samples', out)
+    if "syntax error" in err:
+        return "failed: syntax error."
+    elif len(err) > 0:
+        return "failed: compile error."
+    elif match:
+        cor, tot = [int(i) for i in match.groups()]
+        if cor == 0:
+            return "passed"
+        else:
+            return f"failed: {cor} out of {tot} samples."
+    else:
+        return "failed: info string not matched."
+
+
+def inject_heartbeat(verilog_test: str, period: int) -> Tuple[str, List[str]]:
+    """
+    Appends the heartbeat module, which prints every period time units, to
+    verilog_test. Returns the source and the iverilog flags that elaborate
+    the heartbeat next to tb. The heartbeat keeps the simulation running, so
+    the testbench has to end with $finish, as all testbenches here do.
+    """
+    heartbeat = (f"\nmodule {HEARTBEAT_MODULE};\n"
+                 f"  initial forever begin\n"
+                 f"    #{period} $display(\"{HEARTBEAT_PREFIX}%0t\", $time);\n"
+                 f"    $fflush;\n"
+                 f"  end\n"
+                 f"endmodule\n")
+    return verilog_test + heartbeat, ["-s", HEARTBEAT_MODULE]
+
+
+def strip_heartbeat(out: str) -> str:
+    return "".join(line for line in out.splitlines(True) if not line.startswith(HEARTBEAT_PREFIX))
+
+
+class SimulationStalled(Exception):
+    pass
+
+
+class StallWatchdog:
+    """
+    Decides when a simulator has stopped making progress: it has written
+    nothing for stall_timeout seconds and, without a heartbeat, has not used
+    any CPU time either. With the heartbeat injected, silence alone is
+    enough, since it means that simulation time no longer advances, as in a
+    zero-delay loop that keeps the CPU busy.
+    """
+
+    def __init__(self, pid: int, stall_timeout: float, heartbeat: bool = False):
+        self.pid = pid
+        self.stall_timeout = stall_timeout
+        self.heartbeat = heartbeat
+        self.cpu_time = None
+        self.last_progress = time.monotonic()
+
+    def output(self):
+        self.last_progress = time.monotonic()
+
+    def read_cpu_time(self) -> Optional[int]:
+        """User plus system time of the process in clock ticks, or None without /proc."""
+        try:
+            with open("/proc/{}/stat".format(self.pid), "rb") as f:
+                fields = f.read().rsplit(b")", 1)[1].split()
+            return int(fields[11]) + int(fields[12])
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def stalled(self) -> bool:
+        now = time.monotonic()
+        if not self.heartbeat:
+            cpu_time = self.read_cpu_time()
+            # Without /proc, CPU use cannot be told apart from progress.
+            if cpu_time is None or cpu_time != self.cpu_time:
+                self.cpu_time = cpu_time
+                self.last_progress = now
+        return now - self.last_progress >= self.stall_timeout
+
+class Scratch:
+    """
+    Scratch files of the sandbox jobs, kept in the sandbox's private
+    directory, which is created once and reused for every job. With root
+    set, the files live in root instead of the current directory.
+    """
+
+    pass_fds = ()
+
+    def __init__(self, root: str = "."):
+        self.root = root
+
+    def path(self, name: str) -> str:
+        return name if self.root == "." else os.path.join(self.root, name)
+
+    def source(self, task_id: str, verilog_test: str) -> str:
+        path = self.path("{}.sv".format(task_id))
+        with open(path, 'w') as f:
+            f.write(verilog_test)
+        return path
+
+    def vvp(self) -> str:
+        return self.path("test.vvp")
+
+    def write_vvp(self, vvp: bytes, executable: bool = False) -> str:
+        fd = os.open(self.path("test.vvp"), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o755 if executable else 0o644)
+        with open(fd, "wb") as f:
+            f.write(vvp)
+        return self.path("test.vvp")
+
+    def read_vvp(self) -> Optional[bytes]:
+        try:
+            with open(self.path("test.vvp"), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def reset(self, unlink: Callable, rmdir: Callable = os.rmdir):
+        for dirpath, dirnames, filenames in os.walk(self.root, topdown=False):
+            for name in filenames:
+                unlink(os.path.join(dirpath, name))
+            for name in dirnames:
+                rmdir(os.path.join(dirpath, name))
+
+    def close(self):
+        pass
+
+
+class MemfdScratch(Scratch):
+    """
+    Keeps the source and the vvp image in two anonymous memory files that
+    are truncated and rewritten for every job. The tools reach them through
+    /proc/self/fd, so nothing is created on a filesystem for each sample.
+    """
+
+    def __init__(self, root: str = "."):
+        super().__init__(root)
+        self.source_fd = os.memfd_create("source.sv")
+        self.vvp_fd = os.memfd_create("test.vvp")
+        self.pass_fds = (self.source_fd, self.vvp_fd)
+
+    @staticmethod
+    def _write(fd: int, data: bytes) -> str:
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, data, 0)
+        return "/proc/self/fd/{}".format(fd)
+
+    def source(self, task_id: str, verilog_test: str) -> str:
+        return self._write(self.source_fd, verilog_test.encode("utf-8"))
+
+    def vvp(self) -> str:
+        os.ftruncate(self.vvp_fd, 0)
+        return "/proc/self/fd/{}".format(self.vvp_fd)
+
+    def write_vvp(self, vvp: bytes, executable: bool = False) -> str:
+        return self._write(self.vvp_fd, vvp)
+
+    def read_vvp(self) -> Optional[bytes]:
+        size = os.fstat(self.vvp_fd).st_size
+        return os.pread(self.vvp_fd, size, 0) if size else None
+
+    def reset(self, unlink: Callable, rmdir: Callable = os.rmdir):
+        super().reset(unlink, rmdir)
+        os.ftruncate(self.source_fd, 0)
+        os.ftruncate(self.vvp_fd, 0)
+
+    def close(self):
+        os.close(self.source_fd)
+        os.close(self.vvp_fd)
+
+
+SCRATCH_BACKENDS = ("disk", "tmpfs", "memfd")
+
+
+def scratch_root(backend: str) -> Optional[str]:
+    """
+    Returns the directory the sandbox directories of backend are created in,
+    or None for the default temporary directory. tmpfs and memfd use
+    /dev/shm when it exists; memfd only keeps the tools' working directory
+    there.
+    """
+    if backend not in SCRATCH_BACKENDS:
+        raise ValueError(f"Unknown scratch backend {backend!r}, expected one of {SCRATCH_BACKENDS}.")
+    if backend in ("tmpfs", "memfd") and os.path.isdir("/dev/shm"):
+        return "/dev/shm"
+    return None
+
 
-            # Disable functionalities that can make destructive changes to the test.
-# WARNING
-# subprocess.Popen is used to run shell command with calls to iveriog and vvp.
-# Please refer to reliability_guard function for details
-            reliability_guard()
-
-            # Output testbench with solution to Verilog file in temp directory.
-            verilog_test = problem["test"] + "\n" + \
-                    problem["prompt"] + "\n" + \
-                    completion
-
-                
-            if unit_test_length:
-                keywords = re.findall("repeat\([0-9]*\)", verilog_test)
-                for words in keywords:
-                    verilog_test = verilog_test.replace(words, "repeat({})".format(unit_test_length))
-                    
-            with open("{}.sv".format(problem["task_id"]), 'w') as f:
-                f.write(verilog_test)
-            
-            try:
 # WARNING PLEASE READ
-# The following code use subprocess.Popen to run shell command with calls to iveriog and vvp.
+# The following code use subprocess.Popen to run iverilog and vvp.
 # Please check that iverilog and vvp are installed and included in your current run path.
 # For installation of Icarus Verilog, please refer to: https://github.com/steveicarus/iverilog
 # This program exists to execute untrusted model-generated code. Although
@@ -77,70 +449,836 @@ def check_correctness(problem: Dict, completion: str, timeout: float,
 # proceed at your own risk:
 # BEGIN CODE BLOCK
 
-                with swallow_io():
-                    with time_limit(timeout):
-                        cmd = "iverilog -Wall -Winfloop -Wno-timescale -g2012 \
-                                    -s tb -o test.vvp {}.sv; vvp -n test.vvp".format(problem["task_id"])
-                       
-                        """
-                        adding timeout options for Popen. something breaks if not using timeout. seems to be working for now.
-                        not really sure if its the best/correct way. let me know if anyone has a better solution.
-                        https://stackoverflow.com/questions/1191374/using-module-subprocess-with-timeout
-                        """
-                        p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                        timer = Timer(timeout, p.kill)
-                        try:
-                            timer.start()
-                            out, err = p.communicate()
-                        finally:
-                            timer.cancel()
-                            
-                        out, err = out.decode("utf-8"), err.decode("utf-8") 
-                        match = re.search(r'Mismatches: ([0-9]*) in ([0-9]*) samples', out)
-                        if "syntax error" in err:
-                            result.append("failed: syntax error.")
-                        elif len(err) > 0:
-                            result.append("failed: compile error.")
-                        elif match:
-                            cor, tot = [int(i) for i in match.groups()]
-                            if cor == 0:
-                                result.append("passed")
-                            else:
-                                result.append(f"failed: {cor} out of {tot} samples.")
-                        else:
-                            result.append("failed: info string not matched.")
+class Step(NamedTuple):
+    """
+    One tool run of a simulation flow: its argv, the stage its usage is
+    counted in, whether the StallWatchdog watches it, whether it prints
+    the heartbeat, the directory it runs in, if not the current one, and
+    its own time limit, if it does not count against the time limit of
+    the flow.
+    """
+    argv: List[str]
+    stage: str
+    watch: bool = False
+    heartbeat: bool = False
+    cwd: Optional[str] = None
+    timeout: Optional[float] = None
+
+
+def build_timeout(simulator: Optional[Dict]) -> float:
+    """
+    The time limit of the Verilator build of a sample with simulator (see
+    select_simulators in simulators), which a job gets on top of the time
+    limit of its task; 0 for Icarus Verilog.
+    """
+    if simulator is None or simulator.get("name") != "verilator":
+        return 0.0
+    return simulator.get("build_timeout", VERILATOR_BUILD_TIMEOUT)
+
+
+def _reap(p: subprocess.Popen, deadline: float = math.inf):
+    """
+    Reaps p with wait4, which unlike Popen.wait returns the resource usage
+    of the process, sets its returncode and returns its struct_rusage.
+    Raises TimeoutExpired if p has not exited by deadline.
+    """
+    while True:
+        pid, status, rusage = os.wait4(p.pid, os.WNOHANG if deadline < math.inf else 0)
+        if pid == p.pid:
+            p.returncode = os.waitstatus_to_exitcode(status)
+            return rusage
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise subprocess.TimeoutExpired(p.args, None)
+        time.sleep(min(remaining, WATCHDOG_POLL_INTERVAL))
+
+
+def _communicate(p: subprocess.Popen, timeout: float, watchdog: Optional[StallWatchdog] = None,
+                 peak: Optional[PeakRss] = None):
+    """
+    p.communicate(timeout=timeout) that reaps p itself (see _reap) and
+    returns its stdout, its stderr and its struct_rusage. Where pidfds are
+    available, the exit of p is waited for alongside its pipes. With a
+    watchdog, it also raises SimulationStalled as soon as the watchdog
+    reports that p has stalled. peak samples the RSS of p while it runs.
+    """
+    deadline = time.monotonic() + timeout
+    output = {p.stdout: [], p.stderr: []}
+    pidfd = os.pidfd_open(p.pid) if pidfd_supported() else None
+    try:
+        with selectors.DefaultSelector() as selector:
+            for f in output:
+                selector.register(f, selectors.EVENT_READ)
+            if pidfd is not None:
+                selector.register(pidfd, selectors.EVENT_READ)
+            while selector.get_map():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise subprocess.TimeoutExpired(p.args, timeout)
+                interval = remaining if watchdog is None else min(remaining, WATCHDOG_POLL_INTERVAL)
+                if peak is not None:
+                    interval = min(interval, RSS_SAMPLE_INTERVAL)
+                for key, _ in selector.select(interval):
+                    data = os.read(key.fd, 1 << 16) if key.fileobj in output else b""
+                    if data:
+                        output[key.fileobj].append(data)
+                        if watchdog is not None:
+                            watchdog.output()
+                    else:
+                        selector.unregister(key.fileobj)
+                if peak is not None:
+                    peak.sample()
+                if watchdog is not None and selector.get_map() and watchdog.stalled():
+                    raise SimulationStalled()
+    finally:
+        if pidfd is not None:
+            os.close(pidfd)
+    rusage = _reap(p, deadline)
+    return b"".join(output[p.stdout]), b"".join(output[p.stderr]), rusage
+
+
+def run_command(argv: List[str], timeout: float, killpg: Callable = os.killpg,
+                pass_fds: Sequence[int] = (), usage: Optional[Dict] = None,
+                stall_timeout: Optional[float] = None, heartbeat: bool = False,
+                cwd: Optional[str] = None) -> Optional[Tuple[str, str]]:
+    """
+    Runs argv in its own process group, without a shell, and returns its
+    decoded stdout and stderr, or None if it did not finish within timeout
+    seconds. On timeout the whole group is killed, not only the tool.
+    The CPU time, peak RSS (see usage.PeakRss) and wall time of the tool
+    are added to usage, also when it times out. With stall_timeout set, a
+    StallWatchdog watches the tool, which is killed and raises
+    SimulationStalled once it stalls.
+    """
+    if timeout <= 0:
+        return None
+    start = time.monotonic()
+    with subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          start_new_session=True, pass_fds=pass_fds, cwd=cwd) as p:
+        watchdog = StallWatchdog(p.pid, stall_timeout, heartbeat) if stall_timeout is not None else None
+        peak = PeakRss(p.pid)
+        try:
+            out, err, rusage = _communicate(p, timeout, watchdog, peak)
+        except (subprocess.TimeoutExpired, SimulationStalled) as e:
+            killpg(p.pid, signal.SIGKILL)
+            rusage = _reap(p)
+            add_usage(usage, rusage, time.monotonic() - start, peak.result(rusage))
+            if isinstance(e, SimulationStalled):
+                raise
+            return None
+        except BaseException:
+            killpg(p.pid, signal.SIGKILL)
+            raise
+    add_usage(usage, rusage, time.monotonic() - start, peak.result(rusage))
+    return out.decode("utf-8"), err.decode("utf-8")
+
+
+def _native(image: str) -> str:
+    """Path that executes image, a file name in the scratch directory, rather than searching PATH for it."""
+    return image if os.sep in image else os.path.join(".", image)
+
+
+def _simulation_flags(verilog_test: str, heartbeat: Optional[int]) -> Tuple[str, List[str]]:
+    flags = IVERILOG_FLAGS.split()
+    if heartbeat:
+        verilog_test, heartbeat_flags = inject_heartbeat(verilog_test, heartbeat)
+        flags += heartbeat_flags
+    return verilog_test, flags
+
+
+def _build_flow(source: str, image: str, flags: List[str], simulator: Optional[Dict],
+                syntax_check: bool, scratch: Scratch):
+    """
+    Flow that builds the simulation image of source and returns (out, err,
+    native): the compiler output that decides compile errors, and whether
+    image is a native Verilator executable rather than a vvp image.
+    With the Verilator simulator, iverilog checks the syntax first, so that
+    compile errors are classified alike by every simulator, and the model is
+    then built from a copy of the task's harness (see prepare_harness in
+    simulators), under its own time limit (see build_timeout). A model that
+    Verilator cannot build is compiled by iverilog.
+    """
+    verilator = simulator is not None and simulator.get("name") == "verilator"
+    if syntax_check or verilator:
+        out, err = yield Step(["iverilog", "-t", "null", *flags, source], "compile")
+        if len(err) > 0:
+            return out, err, False
+    if verilator:
+        # The copy keeps the harness's timestamps (-a), so make rebuilds only
+        # what the sample changes and not the Verilator runtime. Verilator
+        # itself runs one make job (-j 1), since the workers already build
+        # one sample each at once.
+        build = scratch.path("verilator")
+        for argv, cwd in ((["cp", "-a", simulator["harness"], build], None),
+                          (["cp", source, os.path.join(build, VERILATOR_SOURCE)], None),
+                          (["verilator", *VERILATOR_FLAGS.split(), "-j", "1", "--Mdir", VERILATOR_MDIR,
+                            VERILATOR_SOURCE], build),
+                          (["cp", os.path.join(build, VERILATOR_MDIR, VERILATOR_BINARY), image], None)):
+            _, err = yield Step(argv, "compile", cwd=cwd,
+                                timeout=build_timeout(simulator) if argv[0] == "verilator" else None)
+            # Verilator reports warnings on stderr as well; only a missing
+            # executable tells that the build failed.
+            if argv[0] == "cp" and len(err) > 0:
+                break
+        else:
+            return "", "", True
+    out, err = yield Step(["iverilog", *flags, "-o", image, source], "compile")
+    return out, err, False
+
+
+def _run_step(image: str, native: bool, heartbeat: bool) -> Step:
+    argv = [_native(image)] if native else ["vvp", "-n", image]
+    return Step(argv, "simulate", watch=True, heartbeat=heartbeat and not native)
+
+
+def _check_flow(source: str, image: str, flags: List[str], simulator: Optional[Dict], heartbeat: bool,
+                scratch: Scratch):
+    """
+    Flow of run_simulation. The simulation is skipped when the compiler
+    reports errors, since any output on stderr already decides the result.
+    """
+    out, err, native = yield from _build_flow(source, image, flags, simulator, False, scratch)
+    if len(err) == 0:
+        sim_out, sim_err = yield _run_step(image, native, heartbeat)
+        out, err = out + strip_heartbeat(sim_out), err + sim_err
+    return dict(result=classify_output(out, err), failure=scan_log(err + "\n" + out))
+
+
+def _compile_flow(source: str, image: str, flags: List[str], simulator: Optional[Dict], scratch: Scratch):
+    out, err, native = yield from _build_flow(source, image, flags, simulator, True, scratch)
+    if len(err) > 0:
+        return dict(result=classify_output(out, err), failure=scan_log(err + "\n" + out))
+    return dict(result="compiled", native=native)
+
+
+def _simulate_flow(image: str, native: bool, heartbeat: bool):
+    out, err = yield _run_step(image, native, heartbeat)
+    out = strip_heartbeat(out)
+    return dict(result=classify_output(out, err), failure=scan_log(err + "\n" + out))
+
+
+def _run_flow(flow, timeout: float, killpg: Callable, scratch: Scratch, stall_timeout: Optional[float]) -> Dict:
+    """
+    Runs the steps of flow, a generator that yields Steps and is sent their
+    output, with run_command under one deadline, and returns the result of
+    the flow with the usage of its stages. Steps with their own time limit
+    run under it instead, and the deadline is moved by the time they took.
+    Steps with watch set are watched for stalls when stall_timeout is set.
+    """
+    usage = {}
+    deadline = time.monotonic() + timeout
+    try:
+        step = next(flow)
+        while True:
+            started = time.monotonic()
+            try:
+                output = run_command(step.argv, deadline - started if step.timeout is None else step.timeout,
+                                     killpg, scratch.pass_fds, usage.setdefault(step.stage, {}),
+                                     stall_timeout if step.watch else None, step.heartbeat, step.cwd)
+            except SimulationStalled:
+                return dict(result="stalled", usage=usage)
+            if output is None:
+                return dict(result="timed out", usage=usage)
+            if step.timeout is not None:
+                deadline += time.monotonic() - started
+            step = flow.send(output)
+    except StopIteration as stop:
+        return dict(stop.value, usage=usage)
+
+
+def run_simulation(task_id: str, verilog_test: str, timeout: float, stall_timeout: Optional[float] = None,
+                   heartbeat: Optional[int] = None, simulator: Optional[Dict] = None,
+                   killpg: Callable = os.killpg, scratch: Optional[Scratch] = None) -> Dict:
+    """
+    Compiles and simulates verilog_test in the current directory. With
+    stall_timeout set, a simulation that stops making progress is killed and
+    the result is "stalled"; heartbeat, if set, is the period of the
+    injected heartbeat. simulator is None for Icarus Verilog or the spec of
+    another simulator, see select_simulators in simulators.
+    """
+    scratch = scratch or Scratch()
+    verilog_test, flags = _simulation_flags(verilog_test, heartbeat)
+    flow = _check_flow(scratch.source(task_id, verilog_test), scratch.vvp(), flags, simulator, bool(heartbeat),
+                       scratch)
+    return _run_flow(flow, timeout, killpg, scratch, stall_timeout)
+
+
+def run_compile(task_id: str, verilog_test: str, timeout: float, heartbeat: Optional[int] = None,
+                simulator: Optional[Dict] = None, killpg: Callable = os.killpg,
+                scratch: Optional[Scratch] = None) -> Dict:
+    """
+    Checks the syntax of verilog_test with the null target, then compiles
+    it to a simulation image and returns the image, and in "native" whether
+    it is a native executable. With heartbeat set, a vvp image includes a
+    heartbeat of that period.
+    """
+    scratch = scratch or Scratch()
+    verilog_test, flags = _simulation_flags(verilog_test, heartbeat)
+    flow = _compile_flow(scratch.source(task_id, verilog_test), scratch.vvp(), flags, simulator, scratch)
+    result = _run_flow(flow, timeout, killpg, scratch, None)
+    if result["result"] == "compiled":
+        result["vvp"] = scratch.read_vvp()
+    return result
+
+
+def run_vvp(vvp: bytes, timeout: float, stall_timeout: Optional[float] = None, heartbeat: bool = False,
+            native: bool = False, killpg: Callable = os.killpg, scratch: Optional[Scratch] = None) -> Dict:
+    """
+    Simulates an image produced by run_compile. heartbeat tells whether the
+    image has a heartbeat and native whether it is a native executable; see
+    run_simulation.
+    """
+    scratch = scratch or Scratch()
+    flow = _simulate_flow(scratch.write_vvp(vvp, executable=native), native, heartbeat)
+    return _run_flow(flow, timeout, killpg, scratch, stall_timeout)
+
+
+def _kill_group(pid: int):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+async def _kill_and_reap(process):
+    """Kills the group of process, an asyncio Process or a future of one, and waits for it."""
+    if asyncio.isfuture(process):
+        try:
+            process = await process
+        except Exception:
+            return
+    _kill_group(process.pid)
+    await process.wait()
+
+
+_pidfd_supported = None
+
+
+def pidfd_supported() -> bool:
+    global _pidfd_supported
+    if _pidfd_supported is None:
+        try:
+            os.close(os.pidfd_open(os.getpid()))
+            _pidfd_supported = True
+        except (AttributeError, OSError):
+            _pidfd_supported = False
+    return _pidfd_supported
+
+
+async def run_command_async(argv: List[str], timeout: float, pass_fds: Sequence[int] = (),
+                            usage: Optional[Dict] = None, stall_timeout: Optional[float] = None,
+                            heartbeat: bool = False, cwd: Optional[str] = None) -> Optional[Tuple[str, str]]:
+    """
+    asyncio counterpart of run_command: runs argv in its own process group,
+    without a shell, and returns its decoded stdout and stderr, or None if
+    it did not finish within timeout seconds. On timeout or cancellation the
+    whole group is killed. Where pidfds are not available, the tool is run
+    as an asyncio subprocess, only its wall time is added to usage and
+    stall_timeout is ignored.
+    """
+    if timeout <= 0:
+        return None
+    if pidfd_supported():
+        return await _run_command_pidfd(argv, timeout, pass_fds, usage, stall_timeout, heartbeat, cwd)
+    start = time.monotonic()
+    spawn = asyncio.ensure_future(asyncio.create_subprocess_exec(
+        *argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True, pass_fds=pass_fds,
+        cwd=cwd))
+    try:
+        p = await asyncio.shield(spawn)
+    except asyncio.CancelledError:
+        # Cancelling a spawn in progress can leave asyncio waiting forever for
+        # the pipes of the new process; let it finish and kill it instead.
+        asyncio.ensure_future(_kill_and_reap(spawn))
+        raise
+    try:
+        out, err = await asyncio.wait_for(p.communicate(), timeout)
+    except asyncio.TimeoutError:
+        await _kill_and_reap(p)
+        add_usage(usage, None, time.monotonic() - start)
+        return None
+    except BaseException:
+        _kill_group(p.pid)
+        asyncio.ensure_future(p.wait())
+        raise
+    add_usage(usage, None, time.monotonic() - start)
+    return out.decode("utf-8"), err.decode("utf-8")
+
+
+async def _run_command_pidfd(argv: List[str], timeout: float, pass_fds: Sequence[int], usage: Optional[Dict],
+                             stall_timeout: Optional[float], heartbeat: bool,
+                             cwd: Optional[str] = None) -> Optional[Tuple[str, str]]:
+    """
+    run_command_async on Linux. The event loop watches the pipes of the tool
+    and a pidfd that becomes readable when it exits, and the tool is reaped
+    here with wait4, so that its resource usage is known; asyncio's own
+    subprocesses are reaped by the child watcher, which drops it.
+    """
+    loop = asyncio.get_running_loop()
+    start = time.monotonic()
+    p = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         start_new_session=True, pass_fds=pass_fds, cwd=cwd)
+    pidfd = os.pidfd_open(p.pid)
+    watchdog = StallWatchdog(p.pid, stall_timeout, heartbeat) if stall_timeout is not None else None
+    peak = PeakRss(p.pid)
+    out_fd, err_fd = p.stdout.fileno(), p.stderr.fileno()
+    output = {out_fd: [], err_fd: []}
+    # Done once both pipes are at EOF and the tool has exited.
+    watched = {out_fd, err_fd, pidfd}
+    finished = loop.create_future()
+
+    def readable(fd):
+        if fd in output:
+            data = os.read(fd, 1 << 16)
+            if data:
+                output[fd].append(data)
+                if watchdog is not None:
+                    watchdog.output()
+                return
+        loop.remove_reader(fd)
+        watched.discard(fd)
+        if not watched and not finished.done():
+            finished.set_result(None)
+
+    for fd in watched:
+        loop.add_reader(fd, readable, fd)
+    deadline = start + timeout
+    stalled = False
+    try:
+        while not finished.done():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.wait([finished], timeout=min(remaining, RSS_SAMPLE_INTERVAL))
+            peak.sample()
+            if watchdog is not None and not finished.done() and watchdog.stalled():
+                stalled = True
+                break
+    finally:
+        for fd in watched:
+            loop.remove_reader(fd)
+        if watched:
+            _kill_group(p.pid)
+        # The tool has exited or was just killed, so this returns at once.
+        _, status, rusage = os.wait4(p.pid, 0)
+        p.returncode = os.waitstatus_to_exitcode(status)
+        add_usage(usage, rusage, time.monotonic() - start, peak.result(rusage))
+        os.close(pidfd)
+        p.stdout.close()
+        p.stderr.close()
+    if stalled:
+        raise SimulationStalled()
+    if not finished.done():
+        return None
+    return b"".join(output[out_fd]).decode("utf-8"), b"".join(output[err_fd]).decode("utf-8")
+
+
+async def _run_flow_async(flow, timeout: float, scratch: Scratch, stall_timeout: Optional[float]) -> Dict:
+    """asyncio counterpart of _run_flow."""
+    usage = {}
+    deadline = time.monotonic() + timeout
+    try:
+        step = next(flow)
+        while True:
+            started = time.monotonic()
+            try:
+                output = await run_command_async(step.argv,
+                                                 deadline - started if step.timeout is None else step.timeout,
+                                                 scratch.pass_fds, usage.setdefault(step.stage, {}),
+                                                 stall_timeout if step.watch else None, step.heartbeat, step.cwd)
+            except SimulationStalled:
+                return dict(result="stalled", usage=usage)
+            if output is None:
+                return dict(result="timed out", usage=usage)
+            if step.timeout is not None:
+                deadline += time.monotonic() - started
+            step = flow.send(output)
+    except StopIteration as stop:
+        return dict(stop.value, usage=usage)
+
+
+async def run_simulation_async(task_id: str, verilog_test: str, timeout: float, stall_timeout: Optional[float],
+                               heartbeat: Optional[int], simulator: Optional[Dict], scratch: Scratch) -> Dict:
+    """asyncio counterpart of run_simulation."""
+    verilog_test, flags = _simulation_flags(verilog_test, heartbeat)
+    flow = _check_flow(scratch.source(task_id, verilog_test), scratch.vvp(), flags, simulator, bool(heartbeat),
+                       scratch)
+    return await _run_flow_async(flow, timeout, scratch, stall_timeout)
+
+
+async def run_compile_async(task_id: str, verilog_test: str, timeout: float, heartbeat: Optional[int],
+                            simulator: Optional[Dict], scratch: Scratch) -> Dict:
+    """asyncio counterpart of run_compile."""
+    verilog_test, flags = _simulation_flags(verilog_test, heartbeat)
+    flow = _compile_flow(scratch.source(task_id, verilog_test), scratch.vvp(), flags, simulator, scratch)
+    result = await _run_flow_async(flow, timeout, scratch, None)
+    if result["result"] == "compiled":
+        result["vvp"] = scratch.read_vvp()
+    return result
+
+
+async def run_vvp_async(vvp: bytes, timeout: float, stall_timeout: Optional[float], heartbeat: bool,
+                        native: bool, scratch: Scratch) -> Dict:
+    """asyncio counterpart of run_vvp."""
+    flow = _simulate_flow(scratch.write_vvp(vvp, executable=native), native, heartbeat)
+    return await _run_flow_async(flow, timeout, scratch, stall_timeout)
 
 # END CODE BLOCK
-            except TimeoutException:
-                result.append("timed out")
-            except BaseException as e:
-                result.append(f"failed: {e}")
-
-            # Needed for cleaning up.
-            shutil.rmtree = rmtree
-            os.rmdir = rmdir
-            os.chdir = chdir
-            
-    manager = multiprocessing.Manager()
-    result = manager.list()
-
-    p = multiprocessing.Process(target=unsafe_execute)
-    p.start()
-    p.join(timeout=timeout + 1)
-    if p.is_alive():
-        p.kill()
-
-    if not result:
-        result.append("timed out")
+
+
+SANDBOX_JOBS = {
+    "check": run_simulation,
+    "compile": run_compile,
+    "simulate": run_vvp,
+}
+
+
+class SandboxWorker:
+    """
+    A long-lived process that runs simulation jobs sent to it over a pipe.
+
+    The worker is forked once from the (already imported) evaluation process,
+    moved into its own session and hardened with reliability_guard before it
+    accepts any job. It then runs one job of SANDBOX_JOBS at a time in a
+    private scratch directory and sends the result back through the pipe.
+    A worker that does not answer within timeout + 1 seconds is killed and
+    transparently replaced on the next call to run.
+    The scratch backend is one of SCRATCH_BACKENDS: "disk" keeps the scratch
+    directory in the default temporary directory, "tmpfs" in /dev/shm, and
+    "memfd" additionally keeps the source and vvp image in memory files.
+    """
+
+    def __init__(self, scratch: str = "tmpfs"):
+        self.scratch = scratch
+        self.process = None
+        self.conn = None
+        self.workdir = None
+
+    def start(self):
+        ctx = multiprocessing.get_context("fork")
+        self.workdir = tempfile.mkdtemp(prefix="verilog-eval-", dir=scratch_root(self.scratch))
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_sandbox_main,
+                                   args=(child_conn, self.conn, self.workdir, self.scratch),
+                                   daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def run(self, kind: str, args: tuple, timeout: float,
+            cancelled: Optional[Callable[[], bool]] = None) -> Optional[Dict]:
+        """
+        Runs SANDBOX_JOBS[kind](*args) in the sandbox. Returns None if the
+        job did not finish in time, the sandbox died, or cancelled returned
+        True while the job was running. A cancelled job is stopped by
+        killing the sandbox together with its simulator processes.
+        """
+        if self.process is None or not self.process.is_alive():
+            self.close()
+            self.start()
+        try:
+            self.conn.send((kind, args))
+            deadline = time.monotonic() + timeout + 1
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if cancelled is None:
+                    if self.conn.poll(remaining):
+                        return self.conn.recv()
+                    break
+                if self.conn.poll(min(remaining, CANCEL_POLL_INTERVAL)):
+                    return self.conn.recv()
+                if cancelled():
+                    break
+        except (EOFError, OSError):
+            pass
+        except BaseException:
+            # An interrupted call would leave a stale reply in the pipe.
+            self.close()
+            raise
+        self.close()
+        return None
+
+    def close(self):
+        if self.process is not None:
+            if self.process.is_alive():
+                # SIGTERM lets the sandbox kill the session of a running
+                # simulator, which a SIGKILL of its own group would miss.
+                self.process.terminate()
+                self.process.join(1)
+            if self.process.is_alive():
+                try:
+                    os.killpg(self.process.pid, signal.SIGKILL)
+                except OSError:
+                    self.process.kill()
+            self.process.join()
+            self.process = None
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        if self.workdir is not None:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+            self.workdir = None
+
+
+def _sandbox_main(conn, parent_conn, workdir: str, backend: str):
+    # Drop the inherited parent end so that recv sees EOF once the parent
+    # is gone, instead of waiting forever as an orphan.
+    parent_conn.close()
+
+    # The worker leads its own process group so that killing it from the
+    # parent also takes down anything it left behind.
+    try:
+        os.setsid()
+    except OSError:
+        pass
+    os.chdir(workdir)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if backend == "memfd" and hasattr(os, "memfd_create"):
+        scratch = MemfdScratch()
+    else:
+        scratch = Scratch()
+
+    import resource
+
+    # These system calls are needed when cleaning up the scratch directory.
+    killpg = os.killpg
+    unlink = os.unlink
+    rmdir = os.rmdir
+
+# WARNING
+# subprocess.Popen is used to run shell command with calls to iveriog and vvp.
+# Please refer to reliability_guard function for details
+    reliability_guard()
+    # os.wait4 imports resource for its result, which reliability_guard
+    # blocks; the sandbox only ever runs iverilog and vvp, so allow it again.
+    sys.modules["resource"] = resource
+
+    try:
+        while True:
+            try:
+                job = conn.recv()
+            except EOFError:
+                break
+            if job is None:
+                break
+            kind, args = job
+            scratch.reset(unlink, rmdir)
+            try:
+                with swallow_io():
+                    result = SANDBOX_JOBS[kind](*args, killpg=killpg, scratch=scratch)
+            except Exception as e:
+                result = dict(result=f"failed: {e}")
+            conn.send(result)
+    finally:
+        scratch.reset(unlink, rmdir)
+        rmdir(workdir)
+
+
+_sandbox = None
+_scratch_backend = "tmpfs"
+
+
+def set_scratch_backend(backend: str):
+    """
+    Selects the scratch backend of the sandbox of the calling process. Used
+    as ProcessPoolExecutor initializer, so it is set in every worker.
+    """
+    global _sandbox, _scratch_backend
+    scratch_root(backend)
+    if _sandbox is not None and _sandbox.scratch != backend:
+        _sandbox.close()
+        _sandbox = None
+    _scratch_backend = backend
+
+
+def get_sandbox() -> SandboxWorker:
+    """
+    Returns the sandbox worker of the calling process, creating it on first
+    use. Each ProcessPoolExecutor worker therefore owns exactly one sandbox.
+    """
+    global _sandbox
+    if _sandbox is None:
+        _sandbox = SandboxWorker(_scratch_backend)
+    return _sandbox
+
+
+class AsyncScratch:
+    """
+    Scratch space of the asyncio evaluator. Since many jobs run at once in
+    one process, every job gets its own subdirectory of a private directory
+    (and, for memfd, its own pair of memory files), removed when it is done.
+    """
+
+    def __init__(self, backend: str = "tmpfs"):
+        self.backend = backend
+        self.workdir = tempfile.mkdtemp(prefix="verilog-eval-", dir=scratch_root(backend))
+        self.ids = itertools.count()
+
+    @contextlib.contextmanager
+    def job(self):
+        root = os.path.join(self.workdir, str(next(self.ids)))
+        os.mkdir(root)
+        if self.backend == "memfd" and hasattr(os, "memfd_create"):
+            scratch = MemfdScratch(root)
+        else:
+            scratch = Scratch(root)
+        try:
+            yield scratch
+        finally:
+            scratch.close()
+            shutil.rmtree(root, ignore_errors=True)
+
+    def close(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+async def _run_async_job(job, args: tuple, scratch: Optional[AsyncScratch]) -> Dict:
+    owned = scratch is None
+    scratch = scratch or AsyncScratch()
+    try:
+        with scratch.job() as job_scratch:
+            return await job(*args, scratch=job_scratch)
+    except Exception as e:
+        return dict(result=f"failed: {e}")
+    finally:
+        if owned:
+            scratch.close()
+
+
+async def check_correctness_async(problem: Dict, completion: str, timeout: float,
+                                  completion_id: Optional[int] = None, unit_test_length: Optional[int] = None,
+                                  stall_timeout: Optional[float] = None, heartbeat: Optional[int] = None,
+                                  simulator: Optional[Dict] = None, scratch: Optional[AsyncScratch] = None) -> Dict:
+    """
+    Same as check_correctness, but runs iverilog and vvp as asyncio
+    subprocesses of the calling event loop instead of in a sandbox worker.
+    """
+    verilog_test = build_verilog_test(problem, completion, unit_test_length)
+    start = time.perf_counter()
+    outcome = await _run_async_job(run_simulation_async,
+                                   (problem["task_id"], verilog_test, timeout, stall_timeout, heartbeat,
+                                                           simulator), scratch)
 
     return dict(
         task_id=problem["task_id"],
-        passed=result[0] == "passed",
-        result=result[0],
+        passed=outcome["result"] == "passed",
+        result=outcome["result"],
         completion_id=completion_id,
+        elapsed=time.perf_counter() - start,
+        failure=failure_code(outcome["result"], outcome.get("failure"), completion),
+        usage=outcome.get("usage"),
     )
 
 
+async def compile_verilog_async(problem: Dict, completion: str, timeout: float,
+                                completion_id: Optional[int] = None, unit_test_length: Optional[int] = None,
+                                heartbeat: Optional[int] = None, simulator: Optional[Dict] = None,
+                                scratch: Optional[AsyncScratch] = None) -> Dict:
+    """asyncio counterpart of compile_verilog."""
+    verilog_test = build_verilog_test(problem, completion, unit_test_length)
+    start = time.perf_counter()
+    outcome = await _run_async_job(run_compile_async,
+                                   (problem["task_id"], verilog_test, timeout, heartbeat, simulator), scratch)
+
+    return dict(
+        task_id=problem["task_id"],
+        passed=False,
+        result=outcome["result"],
+        completion_id=completion_id,
+        elapsed=time.perf_counter() - start,
+        stage="compile",
+        failure=failure_code(outcome["result"], outcome.get("failure"), completion),
+        vvp=outcome.get("vvp"),
+        native=outcome.get("native", False),
+        usage=outcome.get("usage"),
+    )
+
+
+async def simulate_verilog_async(task_id: str, vvp: bytes, timeout: float, completion_id: Optional[int] = None,
+                                 native: bool = False, completion: str = "", stall_timeout: Optional[float] = None,
+                                 heartbeat: Optional[int] = None, scratch: Optional[AsyncScratch] = None) -> Dict:
+    """asyncio counterpart of simulate_verilog."""
+    start = time.perf_counter()
+    outcome = await _run_async_job(run_vvp_async, (vvp, timeout, stall_timeout, bool(heartbeat), native),
+                                   scratch)
+
+    return dict(
+        task_id=task_id,
+        passed=outcome["result"] == "passed",
+        result=outcome["result"],
+        completion_id=completion_id,
+        elapsed=time.perf_counter() - start,
+        stage="simulate",
+        failure=failure_code(outcome["result"], outcome.get("failure"), completion),
+        usage=outcome.get("usage"),
+    )
+
+
+class AsyncExecutor:
+    """
+    Stands in for the ProcessPoolExecutor of the evaluation: runs the
+    coroutine functions above on one asyncio event loop in a background
+    thread, at most max_concurrency at a time. submit returns a
+    concurrent.futures.Future. Leaving the executor because of an exception
+    cancels every job still running, which kills its simulator.
+    """
+
+    def __init__(self, max_concurrency: int = 32, scratch: str = "tmpfs"):
+        self.scratch = AsyncScratch(scratch)
+        self.jobs = set()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.semaphore = self._call(self._make_semaphore(max_concurrency))
+
+    @staticmethod
+    async def _make_semaphore(value: int) -> asyncio.Semaphore:
+        return asyncio.Semaphore(value)
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def _run(self, fn, args: tuple) -> Dict:
+        task = asyncio.current_task()
+        self.jobs.add(task)
+        try:
+            async with self.semaphore:
+                return await fn(*args, scratch=self.scratch)
+        finally:
+            self.jobs.discard(task)
+
+    def submit(self, fn, *args) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(self._run(fn, args), self.loop)
+
+    async def _drain(self, cancel: bool):
+        # Only jobs are cancelled; the helpers that kill and reap the
+        # processes of cancelled jobs must run to completion.
+        if cancel:
+            for task in self.jobs:
+                task.cancel()
+        while True:
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            if not tasks:
+                break
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def shutdown(self, cancel: bool = False):
+        if self.loop.is_closed():
+            return
+        self._call(self._drain(cancel))
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.scratch.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown(cancel=exc_type is not None)
+
+
 @contextlib.contextmanager
 def time_limit(seconds: float):
     def signal_handler(signum, frame):
@@ -0,0 +1,101 @@
+"""
+Failure taxonomy of the simulated samples, the codes of scripts/sv-iv-analyze
+and count_failures.py. scan_log finds the code of a sample in the output of
+iverilog and vvp while the sample is evaluated, failure_code completes it
+with the result and the completion, and count_codes counts the codes of
+many samples at once.
+"""
+from typing import Dict, Iterable, List, Optional
+import re
+
+import numpy as np
+
+FAILURE_CODES = {
+    ".": "No Mismatches",
+    "S": "Syntax Error",
+    "e": "Explicit Cast Required",
+    "0": "Sized Numeric Constant Error",
+    "n": "No Sensitivities Warning",
+    "w": "Declared as Wire",
+    "m": "Unknown Module Type",
+    "p": "Unable to Bind Wire/Reg",
+    "c": "Unable to Bind Wire/Reg `clk`",
+    "T": "Timeout",
+    "r": "Async reset found",
+    "C": "Compiler error",
+    "R": "Runtime error",
+}
+
+# Diagnostics that decide the code of a sample on the first line they occur
+# in, checked in this order, as sv-iv-analyze does.
+DIAGNOSTICS = [
+    ("syntax error", "S"),
+    ("error: This assignment requires an explicit cast", "e"),
+    ("error: Sized numeric constant must have a size greater than zero", "0"),
+    ("warning: always_comb process has no sensitivities", "n"),
+    ("found no sensitivities so it will never trigger", "n"),
+    ("is declared here as wire", "w"),
+    ("Unknown module type", "m"),
+    ("Unable to bind wire/reg/memory `clk'", "c"),
+    ("TIMEOUT", "T"),
+]
+MISMATCHES = re.compile(r"^Mismatches: (\d+) in \d+ samples$")
+RESET_EDGE = re.compile(r"posedge reset|negedge reset|posedge r\)")
+
+
+def scan_log(log: str) -> Optional[str]:
+    """
+    The code of a sample whose iverilog and vvp output is log, or None if
+    the output does not decide it and the sample failed at runtime.
+    """
+    error = unbound = no_mismatches = False
+    for line in log.splitlines():
+        for diagnostic, code in DIAGNOSTICS:
+            if diagnostic in line:
+                return code
+        if "error" in line:
+            error = True
+        if "Unable to bind wire/reg" in line:
+            unbound = True
+        match = MISMATCHES.match(line)
+        if match and int(match.group(1)) == 0:
+            no_mismatches = True
+    if unbound:
+        return "p"
+    if error:
+        return "C"
+    if no_mismatches:
+        return "."
+    return None
+
+
+def failure_code(result: str, log_code: Optional[str], completion: str) -> Optional[str]:
+    """
+    The code of a sample from its result, the scan_log code of its output
+    and its completion. Samples that time out or stall are "T"; runtime
+    failures are "r" if the completion has an asynchronous reset, a common
+    cause of mismatches, and "R" otherwise. Cancelled samples, and samples
+    compiled but not yet simulated, have no code.
+    """
+    if result in ("timed out", "stalled"):
+        return "T"
+    if result in ("cancelled", "compiled"):
+        return None
+    if log_code is not None:
+        return log_code
+    return "r" if RESET_EDGE.search(completion) else "R"
+
+
+def count_codes(codes: Iterable[Optional[str]]) -> Dict[str, int]:
+    """Number of samples of every code in codes; samples without a code are left out."""
+    codes = np.asarray([code for code in codes if code is not None], dtype=object)
+    if codes.size == 0:
+        return {}
+    values, counts = np.unique(codes.astype(str), return_counts=True)
+    return dict(zip(values.tolist(), counts.tolist()))
+
+
+def report_order(codes: Iterable[str]) -> List[str]:
+    """codes in the order count_failures.py reports them: ".", the other codes sorted, then r, R and T."""
+    late = ["r", "R", "T"]
+    return ["."] + sorted(set(codes) - {"."} - set(late)) + late
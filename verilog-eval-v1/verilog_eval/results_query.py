@@ -0,0 +1,72 @@
+import fire
+import json
+import os
+import sys
+
+from verilog_eval.results_store import ResultStore
+
+
+def _split(value) -> list:
+    """Values of a comma-separated option, which fire may already have parsed into a tuple."""
+    if isinstance(value, (tuple, list)):
+        return [str(item) for item in value]
+    return [item for item in str(value).split(",") if item]
+
+
+def ingest(db: str, *paths: str, force: bool = False, benchmark: str = None, model: str = None,
+           mode: str = None, temperature: float = None):
+    """
+    Ingests results files, and every results file below directories, into
+    the store db. Files that did not change since they were last ingested
+    are skipped unless force is set. benchmark, model, mode and temperature
+    override what the paths tell.
+    """
+    metadata = dict(benchmark=benchmark, model=model, mode=mode, temperature=temperature)
+    with ResultStore(db) as store:
+        for path in paths:
+            if os.path.isdir(path):
+                ingested = store.ingest_tree(path, force)
+            else:
+                ingested = {path: store.ingest(path, force, **metadata)}
+            for name, n in ingested.items():
+                print(f"{name}: {n} samples" if n else f"{name}: unchanged")
+
+
+def query(db: str, report: str = "pass@k", k: str = "1", group_by: str = "benchmark,model",
+          benchmark: str = None, model: str = None, mode: str = None, temperature: float = None,
+          output_file: str = None):
+    """
+    Prints one row per group of runs of the store db: report "pass@k"
+    (for every k in the comma-separated k), "failures", "codes" (the
+    failure codes of count_failures.py) or "timings",
+    grouped by the comma-separated run fields group_by, of the runs that
+    match benchmark, model, mode and temperature. Rows are written as JSON
+    lines to output_file if given.
+    """
+    filters = dict(benchmark=benchmark, model=model, mode=mode, temperature=temperature)
+    group_by = _split(group_by)
+    with ResultStore(db) as store:
+        if report == "pass@k":
+            ks = [int(value) for value in _split(k)]
+            rows = store.pass_at_k(ks, group_by, **filters)
+        elif report == "failures":
+            rows = store.failures(group_by, **filters)
+        elif report == "codes":
+            rows = store.failures(group_by, codes=True, **filters)
+        elif report == "timings":
+            rows = store.timings(group_by, **filters)
+        else:
+            raise ValueError(f"Unknown report {report!r}, expected 'pass@k', 'failures', 'codes' or 'timings'.")
+    for row in rows:
+        print(json.dumps(row))
+    if output_file is not None:
+        with open(output_file, "w") as fp:
+            for row in rows:
+                fp.write(json.dumps(row) + "\n")
+
+
+def main():
+    fire.Fire(dict(ingest=ingest, query=query))
+
+
+sys.exit(main())
@@ -0,0 +1,33 @@
+import fire
+import json
+import sys
+
+from verilog_eval.data import stream_jsonl
+from verilog_eval.usage import format_report, summarize_usage
+
+
+def entry_point(
+    results_file: str,
+    top: int = 10,
+    output_file: str = None,
+    n_workers: int = 1,
+):
+    """
+    Prints the resource usage per stage and the top slowest tasks and
+    samples of a results file written by evaluate_functional_correctness,
+    and optionally writes the full summary as JSON to output_file. Large
+    results files are decoded by n_workers processes.
+    """
+    rows = stream_jsonl(results_file, n_workers, keys=("task_id", "completion_id", "result", "usage", "summary"))
+    usage = summarize_usage(rows, top)
+    if output_file is not None:
+        with open(output_file, "w") as fp:
+            json.dump(usage, fp, indent=1)
+    print(format_report(usage))
+
+
+def main():
+    fire.Fire(entry_point)
+
+
+sys.exit(main())
@@ -0,0 +1,78 @@
+import fire
+import sys
+from collections import defaultdict
+from concurrent.futures import as_completed
+
+import tqdm
+
+from verilog_eval.data import read_problems, stream_jsonl
+from verilog_eval.evaluation import make_executor, task_function
+from verilog_eval.execution import check_correctness, reference_completion, VERILATOR_BUILD_TIMEOUT
+from verilog_eval.simulators import select_simulators, HARNESS_CACHE_DIR
+
+
+def entry_point(
+    problem_file: str,
+    sample_file: str = None,
+    n_workers: int = 4,
+    timeout: float = 120.0,
+    harness_dir: str = HARNESS_CACHE_DIR,
+    unit_test: bool = False,
+    build_timeout: float = VERILATOR_BUILD_TIMEOUT,
+):
+    """
+    Parity test of the Verilator backend: simulates the reference of every
+    task of problem_file, and every sample of sample_file if given, with
+    Icarus Verilog and with Verilator, and reports every sample whose
+    results differ, i.e. whose mismatch summaries disagree. Exits with
+    status 1 if any does. build_timeout limits the Verilator build of each
+    sample, on top of timeout.
+    """
+    problems = read_problems(problem_file)
+    unit_test_length = 100 if unit_test else None
+    simulators = select_simulators(problems, "verilator", cache_dir=harness_dir,
+                                   unit_test_length=unit_test_length, n_workers=n_workers,
+                                   build_timeout=build_timeout)
+    missing = [task_id for task_id, spec in simulators.items() if spec is None]
+    if len(missing) == len(problems):
+        sys.exit("No task can be simulated with Verilator.")
+
+    checks = [(task_id, "reference", reference_completion(problem)) for task_id, problem in problems.items()]
+    if sample_file is not None:
+        completion_id = defaultdict(int)
+        for sample in stream_jsonl(sample_file):
+            checks.append((sample["task_id"], completion_id[sample["task_id"]], sample["completion"]))
+            completion_id[sample["task_id"]] += 1
+    checks = [check for check in checks if simulators[check[0]] is not None]
+
+    results = defaultdict(dict)
+    check = task_function(check_correctness, "process", problems)
+    with make_executor("process", n_workers, problems=problems) as executor:
+        futures = {}
+        for index, (task_id, _, completion) in enumerate(checks):
+            for name, spec in (("icarus", None), ("verilator", simulators[task_id])):
+                future = executor.submit(check, task_id, completion, timeout, index,
+                                         unit_test_length, None, None, None, spec)
+                futures[future] = name
+        for future in tqdm.tqdm(as_completed(futures), total=len(futures)):
+            result = future.result()
+            results[result["completion_id"]][futures[future]] = result["result"]
+
+    differ = 0
+    for index, (task_id, sample, _) in enumerate(checks):
+        icarus, verilator = results[index]["icarus"], results[index]["verilator"]
+        if icarus != verilator:
+            differ += 1
+            print(f"{task_id}/{sample}: icarus {icarus!r}, verilator {verilator!r}")
+    print(f"{len(checks) - differ}/{len(checks)} samples of {len(problems) - len(missing)} tasks agree.")
+    if missing:
+        print(f"Verilator cannot build the reference of {len(missing)} tasks: {', '.join(missing)}")
+    if differ or missing:
+        sys.exit(1)
+
+
+def main():
+    fire.Fire(entry_point)
+
+
+sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+Extraction of the Verilog code from model outputs: the last ```verilog block
+after the last "## Code Implementation" marker, without comments and blank
+lines, split into the module header and the rest.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+import multiprocessing
+import os
+import re
+
+
+SECTION_MARKER = "## Code Implementation"
+CODE_BLOCK = re.compile(r"```verilog\s*(.*?)```", re.DOTALL)
+# One token per match: a string literal (kept), a block comment or a line
+# comment (both dropped). Because strings are matched as a whole, comment
+# markers inside them, such as "http://...", are left alone.
+TOKEN = re.compile(r'"(?:[^"\\\n]|\\.)*"|/\*.*?\*/|//[^\n]*', re.DOTALL)
+
+
+def _keep_strings(match):
+    token = match.group()
+    return token if token[0] == '"' else ""
+
+
+def extract_code(text: str) -> Tuple[str, str, str]:
+    """
+    Returns (code, header, body) of a model output. code is the extracted
+    Verilog without comments and blank lines, header runs up to the first
+    line ending in ");" after the first line starting with "module", and
+    body is the rest.
+    """
+    marker = text.rfind(SECTION_MARKER)
+    if marker >= 0:
+        text = text[marker + len(SECTION_MARKER):]
+    code = None
+    for code in CODE_BLOCK.findall(text):
+        pass
+    if code is None:
+        code = text
+
+    lines = [line.rstrip() for line in TOKEN.sub(_keep_strings, code).splitlines() if line.strip()]
+
+    split = len(lines)
+    in_module = False
+    for i, line in enumerate(lines):
+        stripped = line.lstrip()
+        if not in_module and stripped.startswith("module"):
+            in_module = True
+        if in_module and stripped.endswith(");"):
+            split = i + 1
+            break
+    return "\n".join(lines), "\n".join(lines[:split]), "\n".join(lines[split:])
+
+
+def code_results(text: str, extracted: Optional[Tuple[str, str, str]] = None) -> Dict[str, str]:
+    """
+    The code results of one model output, as written to the sample files.
+    The body is all of the code if nothing follows the header.
+    """
+    code, header, body = extracted or extract_code(text)
+    return {
+        'full_code': code,
+        'code_header': header,
+        'code_body': body if body else code,
+        'direct_output': text
+    }
+
+
+def code_results_batch(texts: Sequence[str], n_workers: Optional[int] = None, min_parallel: int = 4096,
+                       chunksize: int = 512, mp_context: str = "forkserver") -> List[Dict[str, str]]:
+    """
+    code_results of every text. Batches of at least min_parallel texts are
+    extracted by a pool of n_workers processes (all cores by default), which
+    only send back the extracted parts. The pool is started with the
+    mp_context start method; the default, "forkserver", keeps the workers
+    from being forked off a process that has initialized CUDA or the
+    threads of an inference engine.
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    if len(texts) < min_parallel or n_workers == 1:
+        return [code_results(text) for text in texts]
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context(mp_context)) as executor:
+        return [code_results(text, extracted)
+                for text, extracted in zip(texts, executor.map(extract_code, texts, chunksize=chunksize))]